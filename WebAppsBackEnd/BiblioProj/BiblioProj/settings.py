@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -85,7 +86,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'api.authentication.TokenUserJSONWebTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
@@ -96,22 +97,139 @@ JWT_AUTH = {
     'JWT_EXPIRATION_DELTA': datetime.timedelta(seconds=604800),
     'JWT_RESPONSE_PAYLOAD_HANDLER':
         'api.jwt.jwt_response_payload_handler',
+    'JWT_PAYLOAD_HANDLER':
+        'api.jwt.jwt_payload_handler',
 
 }
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+#
+# Each worker process has its own cache unless CACHE_REDIS_URL is set, in
+# which case all of them share one on that Redis server (api/redis_cache.py).
+# A stand-in client such as fakeredis.FakeStrictRedis can be given in
+# CACHE_REDIS_CLIENT_CLASS.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.environ.get('CACHE_REDIS_URL') and 'test' not in sys.argv:
+    CACHES['default'] = {
+        'BACKEND': 'api.redis_cache.RedisCache',
+        'LOCATION': os.environ['CACHE_REDIS_URL'],
+        'KEY_PREFIX': 'biblio',
+        'OPTIONS': {},
+    }
+    if os.environ.get('CACHE_REDIS_CLIENT_CLASS'):
+        CACHES['default']['OPTIONS']['CLIENT_CLASS'] = os.environ['CACHE_REDIS_CLIENT_CLASS']
+
+# Server push of answer, vote and comment updates, see api/events.py.
+# Events only reach the streams of the worker process they happen in unless
+# EVENTS_REDIS_URL is set, in which case they are fanned out to every worker
+# over that Redis server. Set it when running more than one worker, as with
+# WEB_CONCURRENCY above 1. A stand-in client such as fakeredis.FakeStrictRedis
+# can be given in EVENTS_REDIS_CLIENT_CLASS.
+#
+# Every open stream holds a worker thread, so run gunicorn with threaded
+# workers, as the Procfile does, with MAX_STREAMS well under the threads,
+# leaving the rest to serve requests.
+EVENTS = {
+    'BROKER': 'api.events.LocalBroker',
+    'OPTIONS': {},
+    'HEARTBEAT': 15,
+    'STREAM_TIMEOUT': 300,
+    'TOKEN_LIFETIME': 60,
+    'MAX_STREAMS': 16,
+}
+
+if os.environ.get('EVENTS_REDIS_URL') and 'test' not in sys.argv:
+    EVENTS['BROKER'] = 'api.events.RedisBroker'
+    EVENTS['OPTIONS'] = {'url': os.environ['EVENTS_REDIS_URL']}
+    if os.environ.get('EVENTS_REDIS_CLIENT_CLASS'):
+        EVENTS['OPTIONS']['client_class'] = os.environ['EVENTS_REDIS_CLIENT_CLASS']
+
+# Answer and comment images are streamed by the worker unless OFFLOAD is set to
+# 'x-accel-redirect' (nginx, with an internal location at INTERNAL_URL aliased
+# to the api directory) or 'x-sendfile' (Apache, lighttpd).
+RESOURCES = {
+    'OFFLOAD': None,
+    'INTERNAL_URL': '/protected/',
+    'MAX_AGE': 7 * 24 * 60 * 60,
+}
+
+# A METRICS_SAMPLE_RATE fraction of requests is timed, see api/metrics.py. The
+# timings are sent as Server-Timing headers, logged as JSON on api.metrics and
+# served to staff at /api/metrics for Prometheus.
+METRICS = {
+    'SAMPLE_RATE': float(os.environ.get('METRICS_SAMPLE_RATE', 0)),
+    'SERVER_TIMING': True,
+    'LOG': True,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.metrics': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
+#
+# Read from the environment, defaulting to the department database:
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+#   DB_CONN_MAX_AGE          seconds a connection is kept open between
+#                            requests, 0 to close it after each one.
+#   DB_HEALTH_CHECK_IDLE     seconds idle after which a kept connection is
+#                            checked before reuse (see api/db/health.py).
+#   DB_PGBOUNCER=1           when connecting through pgbouncer in transaction
+#                            pooling mode, which cannot hold server-side
+#                            cursors open across transactions.
+#   DB_POOL=1                share a pool of connections between the threads
+#                            of each process (api/db/backends/postgresql_pool),
+#                            sized by DB_POOL_MIN_CONNS and DB_POOL_MAX_CONNS.
+#                            Connections then go back to the pool after each
+#                            request instead of being kept by their thread.
+
+def env_flag(name):
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes')
+
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'g1627105_u',
-        'USER': 'g1627105_u',
-        'PASSWORD': '7WnsbnRpjr',
-        'HOST': 'db.doc.ic.ac.uk',
-        'PORT': '5432',
+        'NAME': os.environ.get('DB_NAME', 'g1627105_u'),
+        'USER': os.environ.get('DB_USER', 'g1627105_u'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', '7WnsbnRpjr'),
+        'HOST': os.environ.get('DB_HOST', 'db.doc.ic.ac.uk'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 300)),
+        'HEALTH_CHECK_IDLE': int(os.environ.get('DB_HEALTH_CHECK_IDLE', 30)),
+        'DISABLE_SERVER_SIDE_CURSORS': env_flag('DB_PGBOUNCER'),
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        },
     }
 }
 
+if env_flag('DB_POOL'):
+    DATABASES['default'].update({
+        'ENGINE': 'api.db.backends.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MIN_CONNS': int(os.environ.get('DB_POOL_MIN_CONNS', 2)),
+            'MAX_CONNS': int(os.environ.get('DB_POOL_MAX_CONNS', 10)),
+        },
+    })
+
 if 'test' in sys.argv:
     DATABASES['default'] = {
         'ENGINE': 'django.db.backends.sqlite3',
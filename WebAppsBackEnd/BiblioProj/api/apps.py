@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished, request_started
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from api.db import health
+        # Connects the receivers invalidating cached answers, updating the
+        # search index and keeping the counters of questions and papers.
+        from api import caching, counters, search  # noqa: F401
+
+        request_started.connect(health.check_idle_connections)
+        request_finished.connect(health.mark_connections_used)
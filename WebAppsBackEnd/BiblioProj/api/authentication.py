@@ -0,0 +1,87 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.utils.deprecation import CallableFalse, CallableTrue
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+
+from api import events
+
+_STREAM_TOKEN_SALT = 'api.authentication.StreamTokenAuthentication'
+
+
+# The user of a read request, built from the claims of its token instead of
+# loaded from auth_user. Has the attributes views and permissions use: id,
+# username and is_staff. Compares equal to the User it stands for.
+class TokenUser(AnonymousUser):
+
+    def __init__(self, id, username, is_staff):
+        self.id = self.pk = id
+        self.username = username
+        self.is_staff = is_staff
+
+    def __str__(self):
+        return self.username
+
+    def __eq__(self, other):
+        return bool(getattr(other, 'is_authenticated', False)) and getattr(other, 'pk', None) == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    @property
+    def is_anonymous(self):
+        return CallableFalse
+
+    @property
+    def is_authenticated(self):
+        return CallableTrue
+
+
+# JWT authentication that only loads the user from the database on requests
+# that write, which is also where a disabled account is refused. Reads are
+# authenticated from the token's claims.
+class TokenUserJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+
+    def authenticate(self, request):
+        self.read_only = request.method in ('GET', 'HEAD', 'OPTIONS')
+        return super(TokenUserJSONWebTokenAuthentication, self).authenticate(request)
+
+    def authenticate_credentials(self, payload):
+        # Tokens issued before is_staff was added to them need the database.
+        if not self.read_only or 'is_staff' not in payload:
+            return super(TokenUserJSONWebTokenAuthentication, self).authenticate_credentials(payload)
+
+        user_id = payload.get('user_id')
+        username = payload.get('username')
+        if user_id is None or not username:
+            raise exceptions.AuthenticationFailed('Invalid payload.')
+
+        return TokenUser(user_id, username, bool(payload['is_staff']))
+
+
+# EventSource cannot set an Authorization header, so event streams are opened
+# with a ?token= query parameter instead. As URLs end up in access logs, this
+# is not the JWT but a stream token of make_stream_token(): signed apart from
+# JWTs, so neither is accepted in place of the other, and only valid for
+# EVENTS['TOKEN_LIFETIME'] seconds. Only use this on streaming views.
+class StreamTokenAuthentication(BaseAuthentication):
+
+    def authenticate(self, request):
+        token = request.query_params.get('token')
+        if token is None:
+            return None
+
+        try:
+            claims = signing.loads(token, salt=_STREAM_TOKEN_SALT, max_age=events.get_setting('TOKEN_LIFETIME'))
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Stream token has expired.')
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed('Invalid stream token.')
+
+        return TokenUser(claims['user_id'], claims['username'], claims['is_staff']), token
+
+
+def make_stream_token(user):
+    return signing.dumps({'user_id': user.id, 'username': user.username, 'is_staff': bool(user.is_staff)},
+                         salt=_STREAM_TOKEN_SALT)
@@ -0,0 +1,339 @@
+import base64
+import hashlib
+import json
+import math
+import random
+import time
+from collections import namedtuple
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework_jwt.settings import api_settings as jwt_settings
+
+from api import counters, search
+from api.models import Paper, PaperTitle, Question, Answer, Vote, Comment, AnswerChange, derive_from_html
+from api.renderers import FastJSONRenderer
+from api.serializers import AnswerSerializer, CommentSerializer, can_vote_context, \
+    ANSWER_PROJECTION, COMMENT_PROJECTION
+
+# Benchmarks of the API's hot paths. A dataset of a given shape is generated
+# from a seed, so runs on different commits see the same data, then each
+# scenario sends its request through the full Django stack with a test client
+# and records the latency, queries and bytes of every response.
+
+# Shape of a generated dataset: papers x questions per paper x answers per
+# question, with up to votes votes and comments comments on each answer.
+DatasetSpec = namedtuple('DatasetSpec', 'papers questions answers votes comments pdf_kb seed')
+
+DEFAULT_SPEC = DatasetSpec(papers=10, questions=10, answers=20, votes=5, comments=5, pdf_kb=256, seed=0)
+
+_WORDS = ('proof', 'lemma', 'induction', 'base', 'case', 'hence', 'assume', 'therefore', 'set', 'function',
+          'invariant', 'loop', 'terminates', 'complexity', 'bound', 'graph', 'node', 'edge', 'tree', 'list')
+
+_BATCH_SIZE = 500
+
+
+# The ids of the rows a benchmark requests.
+Dataset = namedtuple('Dataset', 'user paper question answer')
+
+
+def bulk_create_ids(model, objs):
+    # SQLite does not return the ids of a bulk insert, so read them back.
+    before = model.objects.aggregate(id=Max('id'))['id'] or 0
+    model.objects.bulk_create(objs, batch_size=_BATCH_SIZE)
+    return list(model.objects.filter(id__gt=before).order_by('id').values_list('id', flat=True))
+
+
+def html(rng, words):
+    return '<p>' + ' '.join(rng.choice(_WORDS) for _ in range(words)) + '</p>'
+
+
+def pdf(rng, kb):
+    return b'%PDF-1.4\n' + bytes(rng.getrandbits(8) for _ in range(kb * 1024))
+
+
+# Fills the database with a dataset of the shape of spec, and returns the
+# user, paper, question and answer with the most data under them, to
+# benchmark against.
+def generate_dataset(spec):
+    rng = random.Random(spec.seed)
+    password = make_password(None)
+
+    user_ids = bulk_create_ids(User, [
+        User(username='bench_' + str(spec.seed) + '_' + str(i), password=password)
+        for i in range(max(spec.votes, 1) + 1)
+    ])
+
+    title_ids = bulk_create_ids(PaperTitle, [PaperTitle(title='Course ' + str(i)) for i in range(spec.papers)])
+    papers = []
+    for i, title_id in enumerate(title_ids):
+        content = pdf(rng, spec.pdf_kb)
+        papers.append(Paper(course='B' + str(i % 1000).zfill(3), year=2000 - i // 1000, title_id=title_id,
+                            pdf=content, pdf_size=len(content), pdf_sha1=hashlib.sha1(content).hexdigest()))
+    paper_ids = bulk_create_ids(Paper, papers)
+
+    question_ids = bulk_create_ids(Question, [
+        Question(paper_id=paper_id, number=str(i + 1))
+        for paper_id in paper_ids for i in range(spec.questions)
+    ])
+
+    answers = []
+    for question_id in question_ids:
+        for i in range(spec.answers):
+            answers.append(Answer(question_id=question_id, user_id=rng.choice(user_ids),
+                                  votes=rng.randint(0, spec.votes), html=html(rng, rng.randint(50, 300))))
+    # Bulk inserts skip save(), which keeps the fields derived from html.
+    for answer in answers:
+        derive_from_html(answer)
+    answer_ids = bulk_create_ids(Answer, answers)
+
+    votes = []
+    for answer_id, answer in zip(answer_ids, answers):
+        voters = [user_id for user_id in user_ids if user_id != answer.user_id]
+        votes.extend(Vote(answer_id=answer_id, user_id=user_id) for user_id in rng.sample(voters, answer.votes))
+    Vote.objects.bulk_create(votes, batch_size=_BATCH_SIZE)
+
+    AnswerChange.objects.bulk_create([
+        AnswerChange(question_id=answer.question_id, answer_id=answer_id, action=AnswerChange.CREATED)
+        for answer_id, answer in zip(answer_ids, answers)
+    ], batch_size=_BATCH_SIZE)
+
+    # Threads of comments one reply deep, so the comment tree has children.
+    top_level = []
+    for answer_id in answer_ids:
+        for i in range(rng.randint(0, spec.comments)):
+            top_level.append(Comment(answer_id=answer_id, user_id=rng.choice(user_ids), html=html(rng, 20)))
+    for comment in top_level:
+        derive_from_html(comment)
+    top_level_ids = bulk_create_ids(Comment, top_level)
+
+    replies = []
+    for parent_id, parent in zip(top_level_ids, top_level):
+        if rng.random() < 0.5:
+            replies.append(Comment(answer_id=parent.answer_id, parent_id=parent_id,
+                                   user_id=rng.choice(user_ids), html=html(rng, 20)))
+    for comment in replies:
+        derive_from_html(comment)
+    Comment.objects.bulk_create(replies, batch_size=_BATCH_SIZE)
+
+    # Bulk inserts send no signals, so index and count the dataset in one go.
+    search.rebuild()
+    counters.repair()
+
+    # Every question has as many answers, so take the first.
+    question_id = question_ids[0]
+    answer_id = Answer.objects.filter(question_id=question_id).annotate(comments=Count('comment')) \
+        .order_by('-comments', 'id').values_list('id', flat=True).first()
+    paper = Paper.objects.filter(question__id=question_id).values('id', 'course', 'year').get()
+
+    return Dataset(user=User.objects.get(pk=user_ids[0]), paper=paper, question=question_id, answer=answer_id)
+
+
+# A client sending the JWT of user with every request, as the frontend does.
+def client_for(user):
+    token = jwt_settings.JWT_ENCODE_HANDLER(jwt_settings.JWT_PAYLOAD_HANDLER(user))
+    return Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION='JWT ' + token)
+
+
+# Each scenario takes the client and dataset and returns a function making
+# its i-th request, which returns the response.
+def available_papers(client, dataset):
+    return lambda i: client.get('/api/available-papers')
+
+
+def answers_poll(client, dataset):
+    url = '/api/' + str(dataset.question) + '/answer'
+    return lambda i: client.get(url)
+
+
+def answers_summary(client, dataset):
+    url = '/api/' + str(dataset.question) + '/answer'
+    return lambda i: client.get(url, {'view': 'summary'})
+
+
+def answers_revalidate(client, dataset):
+    url = '/api/' + str(dataset.question) + '/answer'
+    etag = client.get(url)['ETag']
+    return lambda i: client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+
+def answer_changes(client, dataset):
+    url = '/api/' + str(dataset.question) + '/answer/changes'
+    cursor = client.get(url).json()['cursor']
+    return lambda i: client.get(url, {'since': cursor})
+
+
+def vote(client, dataset):
+    answer_id = Answer.objects.filter(question_id=dataset.question).exclude(user=dataset.user) \
+        .exclude(vote__user=dataset.user).values_list('id', flat=True).first()
+    urls = ['/api/upvote/' + str(answer_id), '/api/downvote/' + str(answer_id)]
+    return lambda i: client.post(urls[i % 2])
+
+
+def comments(client, dataset):
+    url = '/api/' + str(dataset.answer) + '/comment'
+    return lambda i: client.get(url)
+
+
+def comment_tree(client, dataset):
+    url = '/api/' + str(dataset.answer) + '/comment/tree'
+    return lambda i: client.get(url)
+
+
+def paper_upload(client, dataset):
+    content = base64.b64encode(pdf(random.Random(0), 64)).decode('ascii')
+    # Each upload is a new paper of its own course.
+    start = Paper.objects.filter(course__startswith='U').count()
+
+    def upload(i):
+        n = start + i
+        data = {'course': 'U' + str(n % 1000).zfill(3), 'year': 2000 - n // 1000, 'title': 'Upload', 'pdf': content}
+        return client.post('/api/submit/paper', json.dumps(data), content_type='application/json')
+    return upload
+
+
+def pdf_download(client, dataset):
+    url = '/api/' + dataset.paper['course'] + '/' + str(dataset.paper['year']) + '/paper/pdf'
+    return lambda i: client.get(url)
+
+
+SCENARIOS = [
+    ('available_papers', available_papers),
+    ('answers_poll', answers_poll),
+    ('answers_summary', answers_summary),
+    ('answers_revalidate', answers_revalidate),
+    ('answer_changes', answer_changes),
+    ('vote', vote),
+    ('comments', comments),
+    ('comment_tree', comment_tree),
+    ('paper_upload', paper_upload),
+    ('pdf_download', pdf_download),
+]
+
+
+def content_length(response):
+    if response.streaming:
+        length = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+        return length
+    return len(response.content)
+
+
+# Makes requests requests of the scenario after warmup unmeasured ones, and
+# returns the statistics of their latencies (in milliseconds), queries and
+# response sizes.
+def run_scenario(scenario, client, dataset, requests, warmup):
+    request = scenario(client, dataset)
+    latencies = []
+    queries = []
+    sizes = []
+
+    for i in range(warmup + requests):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = request(i)
+            size = content_length(response)
+            elapsed = time.perf_counter() - start
+
+        if response.status_code >= 400:
+            raise RuntimeError("Request " + str(i) + " of " + scenario.__name__ + " returned " +
+                               str(response.status_code) + ": " + str(response.content[:200]))
+
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+            sizes.append(size)
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / len(latencies),
+        'queries': max(queries),
+        'bytes': int(sum(sizes) / len(sizes)),
+    }
+
+
+# Serializes and renders the answers of the dataset's question and the
+# comments of its answer, as the read views did with the DRF serializers and
+# as they do with projections, repeat times each. Returns the rows, median
+# milliseconds of each way, queries included, and speedup of each list,
+# raising RuntimeError if the two differ by a byte.
+def compare_serializers(dataset, repeat):
+    answers = Answer.objects.filter(question_id=dataset.question).order_by('id')
+    comments = Comment.objects.filter(answer_id=dataset.answer).order_by('id')
+
+    def answers_serializer():
+        context = can_vote_context(dataset.user.id, Vote.objects.filter(answer__question_id=dataset.question))
+        return JSONRenderer().render(AnswerSerializer(answers.select_related('user'), many=True,
+                                                      context=context).data)
+
+    def answers_projection():
+        context = can_vote_context(dataset.user.id, Vote.objects.filter(answer__question_id=dataset.question))
+        fields = ANSWER_PROJECTION.full
+        return FastJSONRenderer().render(ANSWER_PROJECTION.serialize(ANSWER_PROJECTION.values(answers, fields),
+                                                                     fields, context))
+
+    def comments_serializer():
+        return JSONRenderer().render(CommentSerializer(comments.select_related('user'), many=True).data)
+
+    def comments_projection():
+        fields = COMMENT_PROJECTION.full
+        return FastJSONRenderer().render(COMMENT_PROJECTION.serialize(COMMENT_PROJECTION.values(comments, fields),
+                                                                      fields))
+
+    results = {}
+    for name, rows, serializer, projection in [('answers', answers.count(), answers_serializer, answers_projection),
+                                               ('comments', comments.count(), comments_serializer,
+                                                comments_projection)]:
+        if serializer() != projection():
+            raise RuntimeError(name + ": projection renders different bytes than the serializer.")
+
+        timings = {}
+        for way, render in [('serializer', serializer), ('projection', projection)]:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                render()
+                times.append((time.perf_counter() - start) * 1000)
+            timings[way] = percentile(sorted(times), 50)
+
+        results[name] = {
+            'rows': rows,
+            'serializer_ms': timings['serializer'],
+            'projection_ms': timings['projection'],
+            'speedup': timings['serializer'] / timings['projection'],
+        }
+
+    return results
+
+
+# Nearest-rank percentile of sorted values.
+def percentile(values, p):
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+# Compares results against baseline, both as returned by run_scenario() per
+# scenario name. Returns a message per regression: a p95 more than tolerance
+# (a fraction) slower, or more queries per request than before.
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append("%s: p95 %.2f ms, was %.2f ms" % (name, result['p95_ms'], before['p95_ms']))
+        if result['queries'] > before['queries']:
+            regressions.append("%s: %d queries per request, was %d" % (name, result['queries'], before['queries']))
+
+    return regressions
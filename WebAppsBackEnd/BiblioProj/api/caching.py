@@ -0,0 +1,159 @@
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from rest_framework.fields import DateTimeField
+
+from api.models import Paper, Answer, AnswerChange
+from api.renderers import FastJSONRenderer
+from api.serializers import AnswerSerializer, ANSWER_PROJECTION
+
+# The course -> {Name, Years, paper_id, Activity} index of available papers
+# is cached in two parts, each under its own version, read together from the
+# database with one aggregate of the papers table. The courses, names and
+# years change only with the papers, while the activity counters of the
+# papers change with every answer and comment, so they are cached apart and
+# the index is put together for each request. Clients revalidate with both
+# versions as an ETag.
+#
+# The answers of each question are cached rendered to JSON bytes under their
+# version in the database, the latest change of the question's answers in the
+# change feed.
+#
+# Every process reads the same versions, so none serves data older than the
+# ETag it sends, whether or not the cache is shared between them.
+
+_AVAILABLE_PAPERS_KEY = 'available-papers:'
+_ACTIVITY_KEY = 'available-papers:activity:'
+
+_ANSWERS_KEY = 'answers:{}:{}'
+
+# Entries of older versions are left to expire.
+_TIMEOUT = 24 * 60 * 60
+
+_DATE_TIME_FIELD = DateTimeField()
+
+_CAN_VOTE = b'"can_vote":'
+_CAN_VOTE_PLACEHOLDER = _CAN_VOTE + str(AnswerSerializer.NOT_APPLICABLE).encode('ascii')
+_CAN_VOTE_VALUES = {
+    True: str(AnswerSerializer.CANT_VOTE).encode('ascii'),
+    False: str(AnswerSerializer.CAN_VOTE).encode('ascii'),
+}
+
+
+# Returns (version of the papers, version of their activity). A created
+# paper raises the count and the latest id, a deleted one lowers the count.
+# Any answer or comment created raises the latest activity, and any deleted
+# lowers a total.
+def available_papers_version():
+    latest = Paper.objects.aggregate(count=Count('id'), id=Max('id'), answers=Sum('answer_count'),
+                                     comments=Sum('comment_count'), last_activity=Max('last_activity'))
+    last_activity = latest['last_activity']
+    return make_version(latest['count'], latest['id']), make_version(
+        latest['answers'], latest['comments'], None if last_activity is None else last_activity.timestamp())
+
+
+def make_version(*parts):
+    return '-'.join(str(part) for part in parts)
+
+
+# Returns the index at version, building the parts that are not cached. If
+# papers changed since version was read, a part built is newer than version,
+# which is harmless as the next request sees the new version.
+def get_available_papers(version):
+    papers_version, activity_version = version
+    course_year_mappings = get_or_build(_AVAILABLE_PAPERS_KEY + papers_version, build_available_papers)
+    # Keyed on both, so a paper created or deleted rebuilds it.
+    activity = get_or_build(_ACTIVITY_KEY + papers_version + ':' + activity_version, build_activity)
+
+    return dict(
+        (course, dict(course_data, Activity=[activity.get(paper_id) or no_activity(paper_id)
+                                             for paper_id in course_data["Activity"]]))
+        for course, course_data in course_year_mappings.items()
+    )
+
+
+def get_or_build(key, build):
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout=_TIMEOUT)
+    return value
+
+
+# Activity holds the id of the paper of each of Years, in the same order,
+# for get_available_papers() to replace with its counters.
+def build_available_papers():
+    course_year_mappings = {}
+    papers = Paper.objects.order_by('id').values_list('id', 'course', 'year', 'title__title')
+
+    for paper_id, course, year, title in papers:
+        course_data = course_year_mappings.setdefault(str(course), {
+            "Years": [],
+            "Name": title,
+            "paper_id": paper_id,
+            "Activity": [],
+        })
+        course_data["Years"].append(year)
+        course_data["Activity"].append(paper_id)
+
+    return course_year_mappings
+
+
+# The counters of every paper by id, read from the papers table alone.
+def build_activity():
+    papers = Paper.objects.values_list('id', 'answer_count', 'comment_count', 'last_activity')
+    return dict((paper_id, {
+        "paper_id": paper_id,
+        "answer_count": answer_count,
+        "comment_count": comment_count,
+        "last_activity": _DATE_TIME_FIELD.to_representation(last_activity),
+    }) for paper_id, answer_count, comment_count, last_activity in papers)
+
+
+# The counters of a paper created after the activity was read.
+def no_activity(paper_id):
+    return {"paper_id": paper_id, "answer_count": 0, "comment_count": 0, "last_activity": None}
+
+
+# Returns (version, timestamp) of the latest change of the answers of the
+# question. Every create, edit, vote and delete of an answer through the API
+# is recorded in the change feed, see AnswerChange.
+def answers_version(question_id):
+    latest = AnswerChange.objects.filter(question_id=question_id) \
+        .aggregate(id=Max('id'), timestamp=Max('timestamp'))
+    return latest['id'], latest['timestamp']
+
+
+# Returns the answers of the question at version, of answers_version(), as
+# JSON, exactly as AnswerSerializer and the JSON renderer would with
+# can_vote_context(). Only can_vote differs between users, so the rest of
+# each answer is cached rendered, split around can_vote, and the user's
+# values are spliced in.
+def get_answers_json(question_id, version, voted_answer_ids):
+    key = _ANSWERS_KEY.format(question_id, version)
+    rendered = cache.get(key)
+
+    if rendered is None:
+        rendered = render_answers(question_id)
+        cache.set(key, rendered, timeout=_TIMEOUT)
+
+    return b'[' + b','.join(
+            head + _CAN_VOTE_VALUES[answer_id in voted_answer_ids] + tail
+            for answer_id, head, tail in rendered
+    ) + b']'
+
+
+# Renders each answer of the question without a user, as (id, JSON before
+# the can_vote value, JSON after it).
+def render_answers(question_id):
+    fields = ANSWER_PROJECTION.full
+    answers = ANSWER_PROJECTION.values(Answer.objects.filter(question_id=question_id), fields)
+    renderer = FastJSONRenderer()
+    rendered = []
+
+    for answer in ANSWER_PROJECTION.serialize(answers, fields):
+        # can_vote is rendered after html, so the last match is the field
+        # itself and not text inside the answer.
+        head, _, tail = renderer.render(answer).rpartition(_CAN_VOTE_PLACEHOLDER)
+        rendered.append((answer['id'], head + _CAN_VOTE, tail))
+
+    return rendered
@@ -0,0 +1,51 @@
+import calendar
+import functools
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Conditional GET for read views. A view's get_version() derives a cheap
+# version of the resource it would return, from an aggregate or a cache, and
+# @conditional answers If-None-Match/If-Modified-Since with 304 from that
+# alone, before any body is built or serialized.
+
+
+# Strong ETag from the parts that together identify a version of a resource.
+def make_etag(*parts):
+    return '"' + '-'.join('' if part is None else str(part) for part in parts) + '"'
+
+
+# Decorates the get() of a view with a get_version(request, *args, **kwargs)
+# method returning (etag, last_modified), where last_modified is an aware
+# datetime or None, or returning None if the resource does not exist.
+def conditional(get):
+
+    @functools.wraps(get)
+    def conditional_get(view, request, *args, **kwargs):
+        version = view.get_version(request, *args, **kwargs)
+        if version is None:
+            return get(view, request, *args, **kwargs)
+
+        etag, last_modified = version
+        last_modified = None if last_modified is None else calendar.timegm(last_modified.utctimetuple())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+        response = get(view, request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+
+    return conditional_get
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Unless the view says otherwise, every response is per user and should be
+    # revalidated on each use, which costs a 304 unless it has changed.
+    if not response.has_header('Cache-Control'):
+        response['Cache-Control'] = 'private, no-cache'
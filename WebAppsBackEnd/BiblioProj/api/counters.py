@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import Count, DateTimeField, F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.models import Paper, Question, Answer, Comment
+
+# Counters of the answers and comments under each question and paper, and
+# when the latest of them was posted. The receivers below update them in the
+# transaction creating or deleting the answer or comment: Answer.save() and
+# Comment.save() are atomic, and Django deletes a row and its cascade in one
+# transaction. Each is an UPDATE of the counter relative to its value, so
+# concurrent writes do not lose counts.
+#
+# Deletes leave last_activity as it was. repair() recomputes every counter
+# from the rows, for data written without the receivers, such as by bulk
+# inserts, or to fix any drift.
+
+
+def update(questions, papers, field, delta, timestamp=None):
+    updates = {field: F(field) + delta}
+    if timestamp is not None:
+        timestamp = Value(timestamp, output_field=DateTimeField())
+        updates['last_activity'] = Greatest(Coalesce(F('last_activity'), timestamp), timestamp)
+
+    questions.update(**updates)
+    papers.update(**updates)
+
+
+@receiver(post_save, sender=Answer)
+def answer_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update(Question.objects.filter(pk=instance.question_id),
+               Paper.objects.filter(question__id=instance.question_id),
+               'answer_count', 1, instance.timestamp)
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted(sender, instance, **kwargs):
+    update(Question.objects.filter(pk=instance.question_id),
+           Paper.objects.filter(question__id=instance.question_id),
+           'answer_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update(Question.objects.filter(answer__id=instance.answer_id),
+               Paper.objects.filter(question__answer__id=instance.answer_id),
+               'comment_count', 1, instance.timestamp)
+
+
+# Comments deleted with their answer are deleted before it, so it can still
+# be joined through.
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    update(Question.objects.filter(answer__id=instance.answer_id),
+           Paper.objects.filter(question__answer__id=instance.answer_id),
+           'comment_count', -1)
+
+
+# Sets every counter of every question and paper to what the rows hold, with
+# one UPDATE of each table. Returns the number of questions and papers
+# updated.
+def recompute(paper_model, question_model, answer_model, comment_model):
+    answers = answer_model.objects.filter(question=OuterRef('pk')).order_by().values('question')
+    comments = comment_model.objects.filter(answer__question=OuterRef('pk')).order_by().values('answer__question')
+    latest_answer = Subquery(answers.annotate(latest=Max('timestamp')).values('latest'),
+                             output_field=DateTimeField())
+    latest_comment = Subquery(comments.annotate(latest=Max('timestamp')).values('latest'),
+                              output_field=DateTimeField())
+
+    questions = question_model.objects.filter(paper=OuterRef('pk')).order_by().values('paper')
+
+    with transaction.atomic():
+        question_count = question_model.objects.update(
+            answer_count=Coalesce(Subquery(answers.annotate(count=Count('id')).values('count'),
+                                           output_field=IntegerField()), 0),
+            comment_count=Coalesce(Subquery(comments.annotate(count=Count('id')).values('count'),
+                                            output_field=IntegerField()), 0),
+            # Greatest() is NULL if either is on some databases.
+            last_activity=Greatest(Coalesce(latest_answer, latest_comment), Coalesce(latest_comment, latest_answer)),
+        )
+        paper_count = paper_model.objects.update(
+            answer_count=Coalesce(Subquery(questions.annotate(total=Sum('answer_count')).values('total'),
+                                           output_field=IntegerField()), 0),
+            comment_count=Coalesce(Subquery(questions.annotate(total=Sum('comment_count')).values('total'),
+                                            output_field=IntegerField()), 0),
+            last_activity=Subquery(questions.annotate(latest=Max('last_activity')).values('latest'),
+                                   output_field=DateTimeField()),
+        )
+
+    return question_count, paper_count
+
+
+def repair():
+    return recompute(Paper, Question, Answer, Comment)
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import psycopg2
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLDatabaseWrapper
+from django.db.utils import OperationalError
+from psycopg2 import pool
+
+# PostgreSQL backend drawing connections from a pool shared by the threads of
+# the process, instead of each thread opening and closing its own. Django
+# closes the connection at the end of a request as usual (CONN_MAX_AGE 0),
+# which returns it to the pool open, so a request only waits for the network
+# handshake when the pool has none idle.
+#
+# Settings, in the database's POOL dict:
+#   MIN_CONNS  connections kept open while idle (default 1).
+#   MAX_CONNS  connections open at once, busy or idle (default 10).
+#   TIMEOUT    seconds a request waits for a connection when all MAX_CONNS
+#              are busy before failing (default 10).
+# Connections idle in the pool for the database's HEALTH_CHECK_IDLE seconds
+# are checked before being handed out, as in api/db/health.py.
+
+_POOL_DEFAULTS = {
+    'MIN_CONNS': 1,
+    'MAX_CONNS': 10,
+    'TIMEOUT': 10,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool(object):
+
+    def __init__(self, min_conns, max_conns, timeout, health_check_idle, conn_params):
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+        # ThreadedConnectionPool raises as soon as it is exhausted, the
+        # semaphore makes callers queue for a connection instead.
+        self.available = threading.BoundedSemaphore(max_conns)
+        self.pool = pool.ThreadedConnectionPool(min_conns, max_conns, **conn_params)
+        self.returned_at = {}
+
+    def getconn(self):
+        if not self.available.acquire(timeout=self.timeout):
+            raise OperationalError("No database connection free after " + str(self.timeout) + " seconds.")
+
+        try:
+            connection = self.pool.getconn()
+            if not self.is_healthy(connection):
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+            return connection
+        except Exception:
+            self.available.release()
+            raise
+
+    # Takes connection back, rolling back any transaction left open. Closed
+    # or broken connections are discarded rather than handed out again.
+    def putconn(self, connection):
+        try:
+            if not connection.closed:
+                self.returned_at[id(connection)] = time.time()
+            self.pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            self.available.release()
+
+    def is_healthy(self, connection):
+        returned_at = self.returned_at.pop(id(connection), None)
+        if connection.closed:
+            return False
+        if self.health_check_idle is None or returned_at is None \
+                or time.time() - returned_at < self.health_check_idle:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def closeall(self):
+        self.pool.closeall()
+
+
+def get_pool(alias, settings_dict, conn_params):
+    with _pools_lock:
+        if alias not in _pools:
+            options = dict(_POOL_DEFAULTS, **settings_dict.get('POOL', {}))
+            _pools[alias] = ConnectionPool(options['MIN_CONNS'], options['MAX_CONNS'], options['TIMEOUT'],
+                                           settings_dict.get('HEALTH_CHECK_IDLE'), conn_params)
+        return _pools[alias]
+
+
+class DatabaseWrapper(PostgreSQLDatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        connection = get_pool(self.alias, self.settings_dict, conn_params).getconn()
+
+        # As in the PostgreSQL backend: take the isolation level from OPTIONS
+        # or the server's default, before autocommit is set.
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.alias, self.settings_dict, None).putconn(self.connection)
@@ -0,0 +1,35 @@
+import time
+
+from django.db import connections
+
+# Persistent connections (CONN_MAX_AGE) can be cut by the server, a firewall
+# or a failover while they sit idle between requests, and the first query of
+# the next request would fail on them. Before a request reuses a connection
+# that has been idle for HEALTH_CHECK_IDLE seconds or more, check it with a
+# trivial query and close it if that fails, so the request opens a new one.
+# A connection in steady use is not checked, as that would cost a round trip
+# per request.
+
+
+def check_idle_connections(**kwargs):
+    now = time.time()
+
+    for connection in connections.all():
+        idle_limit = connection.settings_dict.get('HEALTH_CHECK_IDLE')
+        if connection.connection is None or idle_limit is None:
+            continue
+
+        last_used = getattr(connection, 'last_used', None)
+        if last_used is not None and now - last_used < idle_limit:
+            continue
+
+        if not connection.is_usable():
+            connection.close()
+
+
+def mark_connections_used(**kwargs):
+    now = time.time()
+
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.last_used = now
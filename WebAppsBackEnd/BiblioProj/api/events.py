@@ -0,0 +1,309 @@
+import json
+import threading
+import time
+from queue import Queue, Empty, Full
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+# Server push of answer, vote and comment updates. Write paths publish events
+# to a broker on the channel of the question and of the paper they belong to,
+# and the Events views stream each channel to browsers as Server-Sent Events.
+#
+# The default LocalBroker only reaches subscribers in the same process, so
+# deployments running more than one worker should use the RedisBroker, which
+# settings.py picks when EVENTS_REDIS_URL is set, or any other Broker set in
+# settings.EVENTS['BROKER'], to fan events out. Browsers still poll the change
+# feed now and then while streaming, so a missed event only delays an update.
+#
+# Each open stream holds a worker thread for up to STREAM_TIMEOUT seconds, so
+# the workers must serve requests concurrently, such as gunicorn's gthread
+# workers with a thread for each stream and request served at once (see the
+# Procfile). Sync workers would serve nothing else while streaming. A process
+# opens at most MAX_STREAMS streams, fewer than its threads, and refuses more
+# with a 503, so streams never take every thread from the other requests and
+# browsers refused one poll the change feed instead.
+
+_DEFAULTS = {
+    'BROKER': 'api.events.LocalBroker',
+    'OPTIONS': {},
+    # Seconds between keep-alive comments on an idle stream.
+    'HEARTBEAT': 15,
+    # Seconds a stream is held open before the client is told to reconnect,
+    # so a worker is never tied up by one browser indefinitely.
+    'STREAM_TIMEOUT': 300,
+    # Seconds a stream token can open a stream for after it is issued, see
+    # api.authentication.StreamTokenAuthentication.
+    'TOKEN_LIFETIME': 60,
+    # Streams open at once in a process.
+    'MAX_STREAMS': 16,
+}
+
+_RECONNECT_MILLISECONDS = 3000
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+
+_broker = None
+_broker_lock = threading.Lock()
+
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'EVENTS', {}).get(name, _DEFAULTS[name])
+
+
+def question_channel(question_id):
+    return 'question:' + str(question_id)
+
+
+def paper_channel(paper_id):
+    return 'paper:' + str(paper_id)
+
+
+class Broker(object):
+
+    def publish(self, channel, message):
+        raise Exception("ERROR: publish(): Brokers should subclass Broker.")
+
+    # Returns a Subscription receiving every message published on channels
+    # from now on.
+    def subscribe(self, channels):
+        raise Exception("ERROR: subscribe(): Brokers should subclass Broker.")
+
+
+class Subscription(object):
+
+    # Returns the next message, or None if none arrives within timeout seconds.
+    def get(self, timeout):
+        raise Exception("ERROR: get(): Subscriptions should subclass Subscription.")
+
+    def close(self):
+        pass
+
+
+# In-process broker, enough for a single worker and for tests.
+class LocalBroker(Broker):
+
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._queues = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            queues = list(self._queues.get(channel, ()))
+
+        for queue in queues:
+            try:
+                queue.put_nowait(message)
+            except Full:
+                # Drop messages for a client too slow to keep up, it resyncs
+                # from the change feed when it reconnects.
+                pass
+
+    def subscribe(self, channels):
+        queue = Queue(maxsize=self.max_queued)
+        with self._lock:
+            for channel in channels:
+                self._queues.setdefault(channel, set()).add(queue)
+        return LocalSubscription(self, channels, queue)
+
+    def unsubscribe(self, channels, queue):
+        with self._lock:
+            for channel in channels:
+                queues = self._queues.get(channel, set())
+                queues.discard(queue)
+                if not queues:
+                    self._queues.pop(channel, None)
+
+
+class LocalSubscription(Subscription):
+
+    def __init__(self, broker, channels, queue):
+        self.broker = broker
+        self.channels = channels
+        self.queue = queue
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self.channels, self.queue)
+
+
+# Fans events out between workers over Redis pub/sub. OPTIONS takes the 'url'
+# of the server and optionally a 'client_class', e.g. a fakeredis stand-in.
+class RedisBroker(Broker):
+
+    def __init__(self, url='redis://localhost:6379/0', client_class=None):
+        if client_class is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured("RedisBroker requires the redis package.")
+            client_class = redis.StrictRedis
+        elif isinstance(client_class, str):
+            client_class = import_string(client_class)
+
+        self.client = client_class.from_url(url)
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message))
+
+    def subscribe(self, channels):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(*channels)
+        return RedisSubscription(pubsub)
+
+
+class RedisSubscription(Subscription):
+
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+
+            message = self.pubsub.get_message(timeout=remaining)
+            if message is not None and message['type'] == 'message':
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+                return json.loads(data)
+
+            if message is None:
+                time.sleep(min(remaining, 0.01))
+
+    def close(self):
+        self.pubsub.close()
+
+
+def get_broker():
+    global _broker
+
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(get_setting('BROKER'))
+                _broker = broker_class(**get_setting('OPTIONS'))
+
+    return _broker
+
+
+# Forgets the broker so the next get_broker() builds it from the settings.
+def reset_broker():
+    global _broker
+    _broker = None
+
+
+# Publishes event to the channels of question and of its paper. The id of an
+# answer event is the change feed cursor after it, so a client reconnecting
+# with Last-Event-ID knows where to resume polling the feed from.
+def publish(question, event, data, event_id=None):
+    data = dict(data, question=question.id)
+    message = {
+        'id': event_id,
+        'event': event,
+        'data': json.dumps(data, cls=JSONEncoder, separators=(',', ':'))
+    }
+
+    broker = get_broker()
+    broker.publish(question_channel(question.id), message)
+    broker.publish(paper_channel(question.paper_id), message)
+
+
+def publish_answer_change(answer, change, answer_data):
+    publish(answer.question, 'answer.' + change.action, {'answer': answer_data}, event_id=change.id)
+
+
+def publish_comment_change(comment, action, comment_data):
+    publish(comment.answer.question, 'comment.' + action, {'comment': comment_data})
+
+
+def format_event(message):
+    lines = []
+    if message.get('id') is not None:
+        lines.append('id: ' + str(message['id']))
+    lines.append('event: ' + message['event'])
+    lines.extend('data: ' + line for line in message['data'].splitlines())
+    return '\n'.join(lines) + '\n\n'
+
+
+# Yields subscription's messages as a text/event-stream body until the stream
+# timeout, sending keep-alive comments while idle.
+def stream(subscription, heartbeat=None, timeout=None):
+    heartbeat = get_setting('HEARTBEAT') if heartbeat is None else heartbeat
+    timeout = get_setting('STREAM_TIMEOUT') if timeout is None else timeout
+    deadline = time.time() + timeout
+
+    try:
+        yield 'retry: ' + str(_RECONNECT_MILLISECONDS) + '\n\n'
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+
+            message = subscription.get(timeout=min(heartbeat, remaining))
+            if message is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield format_event(message)
+    finally:
+        subscription.close()
+
+
+# Subscribes a new stream to channels, returning its Stream, or None if the
+# process already has MAX_STREAMS open.
+def open_stream(channels):
+    global _open_streams
+
+    with _open_streams_lock:
+        if _open_streams >= get_setting('MAX_STREAMS'):
+            return None
+        _open_streams += 1
+
+    try:
+        return Stream(get_broker().subscribe(channels))
+    except Exception:
+        release_stream()
+        raise
+
+
+def release_stream():
+    global _open_streams
+
+    with _open_streams_lock:
+        _open_streams -= 1
+
+
+# The body of an Events response. Django closes it with the response, read or
+# not, which closes the subscription and frees its place among MAX_STREAMS.
+class Stream(object):
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+        self.closed = False
+
+    def __iter__(self):
+        return stream(self.subscription)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.subscription.close()
+        release_stream()
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_jwt.utils import jwt_payload_handler as default_jwt_payload_handler
 
 
 def jwt_response_payload_handler(token, user=None, request=None):
@@ -10,7 +11,15 @@ def jwt_response_payload_handler(token, user=None, request=None):
     }
 
 
+# Tokens also carry is_staff, so that a request can be authenticated from the
+# token alone, see api.authentication.TokenUser.
+def jwt_payload_handler(user):
+    payload = default_jwt_payload_handler(user)
+    payload['is_staff'] = user.is_staff
+    return payload
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ('id', )
\ No newline at end of file
+        fields = ('id', )
@@ -0,0 +1,408 @@
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+from queue import Queue, Empty
+from urllib.parse import urlsplit, urlencode
+
+from api.benchmark import percentile
+
+# Load generator replaying the traffic of students on the solution page of a
+# paper against a running server. Each viewer is a thread with its own
+# keep-alive connection, doing what SolutionPageComponent does when it polls:
+# load the paper, its PDF and questions, open a question, poll that question's
+# answer changes every 5 seconds and refresh every question every 120 seconds.
+# With events, viewers instead hold the paper's event stream open on a second
+# connection and only refresh the question on its events, as the page does
+# where the browser supports EventSource. A few writers on the same page also
+# post answers and votes. Intervals are divided by speedup, so a run can be
+# compressed in time.
+
+POLL_SECONDS = 5
+REFRESH_DELAY_SECONDS = 20
+REFRESH_SECONDS = 120
+
+_TIMEOUT = 30
+# Longest a viewer holding a stream takes to notice it should stop.
+_STOP_SECONDS = 1
+
+_ANSWER_EVENTS = {'answer.created', 'answer.updated', 'answer.voted', 'answer.deleted'}
+# Queued by an EventStream when it has ended.
+_CLOSED = None
+
+
+# Latencies and outcomes of the requests made while a stage of the ramp runs.
+class Recorder(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+
+    def record(self, endpoint, status, seconds):
+        with self.lock:
+            self.samples.append((endpoint, status, seconds))
+
+    # Returns and forgets the samples so far.
+    def take(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+        return samples
+
+
+# A status of None is a request that failed without a response. 304 is a
+# successful revalidation.
+def is_error(status):
+    return status is None or status >= 400
+
+
+# Statistics of samples taken over seconds, in total and per endpoint.
+def summarize(samples, seconds):
+    endpoints = {}
+    for endpoint, status, elapsed in samples:
+        endpoints.setdefault(endpoint, []).append((status, elapsed))
+    endpoints['all'] = [(status, elapsed) for _, status, elapsed in samples]
+
+    summary = {}
+    for endpoint, results in endpoints.items():
+        latencies = sorted(elapsed * 1000 for _, elapsed in results)
+        errors = sum(1 for status, _ in results if is_error(status))
+        summary[endpoint] = {
+            'requests': len(results),
+            'throughput': len(results) / seconds,
+            'errors': errors,
+            'error_rate': errors / len(results) if results else 0.0,
+            'p50_ms': percentile(latencies, 50) if latencies else 0.0,
+            'p95_ms': percentile(latencies, 95) if latencies else 0.0,
+            'p99_ms': percentile(latencies, 99) if latencies else 0.0,
+        }
+    return summary
+
+
+# Returns why the stage summarized by summary saturates the server, or None if
+# it does not: its p95 latency or error rate is over the limit. Throughput is
+# not a reliable sign, as it only grows with viewers until either of these
+# does.
+def saturation(summary, max_p95_ms, max_error_rate):
+    overall = summary['all']
+    if overall['p95_ms'] > max_p95_ms:
+        return "p95 of %.0f ms is over %.0f ms" % (overall['p95_ms'], max_p95_ms)
+    if overall['error_rate'] > max_error_rate:
+        return "error rate of %.1f%% is over %.1f%%" % (overall['error_rate'] * 100, max_error_rate * 100)
+    return None
+
+
+# The first tick of a timer ticking every interval since tick that is still to
+# come.
+def next_tick(tick, interval):
+    tick += interval
+    now = time.time()
+    if tick < now:
+        tick += ((now - tick) // interval + 1) * interval
+    return tick
+
+
+# A browser's connection to the server, as one user.
+class Session(object):
+
+    def __init__(self, url, token, recorder):
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' \
+            else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.headers = {'Authorization': 'JWT ' + token, 'Accept': 'application/json'}
+        self.recorder = recorder
+        self.connection = None
+
+    # Makes a request, recording it under endpoint, and returns its status
+    # and body, or (None, None) if it failed without a response.
+    def request(self, endpoint, method, path, data=None):
+        headers = dict(self.headers)
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = self.connection_class(self.netloc, timeout=_TIMEOUT)
+            self.connection.request(method, self.prefix + path, body, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (http.client.HTTPException, OSError):
+            # Reconnect for the next request.
+            self.close()
+            status, content = None, None
+
+        self.recorder.record(endpoint, status, time.perf_counter() - start)
+        return status, content
+
+    def get_json(self, endpoint, path):
+        status, content = self.request(endpoint, 'GET', path)
+        if status != 200:
+            return None
+        try:
+            return json.loads(content.decode('utf-8'))
+        except ValueError:
+            return None
+
+    # Opens an event stream of path with a new stream token, recording the
+    # time to its headers under endpoint. Returns the EventStream, or None if
+    # no token was issued.
+    def open_stream(self, endpoint, path):
+        status, content = self.request('events_token', 'POST', '/api/events/token')
+        if status != 200:
+            return None
+        token = json.loads(content.decode('utf-8'))['token']
+
+        stream = EventStream(self, endpoint, path + '?' + urlencode({'token': token}))
+        stream.start()
+        return stream
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# An event stream held open on a connection of its own, queueing the
+# (event, data) of each event it receives, then _CLOSED once it ends.
+class EventStream(threading.Thread):
+
+    def __init__(self, session, endpoint, path):
+        super(EventStream, self).__init__(daemon=True)
+        self.session = session
+        self.endpoint = endpoint
+        self.path = path
+        self.events = Queue()
+        self.opened = False
+        self.connection = None
+        # Guards connecting against close(), so a stream closed before it has
+        # connected does not connect.
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                if self.closed:
+                    self.events.put(_CLOSED)
+                    return
+                self.connection = self.session.connection_class(self.session.netloc, timeout=_TIMEOUT)
+                self.connection.connect()
+            self.connection.request('GET', self.session.prefix + self.path,
+                                    headers={'Accept': 'text/event-stream'})
+            response = self.connection.getresponse()
+            status = response.status
+        except (http.client.HTTPException, OSError):
+            response, status = None, None
+        self.session.recorder.record(self.endpoint, status, time.perf_counter() - start)
+
+        try:
+            if status == 200:
+                self.opened = True
+                self.read_events(response)
+        except (http.client.HTTPException, OSError, ValueError):
+            pass
+        finally:
+            self.events.put(_CLOSED)
+            if self.connection is not None:
+                self.connection.close()
+
+    def read_events(self, response):
+        event, data = None, []
+        while True:
+            line = response.readline()
+            if not line:
+                return
+
+            line = line.decode('utf-8').rstrip('\r\n')
+            if not line:
+                if data:
+                    self.events.put((event or 'message', '\n'.join(data)))
+                event, data = None, []
+            elif line.startswith('event:'):
+                event = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                data.append(line[len('data:'):].lstrip(' '))
+
+    # Ends the stream from another thread, waking the read waiting on it.
+    def close(self):
+        with self.lock:
+            self.closed = True
+            sock = self.connection.sock if self.connection is not None else None
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+# A student reading the solutions of a paper.
+class Viewer(threading.Thread):
+
+    def __init__(self, session, paper, speedup, seed, stopped, events=False):
+        super(Viewer, self).__init__(daemon=True)
+        self.session = session
+        self.paper_path = '/api/' + paper['course'] + '/' + str(paper['year'])
+        self.speedup = speedup
+        self.rng = random.Random(seed)
+        self.stopped = stopped
+        self.events = events
+        self.paper_id = None
+        self.question_ids = []
+        self.cursors = {}
+        self.displayed = None
+
+    def run(self):
+        # Pages are opened at different times, so polls do not line up.
+        if self.stopped.wait(self.rng.uniform(0, POLL_SECONDS) / self.speedup):
+            return
+
+        self.load_page()
+        next_refresh = time.time() + REFRESH_DELAY_SECONDS / self.speedup
+        if self.events and self.paper_id is not None:
+            next_refresh = self.listen(next_refresh)
+        self.poll_until_stopped(next_refresh)
+
+        self.session.close()
+
+    def poll_until_stopped(self, next_refresh):
+        next_poll = time.time() + POLL_SECONDS / self.speedup
+
+        # Like the browser's timers, a poll is skipped rather than made late
+        # when the one before it has not returned.
+        while not self.stopped.wait(max(min(next_poll, next_refresh) - time.time(), 0)):
+            now = time.time()
+            if now >= next_refresh:
+                next_refresh = self.refresh_all(next_refresh)
+            if now >= next_poll:
+                self.poll()
+                next_poll = next_tick(next_poll, POLL_SECONDS / self.speedup)
+
+    # Holds the paper's event stream until stopped, reopening it with a new
+    # token whenever the server ends it. Like the page, falls back to polling
+    # if a stream cannot be opened, returning when the next refresh is due.
+    def listen(self, next_refresh):
+        path = '/api/paper/' + str(self.paper_id) + '/events'
+        while not self.stopped.is_set():
+            stream = self.session.open_stream('events', path)
+            if stream is None:
+                return next_refresh
+            try:
+                next_refresh = self.follow(stream, next_refresh)
+            finally:
+                stream.close()
+            if not stream.opened:
+                return next_refresh
+        return next_refresh
+
+    # Refreshes the displayed question on each of the stream's answer events
+    # for it, until the stream ends or the viewer is stopped.
+    def follow(self, stream, next_refresh):
+        while not self.stopped.is_set():
+            if time.time() >= next_refresh:
+                next_refresh = self.refresh_all(next_refresh)
+
+            try:
+                message = stream.events.get(timeout=min(max(next_refresh - time.time(), 0), _STOP_SECONDS))
+            except Empty:
+                continue
+            if message is _CLOSED:
+                break
+
+            event, data = message
+            if event in _ANSWER_EVENTS and json.loads(data).get('question') == self.displayed:
+                self.poll()
+        return next_refresh
+
+    def refresh_all(self, next_refresh):
+        for question_id in self.question_ids:
+            self.refresh(question_id)
+        return next_tick(next_refresh, REFRESH_SECONDS / self.speedup)
+
+    def load_page(self):
+        paper = self.session.get_json('paper', self.paper_path + '/paper') or {}
+        self.paper_id = paper.get('paper_id')
+        self.session.request('paper_pdf', 'GET', self.paper_path + '/paper/pdf')
+        questions = self.session.get_json('questions', self.paper_path + '/questions') or []
+        self.question_ids = [question['id'] for question in questions]
+
+        if self.question_ids:
+            self.displayed = self.rng.choice(self.question_ids)
+            self.refresh(self.displayed)
+
+    def poll(self):
+        if self.displayed is not None:
+            self.refresh(self.displayed)
+
+    # Fetches the answers of the question changed since it was last fetched,
+    # and returns them.
+    def refresh(self, question_id):
+        path = '/api/' + str(question_id) + '/answer/changes'
+        cursor = self.cursors.get(question_id)
+        if cursor is not None:
+            path += '?' + urlencode({'since': cursor})
+
+        status, content = self.session.request('answer_changes', 'GET', path)
+        if status != 200:
+            return []
+        changes = json.loads(content.decode('utf-8'))
+        self.cursors[question_id] = changes['cursor']
+        return changes['answers']
+
+
+# A student on the page who also votes and posts answers, every interval
+# seconds on average. Writes are timed by polls, so writers always poll.
+class Writer(Viewer):
+
+    def __init__(self, session, paper, speedup, seed, stopped, user, interval, answer_share):
+        super(Writer, self).__init__(session, paper, speedup, seed, stopped)
+        self.user = user
+        self.interval = interval
+        self.answer_share = answer_share
+        self.answers = {}
+        self.next_write = None
+
+    def refresh(self, question_id):
+        answers = super(Writer, self).refresh(question_id)
+        if question_id == self.displayed:
+            for answer in answers:
+                self.answers[answer['id']] = answer
+        return answers
+
+    def poll(self):
+        super(Writer, self).poll()
+
+        now = time.time()
+        if self.next_write is None:
+            self.next_write = now + self.rng.expovariate(1.0 / self.interval) / self.speedup
+        if now < self.next_write or self.displayed is None:
+            return
+        self.next_write = now + self.rng.expovariate(1.0 / self.interval) / self.speedup
+
+        votable = [answer for answer in self.answers.values() if answer['user']['id'] != self.user['id']]
+        if votable and self.rng.random() >= self.answer_share:
+            self.vote(self.rng.choice(votable))
+        else:
+            self.post_answer()
+
+    def vote(self, answer):
+        # can_vote is 1 until the user votes, when it turns to 0.
+        action = 'upvote' if answer['can_vote'] == 1 else 'downvote'
+        status, content = self.session.request(action, 'POST', '/api/' + action + '/' + str(answer['id']))
+        if status == 201:
+            answer['can_vote'] = 0 if action == 'upvote' else 1
+
+    def post_answer(self):
+        html = '<p>Load test answer ' + str(self.rng.getrandbits(32)) + '</p>'
+        self.session.request('submit_answer', 'POST', '/api/submit/answer/', {
+            'question': str(self.displayed),
+            'user': self.user,
+            'html': html,
+        })
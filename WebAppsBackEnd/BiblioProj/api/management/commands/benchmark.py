@@ -0,0 +1,132 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import benchmark
+
+# Generates a dataset and times each hot endpoint of the API against it,
+# printing p50/p95/p99 latency, queries and bytes per request. By default the
+# dataset goes in a throwaway test database, so the real data is untouched.
+# Results can be saved as JSON with --output, and a later run checked against
+# them with --compare, failing if any scenario got slower or makes more
+# queries. --serializers also times the read views' projections against the
+# DRF serializers they replaced.
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the API's hot endpoints against a generated dataset."
+
+    def add_arguments(self, parser):
+        spec = benchmark.DEFAULT_SPEC
+        parser.add_argument('--papers', type=int, default=spec.papers, help="Papers to generate.")
+        parser.add_argument('--questions', type=int, default=spec.questions, help="Questions per paper.")
+        parser.add_argument('--answers', type=int, default=spec.answers, help="Answers per question.")
+        parser.add_argument('--votes', type=int, default=spec.votes, help="Most votes per answer.")
+        parser.add_argument('--comments', type=int, default=spec.comments, help="Most comment threads per answer.")
+        parser.add_argument('--pdf-kb', type=int, default=spec.pdf_kb, help="Size of each paper's PDF.")
+        parser.add_argument('--seed', type=int, default=spec.seed, help="Seed of the generated dataset.")
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=20, help="Unmeasured requests before those.")
+        parser.add_argument('--scenario', action='append', choices=[name for name, _ in benchmark.SCENARIOS],
+                            help="Scenario to run, may be repeated. All by default.")
+        parser.add_argument('--output', help="File to write the results to as JSON.")
+        parser.add_argument('--compare', help="JSON results of an earlier run to check these against.")
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help="Fraction by which a scenario's p95 may exceed the compared run's.")
+        parser.add_argument('--serializers', action='store_true',
+                            help="Also time serializing the answers and comments lists with the DRF serializers "
+                                 "and with the projections the read views use.")
+        parser.add_argument('--in-place', action='store_true',
+                            help="Generate the dataset in the configured database instead of a test database.")
+
+    def handle(self, *args, **options):
+        spec = benchmark.DatasetSpec(options['papers'], options['questions'], options['answers'],
+                                     options['votes'], options['comments'], options['pdf_kb'], options['seed'])
+        names = options['scenario'] or [name for name, _ in benchmark.SCENARIOS]
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (IOError, ValueError, KeyError) as e:
+                raise CommandError("Could not read results from " + options['compare'] + ": " + str(e))
+
+        if options['in_place']:
+            results, serializers = self.run(spec, names, options)
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results, serializers = self.run(spec, names, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            output = {'metadata': self.get_metadata(spec, options), 'results': results}
+            if serializers is not None:
+                output['serializers'] = serializers
+            with open(options['output'], 'w') as f:
+                json.dump(output, f, indent=2, sort_keys=True)
+
+        if baseline is not None:
+            regressions = benchmark.find_regressions(results, baseline, options['max_regression'])
+            if regressions:
+                raise CommandError("Regressions against " + options['compare'] + ":\n  " +
+                                   "\n  ".join(regressions))
+            self.stdout.write("No regressions against " + options['compare'] + ".")
+
+    def run(self, spec, names, options):
+        self.stdout.write("Generating " + str(spec) + " in " + connection.vendor + "...")
+        dataset = benchmark.generate_dataset(spec)
+        client = benchmark.client_for(dataset.user)
+        scenarios = dict(benchmark.SCENARIOS)
+
+        self.stdout.write("%-20s %9s %9s %9s %8s %9s" % ('scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'bytes'))
+        results = {}
+        for name in names:
+            try:
+                result = benchmark.run_scenario(scenarios[name], client, dataset,
+                                                options['requests'], options['warmup'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write("%-20s %9.2f %9.2f %9.2f %8d %9d" % (
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries'], result['bytes']))
+            results[name] = result
+
+        serializers = None
+        if options['serializers']:
+            serializers = self.compare_serializers(dataset, options['requests'])
+
+        return results, serializers
+
+    def compare_serializers(self, dataset, repeat):
+        try:
+            serializers = benchmark.compare_serializers(dataset, repeat)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write("%-20s %9s %13s %13s %8s" % ('list', 'rows', 'serializer ms', 'projection ms', 'speedup'))
+        for name, result in sorted(serializers.items()):
+            self.stdout.write("%-20s %9d %13.2f %13.2f %7.1fx" % (
+                name, result['rows'], result['serializer_ms'], result['projection_ms'], result['speedup']))
+
+        return serializers
+
+    def get_metadata(self, spec, options):
+        try:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                             stderr=subprocess.DEVNULL).decode('ascii').strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return {
+            'commit': commit,
+            'vendor': connection.vendor,
+            'dataset': spec._asdict(),
+            'requests': options['requests'],
+            'warmup': options['warmup'],
+        }
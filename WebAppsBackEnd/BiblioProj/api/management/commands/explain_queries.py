@@ -0,0 +1,127 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.models import Answer, Question
+
+# Requests each read endpoint for the question and answer with the most rows
+# under them, or those given, and prints the query plan of every query it
+# makes, so that index use can be checked against the real data.
+
+_ENDPOINTS = [
+    '/api/available-papers',
+    '/api/{course}/{year}/paper',
+    '/api/{course}/{year}/questions',
+    '/api/{question}/answer',
+    '/api/{question}/answer?top=5',
+    '/api/{question}/answer?page_size=20',
+    '/api/{question}/answer?view=summary',
+    '/api/{question}/answer/changes',
+    '/api/{answer}/comment',
+    '/api/{answer}/comment?page_size=20',
+    '/api/{answer}/comment?view=summary',
+    '/api/{answer}/comment/tree',
+]
+
+# Plan lines reading a whole table.
+_FULL_SCANS = {
+    'postgresql': 'Seq Scan',
+    'sqlite': 'SCAN ',
+}
+
+
+class Command(BaseCommand):
+    help = "Prints the query plans of the queries made by each read endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question', type=int, help="Question to request answers of.")
+        parser.add_argument('--answer', type=int, help="Answer to request comments of.")
+        parser.add_argument('--user', help="Username to make requests as, the first user by default.")
+        parser.add_argument('--analyze', action='store_true',
+                            help="Run each query and print actual row counts and timings (PostgreSQL).")
+
+    def handle(self, *args, **options):
+        question = self.get_question(options['question'])
+        answer = self.get_answer(options['answer'], question)
+        user = self.get_user(options['user'])
+        paper = question.paper
+
+        full_scans = 0
+        for endpoint in _ENDPOINTS:
+            url = endpoint.format(course=paper.course, year=paper.year, question=question.id, answer=answer.id)
+            self.stdout.write(self.style.MIGRATE_HEADING("GET " + url))
+
+            for sql in self.capture_queries(url, user):
+                self.stdout.write("  " + sql)
+                for line in self.explain(sql, options['analyze']):
+                    if _FULL_SCANS.get(connection.vendor, '\0') in line:
+                        full_scans += 1
+                        line = self.style.WARNING(line)
+                    self.stdout.write("    " + line)
+            self.stdout.write("")
+
+        self.stdout.write(str(full_scans) + " full table scans.")
+
+    def get_question(self, question_id):
+        questions = Question.objects.select_related('paper')
+        if question_id is not None:
+            question = questions.filter(pk=question_id).first()
+        else:
+            question = questions.annotate(answers=Count('answer')).order_by('-answers', 'id').first()
+
+        if question is None:
+            raise CommandError("No question to request, create some data first.")
+        return question
+
+    def get_answer(self, answer_id, question):
+        if answer_id is not None:
+            answer = Answer.objects.filter(pk=answer_id).first()
+        else:
+            answer = Answer.objects.filter(question=question).annotate(comments=Count('comment')) \
+                .order_by('-comments', 'id').first()
+
+        if answer is None:
+            raise CommandError("No answer to request, create some data first.")
+        return answer
+
+    def get_user(self, username):
+        users = User.objects.order_by('id')
+        user = users.filter(username=username).first() if username is not None else users.first()
+
+        if user is None:
+            raise CommandError("No user to make requests as.")
+        return user
+
+    # Returns the SQL of each query made by a GET of url, authenticated as
+    # user.
+    def capture_queries(self, url, user):
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, user=user)
+        match = resolve(request.path_info)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+
+        if response.status_code >= 400:
+            raise CommandError("GET " + url + " returned " + str(response.status_code) + ".")
+
+        return [query['sql'] for query in queries.captured_queries]
+
+    def explain(self, sql, analyze):
+        if connection.vendor == 'postgresql':
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN '
+        elif connection.vendor == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            prefix = 'EXPLAIN '
+
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            # SQLite puts the plan of each step in the last column.
+            return [str(row[-1]) for row in cursor.fetchall()]
@@ -0,0 +1,149 @@
+import json
+import threading
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework_jwt.settings import api_settings as jwt_settings
+
+from api import benchmark, loadtest
+from api.models import Paper
+
+# Ramps up viewers of a paper's solution page on a running server, adding
+# viewers-step more every stage-seconds, until the server saturates: its p95
+# latency or error rate passes the limits. Prints the throughput, latency and
+# errors of each endpoint at every stage. Tokens are made with this project's
+# settings, so the server must share its SECRET_KEY and database.
+
+
+class Command(BaseCommand):
+    help = "Load tests a running server with simulated viewers of a solution page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help="URL of the server.")
+        parser.add_argument('--paper', help="COURSE/YEAR of the paper to view, the one with the most answers "
+                                            "by default.")
+        parser.add_argument('--generate', action='store_true',
+                            help="Generate the benchmark dataset in the database first.")
+        parser.add_argument('--viewers-start', type=int, default=10, help="Viewers in the first stage.")
+        parser.add_argument('--viewers-step', type=int, default=10, help="Viewers added each stage.")
+        parser.add_argument('--viewers-max', type=int, default=500, help="Viewers in the last stage.")
+        parser.add_argument('--stage-seconds', type=float, default=60, help="Length of each stage.")
+        parser.add_argument('--writers', type=int, default=2, help="Viewers also posting answers and votes.")
+        parser.add_argument('--write-interval', type=float, default=30,
+                            help="Mean seconds between a writer's posts.")
+        parser.add_argument('--answer-share', type=float, default=0.2,
+                            help="Fraction of a writer's posts that are answers rather than votes.")
+        parser.add_argument('--events', action='store_true',
+                            help="Viewers hold the paper's event stream open and refresh on its events "
+                                 "instead of polling.")
+        parser.add_argument('--speedup', type=float, default=1,
+                            help="Factor to shorten polling and writing intervals by.")
+        parser.add_argument('--max-p95-ms', type=float, default=1000, help="p95 latency that saturates.")
+        parser.add_argument('--max-error-rate', type=float, default=0.01, help="Error rate that saturates.")
+        parser.add_argument('--output', help="File to write the statistics of each stage to as JSON.")
+
+    def handle(self, *args, **options):
+        if options['viewers_start'] < 1 or options['viewers_step'] < 1:
+            raise CommandError("--viewers-start and --viewers-step must be at least 1.")
+        if options['viewers_max'] < options['viewers_start']:
+            raise CommandError("--viewers-max must be at least --viewers-start.")
+
+        if options['generate']:
+            benchmark.generate_dataset(benchmark.DEFAULT_SPEC)
+
+        paper = self.get_paper(options['paper'])
+        users = list(User.objects.order_by('id')[:max(options['writers'], 1)])
+        if len(users) < options['writers']:
+            raise CommandError("Need a user per writer, only " + str(len(users)) + " exist.")
+        if not users:
+            raise CommandError("No user to make requests as.")
+        tokens = [jwt_settings.JWT_ENCODE_HANDLER(jwt_settings.JWT_PAYLOAD_HANDLER(user)) for user in users]
+
+        self.stdout.write("Viewing " + paper['course'] + "/" + str(paper['year']) + " on " + options['url'] +
+                          " with " + str(options['writers']) + " writers" +
+                          (", holding event streams." if options['events'] else "."))
+
+        recorder = loadtest.Recorder()
+        stopped = threading.Event()
+        threads = []
+
+        def start(thread):
+            thread.start()
+            threads.append(thread)
+
+        for i in range(options['writers']):
+            session = loadtest.Session(options['url'], tokens[i], recorder)
+            start(loadtest.Writer(session, paper, options['speedup'], len(threads), stopped,
+                                  {'id': users[i].id, 'username': users[i].username},
+                                  options['write_interval'], options['answer_share']))
+
+        stages = []
+        previous = None
+        viewers = 0
+        try:
+            for target in range(options['viewers_start'], options['viewers_max'] + 1, options['viewers_step']):
+                while viewers < target:
+                    session = loadtest.Session(options['url'], tokens[viewers % len(tokens)], recorder)
+                    start(loadtest.Viewer(session, paper, options['speedup'], len(threads), stopped,
+                                          options['events']))
+                    viewers += 1
+
+                recorder.take()
+                stopped.wait(options['stage_seconds'])
+                summary = loadtest.summarize(recorder.take(), options['stage_seconds'])
+
+                reason = loadtest.saturation(summary, options['max_p95_ms'], options['max_error_rate'])
+                stage = {'viewers': viewers, 'endpoints': summary, 'saturated': reason}
+                stages.append(stage)
+                self.write_stage(stage)
+
+                if reason is not None:
+                    break
+                previous = stage
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join(loadtest.REFRESH_SECONDS)
+
+        if stages[-1]['saturated'] is None:
+            self.stdout.write("Not saturated with " + str(viewers) + " viewers.")
+        elif previous is None:
+            self.stdout.write("Saturated with the first " + str(viewers) + " viewers.")
+        else:
+            self.stdout.write("Saturated with " + str(viewers) + " viewers, handles " +
+                              str(previous['viewers']) + ".")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'url': options['url'], 'paper': paper, 'writers': options['writers'],
+                           'events': options['events'], 'speedup': options['speedup'], 'stages': stages},
+                          f, indent=2, sort_keys=True)
+
+    def get_paper(self, course_year):
+        papers = Paper.objects.values('course', 'year')
+        if course_year is not None:
+            course, _, year = course_year.partition('/')
+            paper = papers.filter(course=course, year=year).first() if year.isdigit() else None
+        else:
+            paper = papers.annotate(answers=Count('question__answer')).order_by('-answers', 'id').first()
+
+        if paper is None:
+            raise CommandError("No paper to view, create some data first or pass --generate.")
+        return {'course': paper['course'], 'year': paper['year']}
+
+    def write_stage(self, stage):
+        overall = stage['endpoints']['all']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            "%d viewers: %.1f requests/s, p95 %.0f ms, %.1f%% errors" % (
+                stage['viewers'], overall['throughput'], overall['p95_ms'], overall['error_rate'] * 100)))
+
+        self.stdout.write("  %-16s %9s %9s %9s %9s %8s" % ('endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+        for endpoint, result in sorted(stage['endpoints'].items()):
+            if endpoint != 'all':
+                self.stdout.write("  %-16s %9.1f %9.1f %9.1f %9.1f %8d" % (
+                    endpoint, result['throughput'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                    result['errors']))
+
+        if stage['saturated'] is not None:
+            self.stdout.write(self.style.WARNING("  Saturated: " + stage['saturated'] + "."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import search
+
+# Indexes every paper, question, answer and comment for search afresh. Run it
+# once after migrating to fill the index, or if it gets out of step, e.g.
+# after data was loaded bypassing the models' signals.
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the search index from every paper, question, answer and comment."
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write("Indexed " + str(count) + " documents.")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api import counters
+
+# Recomputes the answer and comment counters of every question and paper from
+# the rows. Run it after data was loaded bypassing the models' signals, or if
+# the counters are suspected to have drifted.
+
+
+class Command(BaseCommand):
+    help = "Recomputes the answer and comment counters of every question and paper."
+
+    def handle(self, *args, **options):
+        questions, papers = counters.repair()
+        self.stdout.write("Recomputed the counters of " + str(questions) + " questions and " + str(papers) +
+                          " papers.")
@@ -0,0 +1,226 @@
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+
+# Per-request instrumentation. A sample of requests, SAMPLE_RATE of them, is
+# timed by MetricsMiddleware: wall time, database queries and their time,
+# time spent in serializers and rendering JSON, and response size. Each
+# sampled request gets a Server-Timing header and a JSON log line on the
+# api.metrics logger, and is added to histograms per view class, which the
+# Metrics view serves in Prometheus' text format.
+#
+# Requests outside the sample are passed straight through, so with a
+# SAMPLE_RATE of 0 the middleware costs a settings lookup per request.
+# Histograms are kept per process; scrape each worker, or run one.
+
+_DEFAULTS = {
+    # Fraction of requests to time, from 0 (off) to 1 (every request).
+    'SAMPLE_RATE': 0.0,
+    'SERVER_TIMING': True,
+    'LOG': True,
+}
+
+_DURATION_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Name, help and buckets of each histogram, by the key of the request's
+# measurement it observes.
+_HISTOGRAMS = [
+    ('duration', 'biblioteq_request_duration_seconds', "Wall time of requests.", _DURATION_BUCKETS),
+    ('db_queries', 'biblioteq_request_db_queries', "Database queries made by requests.", _QUERY_BUCKETS),
+    ('db', 'biblioteq_request_db_duration_seconds', "Time requests spent in database queries.",
+     _DURATION_BUCKETS),
+    ('serialize', 'biblioteq_request_serialize_duration_seconds', "Time requests spent in serializers.",
+     _DURATION_BUCKETS),
+    ('render', 'biblioteq_request_render_duration_seconds', "Time requests spent rendering JSON.",
+     _DURATION_BUCKETS),
+    ('bytes', 'biblioteq_response_size_bytes', "Size of response bodies, except streams.", _SIZE_BUCKETS),
+]
+
+logger = logging.getLogger('api.metrics')
+
+_local = threading.local()
+
+
+def get_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, _DEFAULTS[name])
+
+
+# Measurements of the request being sampled by this thread.
+class RequestMetrics(object):
+
+    def __init__(self):
+        self.view = None
+        self.timers = {'serialize': 0.0, 'render': 0.0}
+        # Name of the timer running, calls within it are part of it.
+        self.timing = None
+
+
+# Counts calls to the decorated function towards the named timer of the request
+# being sampled, if any. Timers do not nest: a call made while one is running,
+# a serializer rendering a nested one say, counts towards that one.
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = getattr(_local, 'metrics', None)
+            if metrics is None or metrics.timing is not None:
+                return func(*args, **kwargs)
+
+            metrics.timing = name
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.timers[name] += time.perf_counter() - start
+                metrics.timing = None
+        return wrapper
+    return decorator
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last count is of values over every bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(view, measurements):
+    with _histograms_lock:
+        for key, name, _, buckets in _HISTOGRAMS:
+            if measurements.get(key) is None:
+                continue
+            if (name, view) not in _histograms:
+                _histograms[(name, view)] = Histogram(buckets)
+            _histograms[(name, view)].observe(measurements[key])
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+# The histograms in Prometheus' text exposition format.
+def render_prometheus():
+    lines = []
+    with _histograms_lock:
+        for _, name, help, buckets in _HISTOGRAMS:
+            views = sorted(view for histogram_name, view in _histograms if histogram_name == name)
+            if not views:
+                continue
+
+            lines.append('# HELP ' + name + ' ' + help)
+            lines.append('# TYPE ' + name + ' histogram')
+            for view in views:
+                histogram = _histograms[(name, view)]
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{view="%s",le="%s"} %d' % (name, view, bound, cumulative))
+                lines.append('%s_sum{view="%s"} %s' % (name, view, repr(float(histogram.sum))))
+                lines.append('%s_count{view="%s"} %d' % (name, view, cumulative))
+
+    return '\n'.join(lines) + '\n'
+
+
+def view_name(view_func):
+    view_class = getattr(view_func, 'view_class', None)
+    return view_class.__name__ if view_class is not None else view_func.__name__
+
+
+class MetricsMiddleware(object):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = get_setting('SAMPLE_RATE')
+        if not sample_rate or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        metrics = _local.metrics = RequestMetrics()
+        # Log this request's queries with their times, even if DEBUG is off.
+        logs = [(connection, connection.force_debug_cursor, len(connection.queries_log))
+                for connection in connections.all()]
+        for connection, _, _ in logs:
+            connection.force_debug_cursor = True
+
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            _local.metrics = None
+
+            queries = []
+            for connection, force_debug_cursor, logged in logs:
+                connection.force_debug_cursor = force_debug_cursor
+                queries.extend(list(connection.queries_log)[logged:])
+
+        measurements = {
+            'duration': duration,
+            'db_queries': len(queries),
+            'db': sum(float(query['time']) for query in queries),
+            'serialize': metrics.timers['serialize'],
+            'render': metrics.timers['render'],
+            'bytes': None if response.streaming else len(response.content),
+        }
+        view = metrics.view or 'unresolved'
+        observe(view, measurements)
+
+        if get_setting('SERVER_TIMING'):
+            response['Server-Timing'] = server_timing(measurements)
+        if get_setting('LOG'):
+            logger.info(json.dumps(dict(measurements, view=view, method=request.method, path=request.path,
+                                        status=response.status_code), sort_keys=True))
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is not None:
+            metrics.view = view_name(view_func)
+
+    # Times the rendering of DRF's responses, which Django does after calling
+    # this, the last template response middleware, and before the callback.
+    def process_template_response(self, request, response):
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is None or metrics.timing is not None:
+            return response
+
+        metrics.timing = 'render'
+        start = time.perf_counter()
+
+        def rendered(response):
+            metrics.timers['render'] += time.perf_counter() - start
+            metrics.timing = None
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+def server_timing(measurements):
+    return ', '.join([
+        'app;dur=%.1f' % (measurements['duration'] * 1000),
+        'db;dur=%.1f;desc="%d queries"' % (measurements['db'] * 1000, measurements['db_queries']),
+        'serialize;dur=%.1f' % (measurements['serialize'] * 1000),
+        'render;dur=%.1f' % (measurements['render'] * 1000),
+    ])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:08
+from __future__ import unicode_literals
+
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Converts each answer's JSON list of voter ids into Vote rows. Ids of users
+# that no longer exist are dropped.
+def user_voted_to_votes(apps, schema_editor):
+    Answer = apps.get_model('api', 'Answer')
+    Vote = apps.get_model('api', 'Vote')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    user_ids = set(User.objects.values_list('id', flat=True))
+    votes = []
+
+    for answer_id, user_voted in Answer.objects.exclude(user_voted=None).exclude(user_voted='') \
+            .values_list('id', 'user_voted').iterator():
+        for user_id in set(json.loads(user_voted)):
+            if user_id in user_ids:
+                votes.append(Vote(answer_id=answer_id, user_id=user_id))
+
+    Vote.objects.bulk_create(votes, batch_size=1000)
+
+
+def votes_to_user_voted(apps, schema_editor):
+    Answer = apps.get_model('api', 'Answer')
+    Vote = apps.get_model('api', 'Vote')
+
+    user_voted = {}
+    for answer_id, user_id in Vote.objects.order_by('id').values_list('answer_id', 'user_id').iterator():
+        user_voted.setdefault(answer_id, []).append(user_id)
+
+    for answer_id, user_ids in user_voted.items():
+        Answer.objects.filter(pk=answer_id).update(user_voted=json.dumps(user_ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0002_answerchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='answer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Answer'),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='voter_of_answer', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('answer', 'user')]),
+        ),
+        migrations.RunPython(user_voted_to_votes, votes_to_user_voted),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:08
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Separate from 0003 so that Postgres has committed the new Vote rows, and
+# their deferred foreign key checks, before the answer table is altered.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_vote'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='answer',
+            name='user_voted',
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:40
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+
+from django.db import migrations, models
+
+
+# Decodes each paper's base64 pdf text into binary, one paper at a time as
+# PDFs are large.
+def decode_pdfs(apps, schema_editor):
+    Paper = apps.get_model('api', 'Paper')
+
+    for paper_id in Paper.objects.values_list('id', flat=True).iterator():
+        encoded = Paper.objects.values_list('pdf', flat=True).get(pk=paper_id)
+        pdf = base64.b64decode(encoded)
+        Paper.objects.filter(pk=paper_id).update(
+                pdf_data=pdf,
+                pdf_size=len(pdf),
+                pdf_sha1=hashlib.sha1(pdf).hexdigest()
+        )
+
+
+def encode_pdfs(apps, schema_editor):
+    Paper = apps.get_model('api', 'Paper')
+
+    for paper_id in Paper.objects.values_list('id', flat=True).iterator():
+        pdf = Paper.objects.values_list('pdf_data', flat=True).get(pk=paper_id)
+        Paper.objects.filter(pk=paper_id).update(pdf=base64.b64encode(bytes(pdf)).decode('ascii'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_remove_answer_user_voted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='pdf_data',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='pdf_sha1',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='pdf_size',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(decode_pdfs, encode_pdfs),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_paper_pdf_binary'),
+    ]
+
+    operations = [
+        # Gives the text column a default so that it can be added back when
+        # this migration is reversed.
+        migrations.AlterField(
+            model_name='paper',
+            name='pdf',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='paper',
+            name='pdf',
+        ),
+        migrations.RenameField(
+            model_name='paper',
+            old_name='pdf_data',
+            new_name='pdf',
+        ),
+        migrations.AlterField(
+            model_name='paper',
+            name='pdf',
+            field=models.BinaryField(),
+        ),
+    ]
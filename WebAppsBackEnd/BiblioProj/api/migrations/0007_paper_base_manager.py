@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:45
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_paper_pdf_rename'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='paper',
+            options={'base_manager_name': 'objects'},
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:22
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_pagination_indexes'),
+    ]
+
+    # The single column indexes of these foreign keys duplicate the leading
+    # column of a composite index, so are dropped once that exists.
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['user', 'answer'], name='api_vote_user_id_405909_idx'),
+        ),
+        migrations.AlterField(
+            model_name='answer',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.Question'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='answer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.Answer'),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='paper',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.Paper'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='answer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.Answer'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='voter_of_answer', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:39
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# GIN indexes are PostgreSQL's own, other databases search in process.
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX api_searchdocument_vector_gin ON api_searchdocument '
+                              'USING gin (search_vector)')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX api_searchdocument_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('paper', 'Paper'), ('question', 'Question'), ('answer', 'Answer'), ('comment', 'Comment')], max_length=8)),
+                ('object_id', models.IntegerField()),
+                ('question_id', models.IntegerField(null=True)),
+                ('answer_id', models.IntegerField(null=True)),
+                ('keywords', models.TextField(blank=True, default='')),
+                ('text', models.TextField(blank=True, default='')),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Paper')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchdocument',
+            unique_together=set([('kind', 'object_id')]),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
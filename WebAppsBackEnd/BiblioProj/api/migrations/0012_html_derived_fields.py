@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from api.text import excerpt, html_to_text, sanitize_html
+
+
+# Updated rather than saved, so comments keep their updated_at.
+def derive_from_html(apps, schema_editor):
+    for model_name in ('Answer', 'Comment'):
+        model = apps.get_model('api', model_name)
+        for id, html in model.objects.values_list('id', 'html').iterator():
+            text = html_to_text(html)
+            model.objects.filter(pk=id).update(safe_html=sanitize_html(html), text=text,
+                                               excerpt=excerpt(text, 200))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='safe_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='safe_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(derive_from_html, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 13:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, DateTimeField, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+
+# Counts the existing answers and comments, as api.counters.recompute() does
+# at the time of writing, with one UPDATE of each table.
+def count_activity(apps, schema_editor):
+    Paper = apps.get_model('api', 'Paper')
+    Question = apps.get_model('api', 'Question')
+    Answer = apps.get_model('api', 'Answer')
+    Comment = apps.get_model('api', 'Comment')
+
+    answers = Answer.objects.filter(question=OuterRef('pk')).order_by().values('question')
+    comments = Comment.objects.filter(answer__question=OuterRef('pk')).order_by().values('answer__question')
+    latest_answer = Subquery(answers.annotate(latest=Max('timestamp')).values('latest'),
+                             output_field=DateTimeField())
+    latest_comment = Subquery(comments.annotate(latest=Max('timestamp')).values('latest'),
+                              output_field=DateTimeField())
+    Question.objects.update(
+        answer_count=Coalesce(Subquery(answers.annotate(count=Count('id')).values('count'),
+                                       output_field=IntegerField()), 0),
+        comment_count=Coalesce(Subquery(comments.annotate(count=Count('id')).values('count'),
+                                        output_field=IntegerField()), 0),
+        # Greatest() is NULL if either is on some databases.
+        last_activity=Greatest(Coalesce(latest_answer, latest_comment), Coalesce(latest_comment, latest_answer)),
+    )
+
+    questions = Question.objects.filter(paper=OuterRef('pk')).order_by().values('paper')
+    Paper.objects.update(
+        answer_count=Coalesce(Subquery(questions.annotate(total=Sum('answer_count')).values('total'),
+                                       output_field=IntegerField()), 0),
+        comment_count=Coalesce(Subquery(questions.annotate(total=Sum('comment_count')).values('total'),
+                                        output_field=IntegerField()), 0),
+        last_activity=Subquery(questions.annotate(latest=Max('last_activity')).values('latest'),
+                               output_field=DateTimeField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_html_derived_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='answer_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(count_activity, migrations.RunPython.noop),
+    ]
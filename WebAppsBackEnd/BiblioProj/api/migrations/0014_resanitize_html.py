@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from api.text import sanitize_html
+
+
+# safe_html of bodies saved before colors and videos were kept, from the
+# html they were written with.
+def resanitize_html(apps, schema_editor):
+    for model_name in ('Answer', 'Comment'):
+        model = apps.get_model('api', model_name)
+        for id, html, safe_html in model.objects.values_list('id', 'html', 'safe_html').iterator():
+            sanitized = sanitize_html(html)
+            if sanitized != safe_html:
+                model.objects.filter(pk=id).update(safe_html=sanitized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_activity_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(resanitize_html, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+# Indexes the papers, questions, answers and comments written before the
+# search index existed, as api.search.rebuild() does at the time of writing.
+# It runs after 0012, which gave answers and comments the text they are indexed by.
+def fill_search_index(apps, schema_editor):
+    Paper = apps.get_model('api', 'Paper')
+    Question = apps.get_model('api', 'Question')
+    Answer = apps.get_model('api', 'Answer')
+    Comment = apps.get_model('api', 'Comment')
+    SearchDocument = apps.get_model('api', 'SearchDocument')
+
+    documents = []
+
+    courses = {}
+    for id, course, year, title in Paper.objects.values_list('id', 'course', 'year', 'title__title'):
+        documents.append(SearchDocument(kind='paper', object_id=id, paper_id=id,
+                                        keywords=' '.join([course, str(year), title])))
+        courses[id] = course
+
+    paper_ids = {}
+    for id, paper_id, number in Question.objects.values_list('id', 'paper_id', 'number'):
+        documents.append(SearchDocument(kind='question', object_id=id, paper_id=paper_id, question_id=id,
+                                        keywords=courses[paper_id] + ' ' + number))
+        paper_ids[id] = paper_id
+
+    question_ids = {}
+    for id, question_id, text in Answer.objects.values_list('id', 'question_id', 'text'):
+        documents.append(SearchDocument(kind='answer', object_id=id, paper_id=paper_ids[question_id],
+                                        question_id=question_id, answer_id=id, text=text))
+        question_ids[id] = question_id
+
+    for id, answer_id, text in Comment.objects.values_list('id', 'answer_id', 'text'):
+        question_id = question_ids[answer_id]
+        documents.append(SearchDocument(kind='comment', object_id=id, paper_id=paper_ids[question_id],
+                                        question_id=question_id, answer_id=answer_id, text=text))
+
+    SearchDocument.objects.all().delete()
+    SearchDocument.objects.bulk_create(documents, batch_size=500)
+
+    if schema_editor.connection.vendor == 'postgresql':
+        config = getattr(settings, 'SEARCH', {}).get('CONFIG', 'english')
+        SearchDocument.objects.update(
+            search_vector=SearchVector('keywords', weight='A', config=config) +
+            SearchVector('text', weight='B', config=config))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_resanitize_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,19 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 import datetime
+import hashlib
+
+from api.text import excerpt, html_to_text, sanitize_html
 
 MAX_USERNAME_LENGTH = 12
 MAX_PASSWORD_LENGTH = 30
 MAX_COURSECODE_LENGTH = 4
 MAX_TITLE_LENGTH = 50
+MAX_ACTION_LENGTH = 7
+MAX_KIND_LENGTH = 8
+MAX_EXCERPT_LENGTH = 200
 
 
 class PaperTitle(models.Model):
@@ -16,12 +23,38 @@ class PaperTitle(models.Model):
         return self.title
 
 
+class PaperQuerySet(models.QuerySet):
+
+    # Loads the PDF too, which is otherwise deferred.
+    def with_pdf(self):
+        return self.defer(None)
+
+
+# Defers the PDF of every paper it loads, as it is megabytes each and only
+# needed for downloads.
+class PaperManager(models.Manager.from_queryset(PaperQuerySet)):
+
+    def get_queryset(self):
+        return super(PaperManager, self).get_queryset().defer('pdf')
+
+
 # TODO: Create Course -> Title functional dependency
 class Paper(models.Model):
     course = models.CharField(max_length=MAX_COURSECODE_LENGTH)
     year = models.IntegerField()
     title = models.ForeignKey(PaperTitle)
-    pdf = models.TextField()
+    pdf = models.BinaryField()
+    # Size and SHA-1 of pdf, kept by save() so downloads can be validated and
+    # ranged without loading the PDF.
+    pdf_size = models.IntegerField(default=0)
+    pdf_sha1 = models.CharField(max_length=40, blank=True, default='')
+    # Answers and comments under its questions, and when the latest was
+    # posted, kept by api/counters.py.
+    answer_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    objects = PaperManager()
 
     # Ensure year is greater then zero and less then current year.
     # Check that course code is valid?
@@ -30,30 +63,171 @@ class Paper(models.Model):
         if self.year < 0 or self.year > datetime.datetime.now().year:
             raise ValidationError('Year is not valid... fix this write a proper thing')
 
+    def save(self, *args, **kwargs):
+        if 'pdf' not in self.get_deferred_fields():
+            pdf = bytes(self.pdf)
+            self.pdf_size = len(pdf)
+            self.pdf_sha1 = hashlib.sha1(pdf).hexdigest()
+        super(Paper, self).save(*args, **kwargs)
+
     class Meta:
         unique_together = ('course', 'year',)
+        # Also defer the PDF when a paper is loaded through a relation.
+        base_manager_name = 'objects'
 
 
 class Question(models.Model):
     number = models.TextField()
-    paper = models.ForeignKey(Paper, on_delete=models.CASCADE)
+    # Indexed by unique_together, which leads with it.
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, db_index=False)
+    # Answers and comments under it, and when the latest was posted, kept by
+    # api/counters.py.
+    answer_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('paper', 'number')
 
 
+# Sets the fields kept from the html of an answer or comment, so reads never
+# parse it: the HTML sanitized for display, its plain text and an excerpt.
+def derive_from_html(instance):
+    instance.safe_html = sanitize_html(instance.html)
+    instance.text = html_to_text(instance.html)
+    instance.excerpt = excerpt(instance.text, MAX_EXCERPT_LENGTH)
+
+
 class Answer(models.Model):
-    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    # Indexed by Meta.indexes, which leads with it.
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
     user = models.ForeignKey('auth.User', related_name='owner_of_answer', on_delete=models.CASCADE)
     votes = models.IntegerField(default=0)
     timestamp = models.DateTimeField(auto_now_add=True)
     html = models.TextField()
-    user_voted = models.TextField(default="", null=True, blank=True)
+    # Kept from html by save(), see derive_from_html().
+    safe_html = models.TextField(blank=True, default='')
+    text = models.TextField(blank=True, default='')
+    excerpt = models.CharField(max_length=MAX_EXCERPT_LENGTH, blank=True, default='')
+
+    def save(self, *args, **kwargs):
+        if 'html' not in self.get_deferred_fields():
+            derive_from_html(self)
+        # Atomic with the counters updated on create, see api/counters.py.
+        with transaction.atomic():
+            super(Answer, self).save(*args, **kwargs)
+
+    class Meta:
+        # Keyset pages of a question's answers, most voted first.
+        indexes = [models.Index(fields=['question', 'votes', 'timestamp', 'id'])]
+
+
+# A user's vote on an answer. Answer.votes is the counter of these, kept in
+# step by the vote views.
+class Vote(models.Model):
+    answer = models.ForeignKey(Answer, on_delete=models.CASCADE, db_index=False)
+    user = models.ForeignKey('auth.User', related_name='voter_of_answer', on_delete=models.CASCADE,
+                             db_index=False)
+
+    class Meta:
+        unique_together = ('answer', 'user')
+        # Answers a user has voted on, read from the index alone. Together
+        # with unique_together this covers both foreign keys.
+        indexes = [models.Index(fields=['user', 'answer'])]
 
 
 class Comment(models.Model):
     user = models.ForeignKey('auth.User', related_name='owner_of_comment', on_delete=models.CASCADE)
-    answer = models.ForeignKey(Answer)
+    # Indexed by Meta.indexes, which leads with it.
+    answer = models.ForeignKey(Answer, db_index=False)
     parent = models.ForeignKey('self', null=True, blank=True, related_name='child')
     timestamp = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     html = models.TextField()
+    # Kept from html by save(), see derive_from_html().
+    safe_html = models.TextField(blank=True, default='')
+    text = models.TextField(blank=True, default='')
+    excerpt = models.CharField(max_length=MAX_EXCERPT_LENGTH, blank=True, default='')
+
+    def save(self, *args, **kwargs):
+        if 'html' not in self.get_deferred_fields():
+            derive_from_html(self)
+        # Atomic with the counters updated on create, see api/counters.py.
+        with transaction.atomic():
+            super(Comment, self).save(*args, **kwargs)
+
+    class Meta:
+        # Keyset pages of an answer's comments, oldest first.
+        indexes = [models.Index(fields=['answer', 'timestamp', 'id'])]
+
+
+
+class AnswerChangeManager(models.Manager):
+
+    # Records that answer has changed. Only the most recent change of each
+    # answer is kept, so the table grows with the number of answers rather
+    # than the number of writes. The old change is replaced in a transaction,
+    # so readers never see the latest change of the question go back to an
+    # older one, and with the answer locked, so concurrent records of it
+    # cannot both keep theirs.
+    def record(self, answer, action):
+        with transaction.atomic():
+            list(Answer.objects.select_for_update().filter(pk=answer.id).values_list('id'))
+            self.filter(answer_id=answer.id).delete()
+            return self.create(question_id=answer.question_id, answer_id=answer.id, action=action)
+
+
+# Change feed of the answers of each question. The id of the most recent
+# change seen by a client is the cursor it polls with.
+class AnswerChange(models.Model):
+    CREATED = 'created'
+    UPDATED = 'updated'
+    VOTED = 'voted'
+    DELETED = 'deleted'
+    ACTIONS = (
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (VOTED, 'Voted'),
+        (DELETED, 'Deleted'),
+    )
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    # Not a foreign key, the change outlives a deleted answer.
+    answer_id = models.IntegerField(db_index=True)
+    action = models.CharField(max_length=MAX_ACTION_LENGTH, choices=ACTIONS)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = AnswerChangeManager()
+
+    class Meta:
+        index_together = ('question', 'id')
+
+
+# A row of the search index, see api/search.py: a paper, question, answer or
+# comment with its text. keywords are ranked above text. search_vector holds
+# both as a tsvector on PostgreSQL, and is unused elsewhere.
+class SearchDocument(models.Model):
+    PAPER = 'paper'
+    QUESTION = 'question'
+    ANSWER = 'answer'
+    COMMENT = 'comment'
+    KINDS = (
+        (PAPER, 'Paper'),
+        (QUESTION, 'Question'),
+        (ANSWER, 'Answer'),
+        (COMMENT, 'Comment'),
+    )
+
+    kind = models.CharField(max_length=MAX_KIND_LENGTH, choices=KINDS)
+    object_id = models.IntegerField()
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE)
+    # Not foreign keys, as with AnswerChange the rows are removed by signals.
+    question_id = models.IntegerField(null=True)
+    answer_id = models.IntegerField(null=True)
+    keywords = models.TextField(blank=True, default='')
+    text = models.TextField(blank=True, default='')
+    search_vector = SearchVectorField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
@@ -0,0 +1,74 @@
+import base64
+import binascii
+import json
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Keyset pagination. A page is the rows after a cursor in a fixed, total
+# ordering, found with a WHERE on the ordering fields rather than an OFFSET,
+# so with an index on those fields any page costs the same as the first.
+# Cursors are opaque to clients: the ordering values of the last row of a
+# page, as base64 encoded JSON.
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPaginator(object):
+
+    # ordering is a sequence of field names, each prefixed with '-' for
+    # descending, ending with a unique field so that it is total.
+    def __init__(self, model, ordering):
+        self.ordering = ordering
+        self.fields = [(model._meta.get_field(name.lstrip('-')), name.startswith('-')) for name in ordering]
+
+    # Returns the page_size rows of queryset after cursor, or the first ones
+    # if cursor is None, and the cursor of the next page or None if there is
+    # no next page.
+    def paginate(self, queryset, cursor, page_size):
+        queryset = queryset.order_by(*self.ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(self.decode_cursor(cursor)))
+
+        rows = list(queryset[:page_size + 1])
+        if len(rows) <= page_size:
+            return rows, None
+
+        rows = rows[:page_size]
+        return rows, self.encode_cursor(rows[-1])
+
+    # Rows strictly after values in the ordering, as
+    #   a <= x AND (a < x OR (a = x AND (b < y OR (b = y AND c < z))))
+    # for descending fields a, b, c. The redundant leading bound lets the
+    # database range scan an index on the fields.
+    def after(self, values):
+        condition = None
+        for (field, descending), value in reversed(list(zip(self.fields, values))):
+            lookup = field.name + ('__lt' if descending else '__gt')
+            if condition is None:
+                condition = Q(**{lookup: value})
+            else:
+                condition = Q(**{lookup: value}) | (Q(**{field.name: value}) & condition)
+
+        field, descending = self.fields[0]
+        bound = Q(**{field.name + ('__lte' if descending else '__gte'): values[0]})
+        return bound & condition
+
+    def encode_cursor(self, row):
+        # Rows of .values() are dicts keyed by the fields' attnames.
+        if isinstance(row, dict):
+            row = SimpleNamespace(**row)
+        values = [field.value_to_string(row) for field, _ in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError(cursor)
+            return [field.to_python(value) for (field, _), value in zip(self.fields, values)]
+        except (binascii.Error, UnicodeError, ValueError, TypeError, ValidationError):
+            raise InvalidCursor("Invalid cursor: " + cursor)
@@ -5,10 +5,10 @@ class IsOwner(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
 
-        return request.user == obj.user
+        return request.user.id == obj.user_id
 
 class IsStaff(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        return request.user == "Robert"
\ No newline at end of file
+        return bool(request.user and request.user.is_authenticated and request.user.is_staff)
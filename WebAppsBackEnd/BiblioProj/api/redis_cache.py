@@ -0,0 +1,76 @@
+import pickle
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Django cache backend storing entries on a Redis server, so that every worker
+# shares one cache, and a version bumped by one is seen by all. LOCATION is
+# the server's URL, OPTIONS may give a 'CLIENT_CLASS', e.g. a fakeredis
+# stand-in, in place of redis.StrictRedis.
+
+
+class RedisCache(BaseCache):
+
+    def __init__(self, server, params):
+        super(RedisCache, self).__init__(params)
+
+        client_class = params.get('OPTIONS', {}).get('CLIENT_CLASS')
+        if client_class is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured("RedisCache requires the redis package.")
+            client_class = redis.StrictRedis
+        elif isinstance(client_class, str):
+            client_class = import_string(client_class)
+
+        self.client = client_class.from_url(server or 'redis://localhost:6379/0')
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._set(key, value, timeout, version, only_if_new=True)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        value = self.client.get(key)
+        return default if value is None else pickle.loads(value)
+
+    def get_many(self, keys, version=None):
+        made_keys = [self.make_key(key, version=version) for key in keys]
+        for key in made_keys:
+            self.validate_key(key)
+
+        values = self.client.mget(made_keys) if made_keys else []
+        return dict((key, pickle.loads(value)) for key, value in zip(keys, values) if value is not None)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._set(key, value, timeout, version)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self.client.delete(key)
+
+    # Deletes only the keys of this cache, the server may be shared.
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.make_key('*', version='*')))
+        if keys:
+            self.client.delete(*keys)
+
+    def _set(self, key, value, timeout, version, only_if_new=False):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is not None and timeout <= 0:
+            # Expires at once, as with Django's own backends.
+            if only_if_new:
+                return False
+            self.client.delete(key)
+            return True
+
+        milliseconds = None if timeout is None else max(int(timeout * 1000), 1)
+        return bool(self.client.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                                    px=milliseconds, nx=only_if_new))
@@ -0,0 +1,51 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from api import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON rendering of the read views' lists, see Projection in serializers.py,
+# and the media type of event streams.
+
+
+# JSONRenderer encoding with orjson when it is installed, and with the json
+# module like JSONRenderer when it is not. The bytes are the same either way:
+# compact, UTF-8 and with U+2028 and U+2029 escaped, as JSONRenderer renders
+# with the default settings. orjson writes some floats differently, 1e-07 as
+# 1e-7, so this is for data without floats, such as answers and comments.
+# Indented output, other settings and data orjson cannot encode, such as
+# lazy strings, are left to JSONRenderer. Rendering outside a response, as
+# the answers cache does, counts towards a sampled request's render time.
+class FastJSONRenderer(JSONRenderer):
+
+    @metrics.timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.is_default(accepted_media_type, renderer_context):
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+        try:
+            rendered = orjson.dumps(data)
+        except TypeError:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+        return rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+    # Whether JSONRenderer would render compact UTF-8, as orjson does.
+    def is_default(self, accepted_media_type, renderer_context):
+        return self.compact and not self.ensure_ascii and \
+            self.get_indent(accepted_media_type, renderer_context or {}) is None
+
+
+# Lets the Events views accept EventSource's Accept: text/event-stream. The
+# stream itself is a StreamingHttpResponse and never rendered, only the
+# errors refusing to open one, which are rendered as JSON.
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
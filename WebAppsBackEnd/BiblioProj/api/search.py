@@ -0,0 +1,375 @@
+import html
+import math
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Count, F, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from api.models import Paper, Question, Answer, Comment, SearchDocument
+
+# Full-text search over papers, questions, answers and comments. Each is kept
+# as a SearchDocument row, written by the receivers below whenever it is
+# saved or deleted, with its course code, title or number as keywords and its
+# plain text. On PostgreSQL the row's tsvector is searched through a GIN index,
+# elsewhere an inverted index of the rows is kept in process.
+#
+# A document matches when it contains every word of the query. Matches in
+# keywords rank above matches in text.
+
+_DEFAULTS = {
+    # Dotted path of the backend class, by default chosen by database.
+    'BACKEND': None,
+    # Text search configuration of PostgreSQL, for stemming and stop words.
+    'CONFIG': 'english',
+}
+
+# Relative weights of matches in keywords and text, PostgreSQL's defaults for
+# A and B.
+_KEYWORDS_WEIGHT = 1.0
+_TEXT_WEIGHT = 0.4
+
+_SNIPPET_WORDS = 30
+_WORD = re.compile(r'\w+')
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'SEARCH', {}).get(name, _DEFAULTS[name])
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend = get_setting('BACKEND')
+            if backend is not None:
+                _backend = import_string(backend)()
+            elif connection.vendor == 'postgresql':
+                _backend = PostgreSQLBackend()
+            else:
+                _backend = InProcessBackend()
+        return _backend
+
+
+def words(text):
+    return _WORD.findall(text.lower())
+
+
+# Returns the count of documents matching query, of one of kinds if given,
+# and the page of them from offset, best first. Each has a rank.
+def search(query, kinds=None, offset=0, limit=20):
+    return get_backend().search(query, kinds, offset, limit)
+
+
+class PostgreSQLBackend(object):
+
+    def search(self, query, kinds, offset, limit):
+        search_query = SearchQuery(query, config=get_setting('CONFIG'))
+        documents = SearchDocument.objects.filter(search_vector=search_query)
+        if kinds:
+            documents = documents.filter(kind__in=kinds)
+
+        count = documents.count()
+        page = list(documents.annotate(rank=SearchRank(F('search_vector'), search_query))
+                    .order_by('-rank', 'id')[offset:offset + limit])
+        return count, page
+
+    def indexed(self, documents):
+        config = get_setting('CONFIG')
+        SearchDocument.objects.filter(pk__in=[document.pk for document in documents]).update(
+            search_vector=SearchVector('keywords', weight='A', config=config) +
+            SearchVector('text', weight='B', config=config))
+
+    def removed(self, kind, object_id):
+        pass
+
+    def rebuilt(self):
+        config = get_setting('CONFIG')
+        SearchDocument.objects.update(
+            search_vector=SearchVector('keywords', weight='A', config=config) +
+            SearchVector('text', weight='B', config=config))
+
+
+# Inverted index of the SearchDocument table: the weighted count of each word
+# in each document. Documents indexed or removed by this process are applied
+# to it once committed; any other change to the table, by another process or
+# a rolled back transaction, is noticed by the table's count, latest id and
+# latest update no longer matching, and the index is rebuilt. This is meant
+# for development and tests: a change by another process committed just
+# before one of this process is applied can go unnoticed until the next.
+class InProcessBackend(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.documents = {}
+        self.state = None
+
+    def get_state(self):
+        state = SearchDocument.objects.aggregate(count=Count('id'), id=Max('id'), updated_at=Max('updated_at'))
+        return state['count'], state['id'], state['updated_at']
+
+    def refresh(self):
+        state = self.get_state()
+        if state == self.state:
+            return
+
+        self.postings = {}
+        self.documents = {}
+        for document in SearchDocument.objects.values('id', 'kind', 'object_id', 'keywords', 'text'):
+            self.add(document)
+        self.state = state
+
+    def add(self, document):
+        key = (document['kind'], document['object_id'])
+        self.remove(key)
+
+        weights = {}
+        for word in words(document['keywords']):
+            weights[word] = weights.get(word, 0) + _KEYWORDS_WEIGHT
+        for word in words(document['text']):
+            weights[word] = weights.get(word, 0) + _TEXT_WEIGHT
+
+        self.documents[key] = (document['id'], document['kind'], list(weights))
+        for word, weight in weights.items():
+            self.postings.setdefault(word, {})[key] = weight
+
+    def remove(self, key):
+        document = self.documents.pop(key, None)
+        if document is None:
+            return
+
+        for word in document[2]:
+            postings = self.postings[word]
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[word]
+
+    def search(self, query, kinds, offset, limit):
+        query_words = set(words(query))
+
+        with self.lock:
+            self.refresh()
+
+            postings = [self.postings.get(word, {}) for word in query_words]
+            if not postings:
+                return 0, []
+            matches = set(postings[0]).intersection(*postings[1:])
+            if kinds:
+                matches = set(key for key in matches if key[0] in kinds)
+            if not matches:
+                return 0, []
+
+            total = len(self.documents)
+            ranks = dict((key, 0.0) for key in matches)
+            for word_postings in postings:
+                idf = math.log(1 + total / len(word_postings))
+                for key in matches:
+                    ranks[key] += word_postings[key] * idf
+            ids = dict((key, self.documents[key][0]) for key in matches)
+
+        ranked = sorted(matches, key=lambda key: (-ranks[key], ids[key]))[offset:offset + limit]
+        documents = SearchDocument.objects.in_bulk([ids[key] for key in ranked])
+        page = []
+        for key in ranked:
+            document = documents.get(ids[key])
+            if document is not None:
+                document.rank = ranks[key]
+                page.append(document)
+        return len(matches), page
+
+    def indexed(self, documents):
+        # Bulk inserts on SQLite leave ids unset, rebuild rather than fetch
+        # them.
+        if any(document.id is None for document in documents):
+            transaction.on_commit(self.rebuilt)
+            return
+
+        values = [{'id': document.id, 'kind': document.kind, 'object_id': document.object_id,
+                   'keywords': document.keywords, 'text': document.text} for document in documents]
+
+        def add_all():
+            for document in values:
+                self.add(document)
+        transaction.on_commit(lambda: self.apply(add_all))
+
+    def removed(self, kind, object_id):
+        transaction.on_commit(lambda: self.apply(lambda: self.remove((kind, object_id))))
+
+    def rebuilt(self):
+        with self.lock:
+            self.state = None
+
+    # Applies a change made by this process, unless the index is already out
+    # of date and will be rebuilt anyway.
+    def apply(self, change):
+        with self.lock:
+            if self.state is None:
+                return
+            change()
+            self.state = self.get_state()
+
+
+# Returns text, or keywords if it has none, cut to the words around the
+# first match of query, with matches in <b></b> and the rest HTML escaped.
+# Words starting with a word of query match, as a stemmed search would.
+def snippet(document, query):
+    query_words = words(query)
+    text_words = (document.text or document.keywords).split()
+
+    def matches(word):
+        normalized = ''.join(words(word))
+        return any(normalized.startswith(query_word) for query_word in query_words)
+
+    first = next((i for i, word in enumerate(text_words) if matches(word)), 0)
+    start = max(first - _SNIPPET_WORDS // 3, 0)
+    end = start + _SNIPPET_WORDS
+
+    parts = []
+    for word in text_words[start:end]:
+        escaped = html.escape(word)
+        parts.append('<b>' + escaped + '</b>' if matches(word) else escaped)
+
+    return ('… ' if start > 0 else '') + ' '.join(parts) + (' …' if end < len(text_words) else '')
+
+
+# Writes document, a dict of SearchDocument fields, to the index.
+def index(document):
+    kind = document.pop('kind')
+    object_id = document.pop('object_id')
+    document, _ = SearchDocument.objects.update_or_create(kind=kind, object_id=object_id, defaults=document)
+    get_backend().indexed([document])
+
+
+def unindex(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+    get_backend().removed(kind, object_id)
+
+
+def paper_document(paper):
+    title = paper.title.title
+    return {
+        'kind': SearchDocument.PAPER, 'object_id': paper.id, 'paper_id': paper.id,
+        'keywords': ' '.join([paper.course, str(paper.year), title]),
+    }
+
+
+def question_document(question, course):
+    return {
+        'kind': SearchDocument.QUESTION, 'object_id': question.id, 'paper_id': question.paper_id,
+        'question_id': question.id, 'keywords': course + ' ' + question.number,
+    }
+
+
+def answer_document(answer, paper_id):
+    return {
+        'kind': SearchDocument.ANSWER, 'object_id': answer.id, 'paper_id': paper_id,
+        'question_id': answer.question_id, 'answer_id': answer.id, 'text': answer.text,
+    }
+
+
+def comment_document(comment, question_id, paper_id):
+    return {
+        'kind': SearchDocument.COMMENT, 'object_id': comment.id, 'paper_id': paper_id,
+        'question_id': question_id, 'answer_id': comment.answer_id, 'text': comment.text,
+    }
+
+
+# Questions are created in bulk, without signals, see QuestionListSerializer.
+# Being new, they are indexed in bulk too.
+def index_questions(questions, course):
+    documents = SearchDocument.objects.bulk_create([
+        SearchDocument(**question_document(question, course)) for question in questions
+    ])
+    get_backend().indexed(documents)
+
+
+# Indexes every paper, question, answer and comment afresh, in bulk.
+def rebuild():
+    documents = []
+
+    courses = {}
+    for paper in Paper.objects.select_related('title'):
+        documents.append(paper_document(paper))
+        courses[paper.id] = paper.course
+
+    paper_ids = {}
+    for question in Question.objects.all():
+        documents.append(question_document(question, courses[question.paper_id]))
+        paper_ids[question.id] = question.paper_id
+
+    question_ids = {}
+    for answer in Answer.objects.only('id', 'question_id', 'text'):
+        documents.append(answer_document(answer, paper_ids[answer.question_id]))
+        question_ids[answer.id] = answer.question_id
+
+    for comment in Comment.objects.only('id', 'answer_id', 'text'):
+        question_id = question_ids[comment.answer_id]
+        documents.append(comment_document(comment, question_id, paper_ids[question_id]))
+
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        SearchDocument.objects.bulk_create([SearchDocument(**document) for document in documents],
+                                           batch_size=500)
+        get_backend().rebuilt()
+
+    return len(documents)
+
+
+# Fixtures loaded by loaddata are saved raw, with their related rows possibly
+# not loaded yet, and are not indexed. Run rebuild_search_index after loading
+# them.
+@receiver(post_save, sender=Paper)
+def paper_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    index(paper_document(instance))
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    course = Paper.objects.values_list('course', flat=True).get(pk=instance.paper_id)
+    index(question_document(instance, course))
+
+
+@receiver(post_save, sender=Answer)
+def answer_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    paper_id = Question.objects.values_list('paper_id', flat=True).get(pk=instance.question_id)
+    index(answer_document(instance, paper_id))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    question_id, paper_id = Answer.objects.values_list('question_id', 'question__paper_id') \
+        .get(pk=instance.answer_id)
+    index(comment_document(instance, question_id, paper_id))
+
+
+_KINDS = {
+    Paper: SearchDocument.PAPER,
+    Question: SearchDocument.QUESTION,
+    Answer: SearchDocument.ANSWER,
+    Comment: SearchDocument.COMMENT,
+}
+
+
+@receiver(post_delete, sender=Paper)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Answer)
+@receiver(post_delete, sender=Comment)
+def deleted(sender, instance, **kwargs):
+    unindex(_KINDS[sender], instance.id)
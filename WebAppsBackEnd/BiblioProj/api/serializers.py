@@ -1,19 +1,67 @@
+import base64
+import binascii
+from collections import OrderedDict
+
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-import json
 from rest_framework.exceptions import ValidationError
+from api import events, metrics, search
 from api.models import Paper, Question, Comment, Answer, PaperTitle, \
-    MAX_TITLE_LENGTH
+    AnswerChange, Vote, MAX_TITLE_LENGTH
+
+
+# The API's serializers are built on these, so that their validation and output
+# count towards a sampled request's serialize time, see metrics.py. Lists are
+# timed as a whole, by the list_serializer_class of their serializer.
+class TimedSerializerMixin(object):
+    @property
+    @metrics.timed('serialize')
+    def data(self):
+        return super(TimedSerializerMixin, self).data
+
+    @metrics.timed('serialize')
+    def is_valid(self, raise_exception=False):
+        return super(TimedSerializerMixin, self).is_valid(raise_exception)
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    pass
+
+
+# Papers are uploaded as base64 text in JSON but stored as binary. An optional
+# data: URI prefix is ignored.
+class Base64PDFField(serializers.Field):
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            raise ValidationError("PDF must be a base64 encoded string.")
+
+        if data.startswith('data:'):
+            data = data.partition(',')[2]
+
+        try:
+            return base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError):
+            raise ValidationError("PDF is not valid base64.")
+
+    def to_representation(self, value):
+        return base64.b64encode(bytes(value)).decode('ascii')
 
 
 # NOTE: Currently no update or delete Paper
 # TODO: On POST, make title field of JSON be the title, not 'PaperTitle object'.
-class PaperSerializer(serializers.ModelSerializer):
+class PaperSerializer(TimedModelSerializer):
     title = serializers.CharField(max_length=MAX_TITLE_LENGTH)
+    pdf = Base64PDFField(write_only=True)
 
     class Meta:
         model = Paper
         fields = '__all__'
+        read_only_fields = ('pdf_size', 'pdf_sha1', 'answer_count', 'comment_count', 'last_activity')
 
     def create(self, validated_data):
         course = validated_data['course']
@@ -33,7 +81,7 @@ class PaperSerializer(serializers.ModelSerializer):
                 )
 
             # Check title matches the title of existing papers of the same course.
-            paper_title = papers_of_that_course.first().title
+            paper_title = papers_of_that_course.select_related('title').first().title
             correct_title = paper_title.title
             if title != correct_title:
                 raise ValidationError(
@@ -51,11 +99,58 @@ class PaperSerializer(serializers.ModelSerializer):
         return Paper.objects.create(**validated_data)
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+# Creates the questions of a paper in bulk: the paper is fetched once, numbers
+# are checked for duplicates against one query, and every question is inserted
+# in the same transaction, so either all of them are created or none are.
+class QuestionListSerializer(TimedListSerializer):
+    def create(self, validated_data):
+        paper = Paper.objects.filter(pk=self.context['paper_id']).first()
+
+        # Fail if paper does not exist
+        if paper is None:
+            raise ValidationError("Creating question for paper that does not "
+                                  "exist: " + str(self.context['paper_id']))
+
+        numbers = [attrs['number'] for attrs in validated_data]
+        existing = set(Question.objects.filter(paper=paper, number__in=numbers)
+                       .values_list('number', flat=True))
+
+        # Fail if any (paper, number) pair already exists, or is given twice
+        for number in numbers:
+            if number in existing:
+                raise ValidationError("Question number \'" + number + "\' of "
+                                      "paper \'" + str(paper.id) + "\' already "
+                                      "exists.")
+            existing.add(number)
+
+        questions = [Question(paper=paper, **attrs) for attrs in validated_data]
+
+        try:
+            with transaction.atomic():
+                Question.objects.bulk_create(questions)
+        except IntegrityError:
+            # Lost a race with another upload of the same questions.
+            raise ValidationError("Questions of paper \'" + str(paper.id) + "\' "
+                                  "were added by another request, try again.")
+
+        # Backends that cannot return the ids of a bulk insert (SQLite) leave
+        # them unset, fetch them back in one query.
+        if questions and questions[0].pk is None:
+            ids = dict(Question.objects.filter(paper=paper, number__in=numbers)
+                       .values_list('number', 'id'))
+            for question in questions:
+                question.pk = ids[question.number]
+
+        search.index_questions(questions, paper.course)
+        return questions
+
+
+class QuestionSerializer(TimedModelSerializer):
     class Meta:
         model = Question
-        fields = ('id', 'number',)
-        read_only_fields = ('id',)
+        fields = ('id', 'number', 'answer_count', 'comment_count', 'last_activity')
+        read_only_fields = ('id', 'answer_count', 'comment_count', 'last_activity')
+        list_serializer_class = QuestionListSerializer
 
     def create(self, validated_data):
         # Get paper
@@ -80,13 +175,13 @@ class QuestionSerializer(serializers.ModelSerializer):
         return Question.objects.create(**validated_data)
 
 
-class NewUserSerializer(serializers.ModelSerializer):
+class NewUserSerializer(TimedModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'password')
 
 
-class OtherUserSerializer(serializers.ModelSerializer):
+class OtherUserSerializer(TimedModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username',)
@@ -100,36 +195,51 @@ class OtherUserSerializer(serializers.ModelSerializer):
         return u
 
 
-class AnswerSerializer(serializers.ModelSerializer):
+# Written as the html given, read back sanitized, see derive_from_html().
+class SanitizedHTMLField(serializers.CharField):
+    def get_attribute(self, instance):
+        return instance.safe_html
+
+
+class AnswerSerializer(TimedModelSerializer):
     cannot_update_fields = ['user', 'question', 'timestamp']
     user = OtherUserSerializer(required=True)
+    html = SanitizedHTMLField()
     can_vote = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Answer
         fields = ('id', 'user', 'votes', 'timestamp', 'html', 'can_vote', 'question')
         read_only_fields = ('can_vote',)
+        list_serializer_class = TimedListSerializer
 
-    def get_can_vote(self, answer):
-        NOT_APPLICABLE = -1
-        CAN_VOTE = 1
-        CANT_VOTE = 0
+    NOT_APPLICABLE = -1
+    CAN_VOTE = 1
+    CANT_VOTE = 0
 
+    def get_can_vote(self, answer):
         if 'user_id' not in self.context.keys():
-            return NOT_APPLICABLE
+            return self.NOT_APPLICABLE
 
         user_id = self.context['user_id']
 
-        json_dec = json.decoder.JSONDecoder()
-        user_ids = [] if answer.user_voted == "" else json_dec.decode(answer.user_voted)
+        # List views look up every vote of the user at once, see
+        # can_vote_context().
+        if 'voted_answer_ids' in self.context:
+            voted = answer.id in self.context['voted_answer_ids']
+        else:
+            voted = Vote.objects.filter(answer=answer, user_id=user_id).exists()
 
-        return CANT_VOTE if user_id in user_ids else CAN_VOTE
+        return self.CANT_VOTE if voted else self.CAN_VOTE
 
     def create(self, validated_data):
         # Can this ever be None?
         validated_data['user'] = validated_data['user'].first()
         assert validated_data['user'] is not None
-        return Answer.objects.create(**validated_data)
+        answer = Answer.objects.create(**validated_data)
+        change = AnswerChange.objects.record(answer, AnswerChange.CREATED)
+        events.publish_answer_change(answer, change, AnswerSerializer(answer).data)
+        return answer
 
     def update(self, instance, validated_data):
         user_data = get_validated_user_data(validated_data)
@@ -142,23 +252,29 @@ class AnswerSerializer(serializers.ModelSerializer):
         instance.votes = validated_data.get('votes', instance.votes)
         instance.html = validated_data.get('html', instance.html)
         instance.save()
+        change = AnswerChange.objects.record(instance, AnswerChange.UPDATED)
+        events.publish_answer_change(instance, change, AnswerSerializer(instance).data)
 
         return instance
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedModelSerializer):
     cannot_update_fields = ['user', 'answer', 'parent', 'timestamp']
     user = OtherUserSerializer(required=True)
+    html = SanitizedHTMLField()
 
     class Meta:
         model = Comment
-        fields = '__all__'
+        fields = ('id', 'user', 'timestamp', 'html', 'answer', 'parent')
+        list_serializer_class = TimedListSerializer
 
     def create(self, validated_data):
         # Can this ever be None?
         validated_data['user'] = validated_data['user'].first()
         assert validated_data['user'] is not None
-        return Comment.objects.create(**validated_data)
+        comment = Comment.objects.create(**validated_data)
+        events.publish_comment_change(comment, events.CREATED, CommentSerializer(comment).data)
+        return comment
 
     def update(self, instance, validated_data):
         user_data = get_validated_user_data(validated_data)
@@ -170,10 +286,168 @@ class CommentSerializer(serializers.ModelSerializer):
         instance.user = user_data.get('id', instance.user)
         instance.html = validated_data.get('html', instance.html)
         instance.save()
+        events.publish_comment_change(instance, events.UPDATED, CommentSerializer(instance).data)
 
         return instance
 
 
+# The fields of a serializer, or some of them, built straight from the rows
+# of a .values() query rather than from model instances by the serializer.
+# Read views serve lists this way, as the serializer's per object and per
+# field overhead is most of their time: every field in full, the same as the
+# serializer would, or those of ?view=summary or ?fields=<name>,<name>.
+class Projection(object):
+
+    # fields is a sequence of (name, columns, represent) in the order the
+    # serializer renders them, where represent(row, context) builds the value
+    # of the field from the columns of the row. keys are the columns always
+    # selected, those of the view's ordering. full is the names of the
+    # serializer's fields, summary those of ?view=summary.
+    def __init__(self, fields, keys, full, summary):
+        self.fields = OrderedDict((name, (columns, represent)) for name, columns, represent in fields)
+        self.keys = keys
+        self.full = full
+        self.summary = summary
+
+    # Returns the names of the fields asked for, in serializer order, or None
+    # for full, raising ValueError if they are not valid.
+    def get_fields(self, query_params):
+        view = query_params.get('view')
+        names = query_params.get('fields')
+
+        if view is not None and view not in ('full', 'summary'):
+            raise ValueError("view must be full or summary, not " + view + ".")
+        if names is None:
+            return list(self.summary) if view == 'summary' else None
+        if view is not None:
+            raise ValueError("Give either view or fields, not both.")
+
+        names = set(name for name in names.split(',') if name)
+        unknown = names.difference(self.fields)
+        if unknown:
+            raise ValueError("Unknown fields: " + ", ".join(sorted(unknown)) + ".")
+        if not names:
+            raise ValueError("fields must name at least one field.")
+        return [name for name in self.fields if name in names]
+
+    def values(self, queryset, fields):
+        columns = list(self.keys)
+        for name in fields:
+            columns.extend(column for column in self.fields[name][0] if column not in columns)
+        return queryset.values(*columns)
+
+    @metrics.timed('serialize')
+    def serialize(self, rows, fields, context=None):
+        represents = [(name, self.fields[name][1]) for name in fields]
+        return [OrderedDict((name, represent(row, context)) for name, represent in represents) for row in rows]
+
+
+_DATE_TIME_FIELD = serializers.DateTimeField()
+
+
+def _column(column):
+    return lambda row, context: row[column]
+
+
+def _represent_user(row, context):
+    return OrderedDict([('id', row['user_id']), ('username', row['user__username'])])
+
+
+def _represent_timestamp(row, context):
+    return _DATE_TIME_FIELD.to_representation(row['timestamp'])
+
+
+# As AnswerSerializer.get_can_vote(), from can_vote_context().
+def _represent_can_vote(row, context):
+    if context is None:
+        return AnswerSerializer.NOT_APPLICABLE
+    return AnswerSerializer.CANT_VOTE if row['id'] in context['voted_answer_ids'] else AnswerSerializer.CAN_VOTE
+
+
+_USER_COLUMNS = ('user_id', 'user__username')
+
+# AnswerSerializer's fields, and the excerpt of the answer's text.
+ANSWER_PROJECTION = Projection([
+    ('id', ('id',), _column('id')),
+    ('user', _USER_COLUMNS, _represent_user),
+    ('votes', ('votes',), _column('votes')),
+    ('timestamp', ('timestamp',), _represent_timestamp),
+    ('html', ('safe_html',), _column('safe_html')),
+    ('excerpt', ('excerpt',), _column('excerpt')),
+    ('can_vote', ('id',), _represent_can_vote),
+    ('question', ('question_id',), _column('question_id')),
+], keys=('id', 'votes', 'timestamp'),
+   full=('id', 'user', 'votes', 'timestamp', 'html', 'can_vote', 'question'),
+   summary=('id', 'user', 'votes', 'timestamp', 'excerpt', 'can_vote'))
+
+# CommentSerializer's fields, and the excerpt of the comment's text.
+COMMENT_PROJECTION = Projection([
+    ('id', ('id',), _column('id')),
+    ('user', _USER_COLUMNS, _represent_user),
+    ('timestamp', ('timestamp',), _represent_timestamp),
+    ('html', ('safe_html',), _column('safe_html')),
+    ('excerpt', ('excerpt',), _column('excerpt')),
+    ('answer', ('answer_id',), _column('answer_id')),
+    ('parent', ('parent_id',), _column('parent_id')),
+], keys=('id', 'timestamp'),
+   full=('id', 'user', 'timestamp', 'html', 'answer', 'parent'),
+   summary=('id', 'user', 'excerpt', 'timestamp', 'parent'))
+
+
+# Splits comments, the .values() rows of COMMENT_PROJECTION's full fields of
+# all the comments of one answer in id order, into the top level comments and
+# an index of the replies to each comment, in one pass. A comment whose parent
+# is not among comments is treated as top level.
+def index_comment_replies(comments):
+    ids = set(comment['id'] for comment in comments)
+    roots = []
+    replies = {}
+
+    for comment in comments:
+        if comment['parent_id'] is None or comment['parent_id'] not in ids:
+            roots.append(comment)
+        else:
+            replies.setdefault(comment['parent_id'], []).append(comment)
+
+    return roots, replies
+
+
+# Serializes the threads under roots, each comment with its replies nested in
+# 'children'. Replies more than depth levels below a top level comment are
+# left out, and the comments they reply to marked 'truncated'. The tree is
+# walked without recursion, so neither its size nor its depth is a problem.
+def serialize_comment_threads(roots, replies, depth=None):
+    nodes = []
+    stack = [(root, 0) for root in roots]
+
+    while stack:
+        comment, level = stack.pop()
+        nodes.append((comment, level))
+        if depth is None or level < depth:
+            stack.extend((reply, level + 1) for reply in replies.get(comment['id'], ()))
+
+    data = COMMENT_PROJECTION.serialize([comment for comment, _ in nodes], COMMENT_PROJECTION.full)
+    serialized = dict((comment['id'], comment_data) for (comment, _), comment_data in zip(nodes, data))
+
+    for comment, level in nodes:
+        comment_data = serialized[comment['id']]
+        comment_replies = replies.get(comment['id'], ())
+        expanded = depth is None or level < depth
+
+        comment_data['children'] = [serialized[reply['id']] for reply in comment_replies] if expanded else []
+        comment_data['truncated'] = bool(comment_replies) and not expanded
+
+    return [serialized[root['id']] for root in roots]
+
+
+# Context for serializing many answers with AnswerSerializer, holding the ids
+# of those the user has voted on out of votes, fetched in one query.
+def can_vote_context(user_id, votes):
+    voted_answer_ids = set(votes.filter(user_id=user_id).values_list('answer_id', flat=True))
+    return {'user_id': user_id, 'voted_answer_ids': voted_answer_ids}
+
+
+
 def get_validated_user_data(validated_data):
     return validated_data.pop('user', {})
 
@@ -1,14 +1,47 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
 from collections import OrderedDict
 from datetime import datetime
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
 
+from django.apps import apps
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, connections
+from django.db.utils import OperationalError
+from django.test import LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve
-from rest_framework import status
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIClient
-
-from api.models import Paper, Question, Answer, Comment, PaperTitle
-from api.serializers import QuestionSerializer, AnswerSerializer, CommentSerializer
+from rest_framework_jwt.settings import api_settings as jwt_settings
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from api import benchmark, caching, events, loadtest, metrics
+from api.authentication import TokenUser
+from api.db import health
+from api.db.backends.postgresql_pool.base import ConnectionPool
+from api.models import Paper, Question, Answer, Comment, PaperTitle, AnswerChange, Vote, SearchDocument
+from api.redis_cache import RedisCache
+from api.renderers import FastJSONRenderer
+from api.text import excerpt, html_to_text, sanitize_html
+from api.serializers import QuestionSerializer, AnswerSerializer, CommentSerializer, can_vote_context
 
 # This User info is reserved during testing
 _TEST_USER_ID       = 200000
@@ -37,12 +70,30 @@ def tearDownModule():
 # Forces authentication for the client using the _test_user
 class AuthAPITestCase(APITestCase):
     def setUp(self):
+        # Cached data of other tests' databases must not leak in.
+        cache.clear()
         self.client.force_login(user=_test_user)
 
     def tearDown(self):
         self.client.logout()
 
 
+# Checks the number of queries each endpoint makes. Budgets are fixed, so a
+# query per returned row (an N+1) fails the test as soon as the data grows.
+class QueryBudgetTestCase(AuthAPITestCase):
+    def assertQueryBudget(self, url, budget):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(
+                len(queries), budget,
+                msg="GET " + url + " made " + str(len(queries)) + " queries, budget is " +
+                    str(budget) + ":\n" + "\n".join(q['sql'] for q in queries.captured_queries)
+        )
+        return response
+
+
 class RetrievePdfFromDBTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -57,6 +108,334 @@ class RetrievePdfFromDBTestCase(TestCase):
             self.fail("Calling get() on Paper.objects with course=C212 and year=2016 raised DoesNotExist exception")
 
 
+class DownloadPaperPdf(AuthAPITestCase):
+    PDF = b'%PDF-1.4 ' + bytes(range(256)) * 10
+
+    @classmethod
+    def setUpTestData(cls):
+        super(DownloadPaperPdf, cls).setUpTestData()
+        t = PaperTitle.objects.create(title="__TEST__")
+        Paper.objects.create(course="C212", year=2016, title=t, pdf=cls.PDF)
+
+    def test_metadata_does_not_include_pdf(self):
+        response = self.client.get('/api/C212/2016/paper')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data.keys()), {'title', 'paper_id'})
+
+    def test_download_pdf(self):
+        response = self.client.get('/api/C212/2016/paper/pdf')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Length'], str(len(self.PDF)))
+        self.assertEqual(response['ETag'], '"' + hashlib.sha1(self.PDF).hexdigest() + '"')
+        self.assertEqual(b''.join(response.streaming_content), self.PDF)
+
+    def test_download_pdf_in_chunks(self):
+        with mock.patch('api.views._PDF_CHUNK_SIZE', 100):
+            response = self.client.get('/api/C212/2016/paper/pdf', HTTP_RANGE='bytes=50-')
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(len(chunks), 26)
+        self.assertEqual(b''.join(chunks), self.PDF[50:])
+
+    def test_download_unchanged_pdf(self):
+        etag = self.client.get('/api/C212/2016/paper/pdf')['ETag']
+
+        response = self.client.get('/api/C212/2016/paper/pdf', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_download_range(self):
+        for header, start, end in [('bytes=10-19', 10, 19), ('bytes=100-', 100, len(self.PDF) - 1),
+                                   ('bytes=-5', len(self.PDF) - 5, len(self.PDF) - 1)]:
+            response = self.client.get('/api/C212/2016/paper/pdf', HTTP_RANGE=header)
+
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(response['Content-Range'],
+                             'bytes ' + str(start) + '-' + str(end) + '/' + str(len(self.PDF)))
+            self.assertEqual(b''.join(response.streaming_content), self.PDF[start:end + 1])
+
+    def test_download_unsatisfiable_range(self):
+        response = self.client.get('/api/C212/2016/paper/pdf', HTTP_RANGE='bytes=100000-')
+
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_range_ignored_for_changed_pdf(self):
+        response = self.client.get('/api/C212/2016/paper/pdf', HTTP_RANGE='bytes=10-19',
+                                   HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.PDF)
+
+    def test_upload_stores_binary(self):
+        data = {
+            'course': 'C240',
+            'year': 2016,
+            'title': '__TEST__',
+            'pdf': base64.b64encode(self.PDF).decode('ascii')
+        }
+        response = self.client.post('/api/submit/paper', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('pdf', response.data)
+        paper = Paper.objects.with_pdf().get(course='C240', year=2016)
+        self.assertEqual(bytes(paper.pdf), self.PDF)
+        self.assertEqual(paper.pdf_size, len(self.PDF))
+
+    def test_pdf_deferred_unless_downloaded(self):
+        p = Paper.objects.get(course="C212", year=2016)
+        Question.objects.create(number="1", paper=p)
+        self.assertIn('pdf', Paper.objects.get(pk=p.id).get_deferred_fields())
+        self.assertNotIn('pdf', Paper.objects.with_pdf().get(pk=p.id).get_deferred_fields())
+
+        pdf_column = connection.ops.quote_name('pdf')
+        for url in ['/api/available-papers', '/api/C212/2016/paper', '/api/C212/2016/questions']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            for query in queries.captured_queries:
+                self.assertNotIn(pdf_column, query['sql'], msg=url + " loaded the PDF")
+
+        self.assertIn('pdf', Question.objects.get(paper=p).paper.get_deferred_fields())
+
+    def test_upload_rejects_invalid_base64(self):
+        data = {'course': 'C240', 'year': 2016, 'title': '__TEST__', 'pdf': 'not base64!'}
+        response = self.client.post('/api/submit/paper', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CachedAvailablePapers(AuthAPITestCase):
+    logic = None
+    databases = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(CachedAvailablePapers, cls).setUpTestData()
+        t = PaperTitle.objects.create(title="Logic")
+        cls.logic = Paper.objects.create(course="C140", year=2015, title=t)
+        Paper.objects.create(course="C140", year=2016, title=t)
+        t = PaperTitle.objects.create(title="Databases")
+        cls.databases = Paper.objects.create(course="C220", year=2016, title=t)
+
+    def test_available_papers(self):
+        response = self.client.get('/api/available-papers')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        activity = dict((paper.id, {'paper_id': paper.id, 'answer_count': 0, 'comment_count': 0,
+                                    'last_activity': None}) for paper in Paper.objects.all())
+        self.assertEqual(response.data, {
+            'C140': {'Name': 'Logic', 'Years': [2015, 2016], 'paper_id': self.logic.id,
+                     'Activity': [activity[self.logic.id], activity[self.logic.id + 1]]},
+            'C220': {'Name': 'Databases', 'Years': [2016], 'paper_id': self.databases.id,
+                     'Activity': [activity[self.databases.id]]},
+        })
+
+    # Returns the response to a GET of the index, and the queries of it that
+    # read papers.
+    def paper_queries(self, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/available-papers', **extra)
+        return response, [q['sql'] for q in queries.captured_queries if 'api_paper' in q['sql']]
+
+    def test_unchanged_papers_not_modified(self):
+        etag = self.client.get('/api/available-papers')['ETag']
+
+        response, queries = self.paper_queries(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('api_papertitle', queries[0])
+
+    def test_index_cached(self):
+        self.client.get('/api/available-papers')
+
+        response, queries = self.paper_queries()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('api_papertitle', queries[0])
+
+    # The version is read from the database, so a process that missed the
+    # write, as with a cache shared by other servers, sees it.
+    def test_version_read_from_database(self):
+        etag = self.client.get('/api/available-papers')['ETag']
+        Paper.objects.create(course="C240", year=2016, title=PaperTitle.objects.create(title="Models"))
+
+        response = self.client.get('/api/available-papers', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('C240', response.data)
+
+    def test_created_and_deleted_papers_invalidate(self):
+        etag = self.client.get('/api/available-papers')['ETag']
+
+        data = {'course': 'C240', 'year': 2016, 'title': 'Models', 'pdf': ''}
+        paper_id = self.client.post('/api/submit/paper', data, format='json').data['id']
+
+        response = self.client.get('/api/available-papers', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('C240', response.data)
+        etag = response['ETag']
+
+        response = self.client.delete('/api/delete/' + str(paper_id) + '/paper')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get('/api/available-papers', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('C240', response.data)
+
+
+class ConditionalGets(AuthAPITestCase):
+    q = None
+    a = None
+    c = None
+    u = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(ConditionalGets, cls).setUpTestData()
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+        cls.u = User.objects.create_user(username="user", password="password")
+        cls.a = Answer.objects.create(question=cls.q, user=cls.u, html="<p> Answer </p>")
+        cls.c = Comment.objects.create(answer=cls.a, user=_test_user, html="<p> Comment </p>")
+
+    def assertRevalidates(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(not_modified.content)
+        return response['ETag']
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_paper(self):
+        self.assertRevalidates('/api/C141/2015/paper')
+
+    def test_questions(self):
+        url = '/api/C141/2015/questions'
+        etag = self.assertRevalidates(url)
+
+        Question.objects.create(number="2", paper=self.q.paper)
+
+        self.assertModified(url, etag)
+
+    def test_answers(self):
+        url = '/api/' + str(self.q.id) + '/answer'
+        etag = self.assertRevalidates(url)
+
+        self.client.post('/api/upvote/' + str(self.a.id), {})
+
+        self.assertModified(url, etag)
+
+    def test_answers_if_modified_since(self):
+        url = '/api/' + str(self.q.id) + '/answer'
+        self.client.post('/api/upvote/' + str(self.a.id), {})
+        last_modified = self.client.get(url)['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_answers_differ_between_users(self):
+        url = '/api/' + str(self.q.id) + '/answer'
+        etag = self.client.get(url)['ETag']
+
+        client = APIClient()
+        client.force_login(user=self.u)
+
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_comments(self):
+        url = '/api/' + str(self.a.id) + '/comment'
+        etag = self.assertRevalidates(url)
+
+        self.client.post('/api/update/comment', {'id': self.c.id, 'html': "<p> Edited </p>"}, format='json')
+
+        self.assertModified(url, etag)
+
+    # Deleting an older comment changes no timestamp, so comments are only
+    # revalidated by ETag.
+    def test_comments_deleted_not_modified_since(self):
+        url = '/api/' + str(self.a.id) + '/comment'
+        Comment.objects.create(answer=self.a, user=_test_user, html="<p> Newer </p>")
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+
+        self.client.delete('/api/delete/' + str(self.c.id) + '/comment')
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_resource(self):
+        self.assertRevalidates('/api/14/img1.jpg/answers')
+
+    def test_available_papers(self):
+        self.assertRevalidates('/api/available-papers')
+
+
+class ServeResources(AuthAPITestCase):
+    url = '/api/14/img1.jpg/answers'
+
+    def test_streams_file_with_content_type(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        with open(os.path.join(os.path.dirname(__file__), 'answers', '14', 'img1.jpg'), 'rb') as image:
+            content = image.read()
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(response['Content-Length'], str(len(content)))
+        response.close()
+
+    def test_long_lived_cache_headers(self):
+        response = self.client.get(self.url)
+        response.close()
+
+        self.assertIn('ETag', response)
+        self.assertIn('max-age=604800', response['Cache-Control'])
+
+    def test_missing_resource_is_404(self):
+        response = self.client.get('/api/14/missing.jpg/answers')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_path_outside_resource_directory_is_404(self):
+        response = self.client.get('/api/14/../../views.py/answers')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(RESOURCES={'OFFLOAD': 'x-accel-redirect', 'INTERNAL_URL': '/protected/'})
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/answers/14/img1.jpg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertFalse(response.content)
+
+    @override_settings(RESOURCES={'OFFLOAD': 'x-sendfile'})
+    def test_x_sendfile(self):
+        response = self.client.get('/api/23/img1.jpg/comments')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Sendfile'],
+                         os.path.join(os.path.dirname(os.path.realpath(__file__)), 'comments', '23', 'img1.jpg'))
+
+
 class CorrectlySerializesQuestions(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -79,10 +458,14 @@ class CorrectlySerializesQuestions(TestCase):
         # Serialise into (question id, question number)
         serializer = QuestionSerializer(questions, many=True)
         self.assertEqual(serializer.data, [
-                OrderedDict([('id', 1), ('number', '1')]),
-                OrderedDict([('id', 2), ('number', '2')]),
-                OrderedDict([('id', 3), ('number', '3')]),
-                OrderedDict([('id', 4), ('number', '4')])
+                OrderedDict([('id', 1), ('number', '1'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)]),
+                OrderedDict([('id', 2), ('number', '2'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)]),
+                OrderedDict([('id', 3), ('number', '3'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)]),
+                OrderedDict([('id', 4), ('number', '4'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)])
         ])
 
     def test_serializer2(self):
@@ -92,10 +475,14 @@ class CorrectlySerializesQuestions(TestCase):
         # Serialise into (question id, question number)
         serializer = QuestionSerializer(questions, many=True)
         self.assertEqual(serializer.data, [
-                OrderedDict([('id', 5), ('number', '1ai')]),
-                OrderedDict([('id', 6), ('number', '2ai')]),
-                OrderedDict([('id', 7), ('number', '3ai')]),
-                OrderedDict([('id', 8), ('number', '4ai')])
+                OrderedDict([('id', 5), ('number', '1ai'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)]),
+                OrderedDict([('id', 6), ('number', '2ai'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)]),
+                OrderedDict([('id', 7), ('number', '3ai'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)]),
+                OrderedDict([('id', 8), ('number', '4ai'), ('answer_count', 0), ('comment_count', 0),
+                             ('last_activity', None)])
         ])
 
 
@@ -131,16 +518,14 @@ class ValidateGetRequests(AuthAPITestCase):
         ans = []
         for i in range(0, 4):
             for j in range(0, 4):
-                user_voted = []
-                if j % 2 == 0:
-                    user_voted.append(j)
                 a = Answer.objects.create(
                         id=k,
                         question=qs[i],
                         user=us[j],
-                        user_voted=str(user_voted),
                         html="<p> This is a dummy answer <\p>"
                 )
+                if j % 2 == 0:
+                    Vote.objects.create(answer=a, user=us[j])
                 k += 1
                 ans.insert(k, a)
 
@@ -192,19 +577,20 @@ class ValidateGetRequests(AuthAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Test response data can be serialized.
-        serializer = AnswerSerializer(data=response.data, many=True)
+        serializer = AnswerSerializer(data=response.json(), many=True)
         self.assertTrue(serializer.is_valid(), msg=str(serializer.errors))
 
         # Test response data is correct.
         for i in range(0, 4):
-            data = response.data[i]
+            data = response.json()[i]
             r_user_id = data['user']['id']
             self.assertEqual(data['id'], Q_ID * 4 + i)
             self.assertEqual(data['question'], Q_ID)
             self.assertEqual(data['user']['id'], i)
             self.assertEqual(data['user']['username'], "user_" + str(i))
             self.assertEqual(data['votes'], 0)
-            self.assertEqual(data['html'], "<p> This is a dummy answer <\p>")
+            # Served sanitized: the malformed <\p> is text and the <p> closed.
+            self.assertEqual(data['html'], "<p> This is a dummy answer &lt;\p&gt;</p>")
 
     def test_correct_user_can_vote(self):
         Q_ID = 3
@@ -219,7 +605,17 @@ class ValidateGetRequests(AuthAPITestCase):
             client.force_login(user=u)
             response = client.get(url)
 
-            self.assertEqual(response.data[i]['can_vote'], int(not (u.id % 2 == 0)))
+            self.assertEqual(response.json()[i]['can_vote'], int(not (u.id % 2 == 0)))
+
+    def test_can_vote_of_answer_list_uses_one_query(self):
+        Q_ID = 3
+        answers = list(Answer.objects.select_related('user').filter(question_id=Q_ID))
+
+        with self.assertNumQueries(1):
+            context = can_vote_context(0, Vote.objects.filter(answer__question_id=Q_ID))
+            data = AnswerSerializer(answers, many=True, context=context).data
+
+        self.assertEqual([a['can_vote'] for a in data], [0, 1, 1, 1])
 
     def test_get_comments_correctly(self):
         A_ID = 2
@@ -246,7 +642,8 @@ class ValidateGetRequests(AuthAPITestCase):
             self.assertEqual(data['user']['id'], i)
             self.assertEqual(data['user']['username'], "user_" + str(i))
             self.assertEqual(data['parent'], parent_id)
-            self.assertEqual(data['html'], "<p> This is a dummy comment <\p>")
+            # Served sanitized: the malformed <\p> is text and the <p> closed.
+            self.assertEqual(data['html'], "<p> This is a dummy comment &lt;\p&gt;</p>")
 
 
 class RetrievingQuestionsOfNonExistentPaperReturns404(AuthAPITestCase):
@@ -272,6 +669,10 @@ class ValidURLsAreRecognised(TestCase):
         resolver = resolve('/api/23/img1.jpg/answers')
         self.assertEqual(resolver.view_name, 'api.views.AnswerResource')
 
+    def test_answer_changes_url(self):
+        resolver = resolve('/api/25/answer/changes')
+        self.assertEqual(resolver.view_name, 'api.views.AnswerChanges')
+
     def test_put_answer_url(self):
         resolver = resolve("/api/submit/answer/")
         self.assertEqual(resolver.view_name, 'api.views.Answers')
@@ -488,6 +889,40 @@ class SubmitToDatabase(AuthAPITestCase):
         # Test failed this time
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_new_questions_ids_match_database(self):
+        url = '/api/submit/2/questions'
+        data = [{"number": "3a"}, {"number": "3b"}]
+
+        response = self.client.post(url, data, format='json')
+
+        for question in response.data:
+            self.assertEqual(Question.objects.get(pk=question['id']).number, question['number'])
+
+    def test_new_questions_in_constant_queries(self):
+        url = '/api/submit/2/questions'
+        data = [{"number": "q" + str(i)} for i in range(40)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 40)
+        self.assertLess(len(queries), 10)
+
+    def test_duplicate_question_creates_none(self):
+        url = '/api/submit/2/questions'
+        data = [{"number": "4a"}, {"number": "4b"}, {"number": "4a"}]
+
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Question.objects.filter(paper_id=2, number__startswith="4").exists())
+
+    def test_questions_of_non_existent_paper(self):
+        response = self.client.post('/api/submit/999/questions', [{"number": "1"}], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class UpdateDatabase(APITestCase):
     @classmethod
@@ -661,9 +1096,9 @@ class Voting(AuthAPITestCase):
                 question=qs[2],
                 user=_test_user,
                 votes=5,
-                user_voted="[" + str(cls.u.id) + "]",
                 html="<p> This is a dummy answer </p>"
         )
+        Vote.objects.create(answer=a, user=cls.u)
 
         a = Answer.objects.create(
                 question=qs[2],
@@ -682,6 +1117,9 @@ class Voting(AuthAPITestCase):
         # Test votes have increased
         self.assertEquals(response.data['votes'], 1)
 
+        # Test vote recorded
+        self.assertTrue(Vote.objects.filter(answer_id=1, user=_test_user).exists())
+
     def test_downvote_answer(self):
         self.client = APIClient()
         self.client.force_login(user=Voting.u)
@@ -692,9 +1130,26 @@ class Voting(AuthAPITestCase):
         # Test status code
         self.assertEquals(response.status_code, status.HTTP_201_CREATED)
 
-        # Test votes have increased
+        # Test votes have decreased
         self.assertEquals(response.data['votes'], 4)
 
+        # Test vote removed
+        self.assertFalse(Vote.objects.filter(answer_id=2, user=Voting.u).exists())
+
+    def test_cant_downvote_without_voting(self):
+        url = '/api/downvote/3/'
+        response = self.client.post(url, {})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Answer.objects.get(pk=3).votes, 5)
+
+    def test_cant_vote_on_own_answer(self):
+        url = '/api/upvote/2/'
+        response = self.client.post(url, {})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Answer.objects.get(pk=2).votes, 5)
+
     def test_cant_vote_twice(self):
         url = '/api/upvote/3/'
         response = self.client.post(url, {})
@@ -708,6 +1163,1400 @@ class Voting(AuthAPITestCase):
 
 
 
+class AnswerChangeFeed(AuthAPITestCase):
+    q = None
+    u = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(AnswerChangeFeed, cls).setUpTestData()
+
+        # Create dummy PaperTitle
+        t = PaperTitle.objects.create(title="__TEST__")
+
+        # Create dummy paper and question
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+
+        # Create dummy user
+        cls.u = User.objects.create_user(
+                username="user",
+                password="password"
+        )
+
+    def url(self, since=None):
+        url = '/api/' + str(self.q.id) + '/answer/changes'
+        if since is not None:
+            url += '?since=' + str(since)
+        return url
+
+    def submit_answer(self, html):
+        data = {
+                'question': str(self.q.id),
+                'user': {'id': self.u.id, 'username': self.u.username},
+                'html': html
+        }
+        response = self.client.post('/api/submit/answer/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def test_initial_request_returns_all_answers(self):
+        first = self.submit_answer("<p> First answer </p>")
+        second = self.submit_answer("<p> Second answer </p>")
+
+        response = self.client.get(self.url())
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([a['id'] for a in response.data['answers']], [first, second])
+        self.assertEqual(response.data['deleted'], [])
+        self.assertEqual(response.data['cursor'], AnswerChange.objects.latest('id').id)
+
+    def test_unchanged_question_returns_no_content(self):
+        self.submit_answer("<p> First answer </p>")
+        cursor = self.client.get(self.url()).data['cursor']
+
+        response = self.client.get(self.url(cursor))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(response.content)
+
+    def test_missing_question_not_found(self):
+        response = self.client.get('/api/999999/answer/changes?since=0')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # Replacing an answer's change deletes the old one first. The latest
+    # change of the question, the answers' cached version, must never go
+    # back to an older one, even if the new change fails to be written.
+    def test_version_never_decreases(self):
+        first = Answer.objects.get(pk=self.submit_answer("<p> First answer </p>"))
+        second = Answer.objects.get(pk=self.submit_answer("<p> Second answer </p>"))
+        versions = [caching.answers_version(self.q.id)[0]]
+
+        for answer in [first, second, first]:
+            AnswerChange.objects.record(answer, AnswerChange.UPDATED)
+            versions.append(caching.answers_version(self.q.id)[0])
+
+        with mock.patch.object(AnswerChange.objects, 'create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                AnswerChange.objects.record(first, AnswerChange.VOTED)
+        versions.append(caching.answers_version(self.q.id)[0])
+
+        self.assertEqual(versions, sorted(versions))
+        self.assertEqual(versions[-1], versions[-2])
+        self.assertEqual(AnswerChange.objects.filter(answer_id=first.id).count(), 1)
+
+    def test_returns_only_changed_answers(self):
+        self.submit_answer("<p> First answer </p>")
+        second = self.submit_answer("<p> Second answer </p>")
+        cursor = self.client.get(self.url()).data['cursor']
+
+        response = self.client.post('/api/upvote/' + str(second), {})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(self.url(cursor))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['answers']), 1)
+        self.assertEqual(response.data['answers'][0]['id'], second)
+        self.assertEqual(response.data['answers'][0]['votes'], 1)
+        self.assertGreater(response.data['cursor'], cursor)
+
+    def test_returns_deleted_answers(self):
+        first = self.submit_answer("<p> First answer </p>")
+        cursor = self.client.get(self.url()).data['cursor']
+
+        response = self.client.delete('/api/delete/' + str(first) + '/answer')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(self.url(cursor))
+
+        self.assertEqual(response.data['answers'], [])
+        self.assertEqual(response.data['deleted'], [first])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url('abc'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PushEvents(AuthAPITestCase):
+    q = None
+    u = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(PushEvents, cls).setUpTestData()
+
+        # Create dummy PaperTitle
+        t = PaperTitle.objects.create(title="__TEST__")
+
+        # Create dummy paper and question
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+
+        # Create dummy user
+        cls.u = User.objects.create_user(
+                username="user",
+                password="password"
+        )
+
+    def setUp(self):
+        super(PushEvents, self).setUp()
+        events.reset_broker()
+        self.subscription = events.get_broker().subscribe([
+                events.question_channel(self.q.id),
+        ])
+
+    def tearDown(self):
+        self.subscription.close()
+        super(PushEvents, self).tearDown()
+
+    def next_event(self):
+        message = self.subscription.get(timeout=1)
+        self.assertIsNotNone(message)
+        return message['event'], json.loads(message['data'])
+
+    def submit_answer(self):
+        data = {
+                'question': str(self.q.id),
+                'user': {'id': self.u.id, 'username': self.u.username},
+                'html': "<p> Pushed answer </p>"
+        }
+        return self.client.post('/api/submit/answer/', data, format='json').data['id']
+
+    def test_answer_events(self):
+        a_id = self.submit_answer()
+        event, data = self.next_event()
+        self.assertEqual(event, 'answer.created')
+        self.assertEqual(data['question'], self.q.id)
+        self.assertEqual(data['answer']['id'], a_id)
+
+        self.client.post('/api/upvote/' + str(a_id), {})
+        event, data = self.next_event()
+        self.assertEqual(event, 'answer.voted')
+        self.assertEqual(data['answer'], {'id': a_id, 'votes': 1})
+
+        self.client.delete('/api/delete/' + str(a_id) + '/answer')
+        event, data = self.next_event()
+        self.assertEqual(event, 'answer.deleted')
+        self.assertEqual(data['answer'], {'id': a_id})
+
+    def test_comment_events(self):
+        a_id = self.submit_answer()
+        self.next_event()
+
+        data = {
+                'user': {'id': self.u.id, 'username': self.u.username},
+                'answer': str(a_id),
+                'html': "<p> Pushed comment </p>"
+        }
+        c_id = self.client.post('/api/submit/comment/', data, format='json').data['id']
+        event, data = self.next_event()
+        self.assertEqual(event, 'comment.created')
+        self.assertEqual(data['comment']['id'], c_id)
+
+        self.client.delete('/api/delete/' + str(c_id) + '/comment')
+        event, data = self.next_event()
+        self.assertEqual(event, 'comment.deleted')
+        self.assertEqual(data['comment'], {'id': c_id, 'answer': a_id})
+
+    def stream_token(self):
+        response = self.client.post('/api/events/token')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['expires_in'], events.get_setting('TOKEN_LIFETIME'))
+        return response.data['token']
+
+    @override_settings(EVENTS={'HEARTBEAT': 1, 'STREAM_TIMEOUT': 1})
+    def test_stream_with_token_in_query_string(self):
+        token = self.stream_token()
+
+        client = APIClient()
+        response = client.get('/api/paper/' + str(self.q.paper_id) + '/events?token=' + token,
+                              HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        a_id = self.submit_answer()
+        body = b''.join(response.streaming_content).decode('utf-8')
+        response.close()
+
+        self.assertIn('event: answer.created\n', body)
+        self.assertIn('"id":' + str(a_id), body)
+
+    @override_settings(EVENTS={'MAX_STREAMS': 1})
+    def test_streams_over_cap_refused(self):
+        url = '/api/' + str(self.q.id) + '/events'
+        first = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/api/paper/' + str(self.q.paper_id) + '/events',
+                                   HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        # Closed unread, as when the browser goes away before the first event.
+        first.close()
+        response = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response.close()
+
+    def test_stream_requires_authentication(self):
+        response = APIClient().get('/api/' + str(self.q.id) + '/events')
+        self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+    # The long-lived JWT must not end up in URLs, nor the stream token work
+    # anywhere else.
+    def test_stream_token_and_jwt_not_interchangeable(self):
+        jwt = jwt_settings.JWT_ENCODE_HANDLER(jwt_settings.JWT_PAYLOAD_HANDLER(self.u))
+        response = APIClient().get('/api/' + str(self.q.id) + '/events?token=' + jwt)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='JWT ' + self.stream_token())
+        response = client.get('/api/' + str(self.q.id) + '/answer')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_missing_paper_not_found_as_event_stream(self):
+        response = self.client.get('/api/paper/0/events', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_stream_token_rejected(self):
+        token = self.stream_token()
+
+        with override_settings(EVENTS={'TOKEN_LIFETIME': -1}):
+            response = APIClient().get('/api/' + str(self.q.id) + '/events?token=' + token)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CommentTree(QueryBudgetTestCase):
+    a = None
+    c = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(CommentTree, cls).setUpTestData()
+
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        q = Question.objects.create(number="1", paper=p)
+        cls.a = Answer.objects.create(question=q, user=_test_user, html="<p> Answer </p>")
+
+        # Three threads: c[0] <- c[1] <- c[2] and c[0] <- c[3], c[4], c[5].
+        cls.c = []
+        for parent in [None, 0, 1, 0, None, None]:
+            cls.c.append(Comment.objects.create(
+                    answer=cls.a,
+                    user=_test_user,
+                    parent=None if parent is None else cls.c[parent],
+                    html="<p> Comment </p>"
+            ))
+
+    def url(self, query=''):
+        return '/api/' + str(self.a.id) + '/comment/tree' + query
+
+    def ids(self, threads):
+        return [thread['id'] for thread in threads]
+
+    def test_nests_replies(self):
+        response = self.client.get(self.url())
+        threads = response.data['threads']
+
+        self.assertEqual(response.data['count'], 3)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.ids(threads), [self.c[0].id, self.c[4].id, self.c[5].id])
+        self.assertEqual(self.ids(threads[0]['children']), [self.c[1].id, self.c[3].id])
+        self.assertEqual(self.ids(threads[0]['children'][0]['children']), [self.c[2].id])
+        self.assertEqual(threads[0]['user']['username'], _TEST_USER_USERNAME)
+        self.assertFalse(threads[0]['truncated'])
+
+    def test_depth_limit(self):
+        threads = self.client.get(self.url('?depth=1')).data['threads']
+
+        reply = threads[0]['children'][0]
+        self.assertEqual(reply['children'], [])
+        self.assertTrue(reply['truncated'])
+        self.assertFalse(threads[0]['children'][1]['truncated'])
+
+    def test_pages_top_level_threads(self):
+        first = self.client.get(self.url('?page_size=2')).data
+        self.assertEqual(self.ids(first['threads']), [self.c[0].id, self.c[4].id])
+        self.assertEqual(first['next'], self.c[4].id)
+
+        second = self.client.get(self.url('?page_size=2&after=' + str(first['next']))).data
+        self.assertEqual(self.ids(second['threads']), [self.c[5].id])
+        self.assertIsNone(second['next'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url('?depth=-1')).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url('?page_size=x')).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_non_existent_answer(self):
+        self.assertEqual(self.client.get('/api/999/comment/tree').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deep_thread_in_fixed_queries(self):
+        parent = self.c[2]
+        for i in range(1500):
+            parent = Comment.objects.create(answer=self.a, user=_test_user, parent=parent, html="<p> Reply </p>")
+
+        response = self.assertQueryBudget(self.url(), 5)
+
+        node = response.data['threads'][0]
+        levels = 0
+        while node['children']:
+            node = node['children'][0]
+            levels += 1
+        self.assertEqual(levels, 64)
+        self.assertTrue(node['truncated'])
+
+        response = self.assertQueryBudget(self.url('?root=' + str(node['id'])), 5)
+        self.assertEqual(response.data['threads'][0]['id'], node['id'])
+        self.assertEqual(len(response.data['threads'][0]['children']), 1)
+
+
+class CursorPagination(QueryBudgetTestCase):
+    q = None
+    a = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(CursorPagination, cls).setUpTestData()
+
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+
+        # Votes with ties, so pages split between answers of equal votes.
+        cls.a = []
+        for votes in [3, 1, 3, 0, 2, 3, 1]:
+            cls.a.append(Answer.objects.create(question=cls.q, user=_test_user, votes=votes,
+                                               html="<p> Answer </p>"))
+        for i in range(7):
+            Comment.objects.create(answer=cls.a[0], user=_test_user, html="<p> Comment " + str(i) + " </p>")
+
+    def answers_url(self, query):
+        return '/api/' + str(self.q.id) + '/answer' + query
+
+    def comments_url(self, query):
+        return '/api/' + str(self.a[0].id) + '/comment' + query
+
+    # Follows 'next' cursors from the first page, returning the ids seen.
+    def page_through(self, url, page_size):
+        ids = []
+        response = self.client.get(url('?page_size=' + str(page_size)))
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), page_size)
+            ids.extend(row['id'] for row in response.data['results'])
+            if response.data['next'] is None:
+                return ids
+            response = self.client.get(url('?page_size=' + str(page_size) + '&cursor=' + response.data['next']))
+
+    def test_answers_by_votes(self):
+        expected = [a.id for a in sorted(self.a, key=lambda a: (-a.votes, -a.timestamp.timestamp(), -a.id))]
+
+        self.assertEqual(self.page_through(self.answers_url, 2), expected)
+        self.assertEqual(self.page_through(self.answers_url, 100), expected)
+
+    def test_comments_oldest_first(self):
+        expected = list(Comment.objects.filter(answer=self.a[0]).order_by('timestamp', 'id')
+                        .values_list('id', flat=True))
+
+        self.assertEqual(self.page_through(self.comments_url, 3), expected)
+
+    def test_top_answers(self):
+        response = self.client.get(self.answers_url('?top=3'))
+
+        self.assertEqual([answer['votes'] for answer in response.data], [3, 3, 3])
+
+    def test_unpaged_without_parameters(self):
+        response = self.client.get(self.answers_url(''))
+
+        self.assertEqual(len(response.json()), 7)
+
+    def test_invalid_cursor(self):
+        for cursor in ['x', 'WzFd', 'WyJ4IiwgIngiLCAieCJd']:
+            response = self.client.get(self.answers_url('?cursor=' + cursor))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=cursor)
+
+    def test_later_pages_cost_the_same(self):
+        first = self.assertQueryBudget(self.answers_url('?page_size=2'), 6)
+        self.assertQueryBudget(self.answers_url('?page_size=2&cursor=' + first.data['next']), 6)
+
+
+class SummaryProjection(QueryBudgetTestCase):
+    q = None
+    a = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(SummaryProjection, cls).setUpTestData()
+
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+
+        cls.a = []
+        for votes in [2, 0, 1]:
+            cls.a.append(Answer.objects.create(question=cls.q, user=_test_user, votes=votes,
+                                               html="<p>Answer with " + "many words " * 50 + "</p>"))
+        Vote.objects.create(answer=cls.a[1], user=_test_user)
+        Comment.objects.create(answer=cls.a[0], user=_test_user, html="<p> Comment </p>")
+
+    def answers_url(self, query):
+        return '/api/' + str(self.q.id) + '/answer' + query
+
+    def test_answers_summary(self):
+        full = dict((answer['id'], answer) for answer in self.client.get(self.answers_url('')).json())
+
+        response = self.assertQueryBudget(self.answers_url('?view=summary'), 6)
+
+        self.assertEqual(len(response.json()), 3)
+        for answer in response.json():
+            self.assertEqual(list(answer), ['id', 'user', 'votes', 'timestamp', 'excerpt', 'can_vote'])
+            for field in ['user', 'votes', 'timestamp', 'can_vote']:
+                self.assertEqual(answer[field], full[answer['id']][field])
+            self.assertTrue(answer['excerpt'].startswith('Answer with many words'))
+            self.assertLessEqual(len(answer['excerpt']), 200)
+        self.assertEqual(dict((answer['id'], answer['can_vote']) for answer in response.json()),
+                         {self.a[0].id: 1, self.a[1].id: 0, self.a[2].id: 1})
+
+    def test_answers_fields(self):
+        response = self.client.get(self.answers_url('?fields=votes,id'))
+
+        self.assertEqual(sorted(response.json(), key=lambda answer: answer['id']),
+                         [{'id': a.id, 'votes': a.votes} for a in self.a])
+
+    def test_summary_pages(self):
+        response = self.assertQueryBudget(self.answers_url('?view=summary&page_size=2'), 6)
+        self.assertEqual([answer['votes'] for answer in response.data['results']], [2, 1])
+
+        response = self.client.get(self.answers_url('?view=summary&page_size=2&cursor=' + response.data['next']))
+        self.assertEqual([answer['id'] for answer in response.data['results']], [self.a[1].id])
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_projection(self):
+        for query in ['?view=short', '?fields=id,body', '?fields=,', '?view=summary&fields=id']:
+            response = self.client.get(self.answers_url(query))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=query)
+
+    def test_projection_is_part_of_etag(self):
+        etag = self.client.get(self.answers_url(''))['ETag']
+
+        response = self.client.get(self.answers_url('?view=summary'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        response = self.client.get(self.answers_url('?view=summary'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_comments_summary(self):
+        response = self.client.get('/api/' + str(self.a[0].id) + '/comment?view=summary')
+
+        self.assertEqual(response.json(), [{
+            'id': Comment.objects.get().id,
+            'user': {'id': _test_user.id, 'username': _test_user.username},
+            'excerpt': 'Comment',
+            'timestamp': self.client.get('/api/' + str(self.a[0].id) + '/comment').json()[0]['timestamp'],
+            'parent': None,
+        }])
+
+    def test_answer_changes_summary(self):
+        response = self.client.get('/api/' + str(self.q.id) + '/answer/changes?view=summary')
+
+        self.assertEqual(len(response.data['answers']), 3)
+        self.assertNotIn('html', response.data['answers'][0])
+
+    def test_answer_detail(self):
+        response = self.client.post('/api/submit/answer/', {
+            'question': str(self.q.id),
+            'user': {'id': _test_user.id, 'username': _test_user.username},
+            'html': '<p>Full body</p>',
+        }, format='json')
+        url = '/api/answer/' + str(response.data['id'])
+
+        response = self.assertQueryBudget(url, 5)
+        self.assertEqual(response.data['html'], '<p>Full body</p>')
+        self.assertEqual(response.data['can_vote'], 1)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.assertEqual(self.client.get('/api/answer/999999').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FastPathSerialization(AuthAPITestCase):
+    q = None
+    a = None
+
+    @classmethod
+    def setUpTestData(cls):
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+        u = User.objects.create_user(username="caf\u00e9", password="password")
+
+        cls.a = []
+        for html in ['<p> "quoted" \\ \u2028 \u2029 \t </p>', '<p> caf\u00e9 \U0001F600 </p>', '<p></p>']:
+            cls.a.append(Answer.objects.create(question=cls.q, user=u, votes=len(html), html=html))
+        Vote.objects.create(answer=cls.a[0], user=_test_user)
+        c = Comment.objects.create(answer=cls.a[0], user=u, html='<p> \u2028 Comment </p>')
+        Comment.objects.create(answer=cls.a[0], user=_test_user, parent=c, html='<p> Reply </p>')
+
+    def answers_bytes(self, answers):
+        context = can_vote_context(_test_user.id, Vote.objects.all())
+        return JSONRenderer().render(AnswerSerializer(answers, many=True, context=context).data)
+
+    def test_renderer_matches_json_renderer(self):
+        data = [OrderedDict([('a', '\u2028\u2029 "\\ \x00\x1f\x7f caf\u00e9 \U0001F600'), ('b', None)]),
+                {'c': [True, False, -1, 2 ** 40], 'd': {}}]
+
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+
+    def test_answer_pages_same_bytes_as_serializer(self):
+        response = self.client.get('/api/' + str(self.q.id) + '/answer?top=10')
+
+        answers = Answer.objects.filter(question=self.q).order_by('-votes', '-timestamp', '-id')
+        self.assertEqual(response.content, self.answers_bytes(answers))
+
+    def test_answer_changes_same_bytes_as_serializer(self):
+        response = self.client.get('/api/' + str(self.q.id) + '/answer/changes')
+
+        answers = self.answers_bytes(Answer.objects.filter(question=self.q))
+        self.assertIn(b'"answers":' + answers + b',', response.content)
+
+    def test_comments_same_bytes_as_serializer(self):
+        response = self.client.get('/api/' + str(self.a[0].id) + '/comment')
+
+        comments = Comment.objects.filter(answer=self.a[0])
+        self.assertEqual(response.content, JSONRenderer().render(CommentSerializer(comments, many=True).data))
+        self.assertEqual(list(response.json()[0]), ['id', 'user', 'timestamp', 'html', 'answer', 'parent'])
+
+    def test_comment_tree_same_fields_as_serializer(self):
+        response = self.client.get('/api/' + str(self.a[0].id) + '/comment/tree')
+
+        root, reply = Comment.objects.filter(answer=self.a[0]).order_by('id')
+        expected = dict(CommentSerializer(root).data, truncated=False,
+                        children=[dict(CommentSerializer(reply).data, children=[], truncated=False)])
+        self.assertEqual(response.json()['threads'], [json.loads(JSONRenderer().render(expected).decode('utf-8'))])
+
+    def test_browsable_api_still_served(self):
+        response = self.client.get('/api/' + str(self.q.id) + '/answer?top=10', HTTP_ACCEPT='text/html')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+
+class ActivityCounters(AuthAPITestCase):
+    p = None
+    q = None
+
+    @classmethod
+    def setUpTestData(cls):
+        t = PaperTitle.objects.create(title="__TEST__")
+        cls.p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=cls.p)
+        Question.objects.create(number="2", paper=cls.p)
+
+    def post_answer(self):
+        response = self.client.post('/api/submit/answer/', {
+            'question': str(self.q.id),
+            'user': {'id': _test_user.id, 'username': _test_user.username},
+            'html': '<p> Answer </p>',
+        }, format='json')
+        return Answer.objects.get(pk=response.data['id'])
+
+    def post_comment(self, answer):
+        response = self.client.post('/api/submit/comment', {
+            'answer': answer.id,
+            'user': {'id': _test_user.id, 'username': _test_user.username},
+            'html': '<p> Comment </p>',
+        }, format='json')
+        return Comment.objects.get(pk=response.data['id'])
+
+    def counters(self):
+        return (Question.objects.values_list('answer_count', 'comment_count', 'last_activity').get(pk=self.q.id),
+                Paper.objects.values_list('answer_count', 'comment_count', 'last_activity').get(pk=self.p.id))
+
+    def test_counted_on_create(self):
+        answer = self.post_answer()
+        self.post_answer()
+        comment = self.post_comment(answer)
+
+        self.assertEqual(self.counters(), ((2, 1, comment.timestamp), (2, 1, comment.timestamp)))
+
+    def test_counted_on_delete_with_cascade(self):
+        answer = self.post_answer()
+        self.post_comment(answer)
+        self.post_comment(answer)
+        latest = self.post_comment(self.post_answer())
+
+        self.client.delete('/api/delete/' + str(answer.id) + '/answer')
+
+        self.assertEqual(self.counters(), ((1, 1, latest.timestamp), (1, 1, latest.timestamp)))
+
+    def test_not_created_if_counting_fails(self):
+        with mock.patch('api.counters.update', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                Answer.objects.create(question=self.q, user=_test_user, html="<p> Answer </p>")
+
+        self.assertFalse(Answer.objects.exists())
+
+    def test_repair(self):
+        answer = self.post_answer()
+        comment = self.post_comment(answer)
+        expected = self.counters()
+        Question.objects.update(answer_count=7, comment_count=7, last_activity=None)
+        Paper.objects.update(answer_count=7)
+        out = StringIO()
+
+        call_command('repair_counters', stdout=out)
+
+        self.assertEqual(self.counters(), expected)
+        self.assertEqual(expected[0][2], comment.timestamp)
+        self.assertEqual(Question.objects.get(number="2").answer_count, 0)
+        self.assertIn("2 questions and 1 papers", out.getvalue())
+
+    def test_exposed_in_questions(self):
+        etag = self.client.get('/api/C141/2015/questions')['ETag']
+        self.post_answer()
+
+        response = self.client.get('/api/C141/2015/questions', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        question = next(question for question in response.json() if question['id'] == self.q.id)
+        self.assertEqual(question['answer_count'], 1)
+        self.assertEqual(question['comment_count'], 0)
+        self.assertIsNotNone(question['last_activity'])
+
+    def test_exposed_in_available_papers(self):
+        etag = self.client.get('/api/available-papers')['ETag']
+        answer = self.post_answer()
+
+        response = self.client.get('/api/available-papers', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['C141']['Activity'], [{
+            'paper_id': self.p.id,
+            'answer_count': 1,
+            'comment_count': 0,
+            'last_activity': self.client.get('/api/answer/' + str(answer.id)).json()['timestamp'],
+        }])
+
+    def test_activity_cached_apart_from_index(self):
+        self.client.get('/api/available-papers')
+        self.post_answer()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/available-papers')
+
+        self.assertEqual(response.json()['C141']['Activity'][0]['answer_count'], 1)
+        for query in queries.captured_queries:
+            self.assertNotIn('api_papertitle', query['sql'])
+
+
+class ExplainQueries(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        q = Question.objects.create(number="1", paper=p)
+        a = Answer.objects.create(question=q, user=_test_user, html="<p> Answer </p>")
+        Comment.objects.create(answer=a, user=_test_user, html="<p> Comment </p>")
+
+    def test_prints_plans_of_each_endpoint(self):
+        out = StringIO()
+
+        call_command('explain_queries', stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("GET /api/1/answer?page_size=20", output)
+        self.assertIn("GET /api/1/comment/tree", output)
+        self.assertIn("api_answer_questio_b64a35_idx", output)
+        self.assertIn("api_comment_answer__a3a034_idx", output)
+
+    def test_requires_data(self):
+        Question.objects.all().delete()
+
+        with self.assertRaises(CommandError):
+            call_command('explain_queries', stdout=StringIO())
+
+
+class DerivedFromHTML(AuthAPITestCase):
+    q = None
+
+    @classmethod
+    def setUpTestData(cls):
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+
+    def test_sanitize_html(self):
+        self.assertEqual(sanitize_html('<p class="ql-align-center x">a <b>b</b><br/></p>'),
+                         '<p class="ql-align-center">a <b>b</b><br></p>')
+        self.assertEqual(sanitize_html('<p onclick="x()">a<script>alert(1)</script><style>p{}</style></p>'),
+                         '<p>a</p>')
+        self.assertEqual(sanitize_html('<a href="javascript:alert(1)">a</a><a href="/x" target="_blank">b</a>'),
+                         '<a>a</a><a href="/x" target="_blank" rel="noopener noreferrer">b</a>')
+        self.assertEqual(sanitize_html('<img src="data:image/png;base64,AA"><img src="data:text/html,x">'),
+                         '<img src="data:image/png;base64,AA"><img>')
+        self.assertEqual(sanitize_html('<ul><li>1 &lt; 2<li>3</ul><iframe>i</iframe>'),
+                         '<ul><li>1 &lt; 2<li>3</li></li></ul>i')
+
+    def test_sanitize_html_keeps_colors_and_videos(self):
+        self.assertEqual(sanitize_html('<span style="color: rgb(230, 0, 0);">a</span>'
+                                       '<span style="background-color:#ff0; position: fixed">b</span>'
+                                       '<span style="color: url(javascript:x)">c</span>'),
+                         '<span style="color: rgb(230, 0, 0);">a</span>'
+                         '<span style="background-color: #ff0;">b</span><span>c</span>')
+        video = '<iframe class="ql-video" frameborder="0" allowfullscreen="true" ' \
+                'src="https://www.youtube.com/embed/x"></iframe>'
+        self.assertEqual(sanitize_html(video), video)
+        self.assertEqual(sanitize_html('<iframe class="ql-video" src="http://example.com/"></iframe>'
+                                       '<iframe class="ql-video" src="javascript:alert(1)"></iframe>'
+                                       '<iframe src="https://example.com/"></iframe>'), '')
+
+    def test_excerpt(self):
+        self.assertEqual(excerpt("short", 10), "short")
+        self.assertEqual(excerpt("a proof by induction", 12), "a proof by…")
+        self.assertEqual(excerpt("abcdefghijklmnop", 8), "abcdefg…")
+
+    def test_answer_derived_on_create_and_edit(self):
+        data = {
+            'question': str(self.q.id),
+            'user': {'id': _test_user.id, 'username': _test_user.username},
+            'html': '<p>Proof by <b>induction</b><script>x()</script></p>' + '<p>more</p>' * 100,
+        }
+        response = self.client.post('/api/submit/answer/', data, format='json')
+
+        self.assertTrue(response.data['html'].startswith('<p>Proof by <b>induction</b></p><p>more</p>'))
+        answer = Answer.objects.get(pk=response.data['id'])
+        self.assertTrue(answer.text.startswith('Proof by induction more more'))
+        self.assertLessEqual(len(answer.excerpt), 200)
+        self.assertTrue(answer.excerpt.endswith('more…'))
+
+        self.client.post('/api/update/answer/', {'id': answer.id, 'html': '<p>Edited</p>'}, format='json')
+
+        answer.refresh_from_db()
+        self.assertEqual((answer.safe_html, answer.text, answer.excerpt), ('<p>Edited</p>', 'Edited', 'Edited'))
+
+    def test_comment_derived_on_create(self):
+        a = Answer.objects.create(question=self.q, user=_test_user, html="<p> Answer </p>")
+        data = {
+            'answer': a.id,
+            'user': {'id': _test_user.id, 'username': _test_user.username},
+            'html': '<p onmouseover="x()">Why?</p>',
+        }
+        response = self.client.post('/api/submit/comment', data, format='json')
+
+        self.assertEqual(response.data['html'], '<p>Why?</p>')
+        self.assertNotIn('text', response.data)
+        comment = Comment.objects.get(pk=response.data['id'])
+        self.assertEqual((comment.text, comment.excerpt), ('Why?', 'Why?'))
+
+
+class Search(AuthAPITestCase):
+    p = None
+    q = None
+    a1 = None
+    a2 = None
+
+    @classmethod
+    def setUpTestData(cls):
+        t = PaperTitle.objects.create(title="Logic")
+        cls.p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1a", paper=cls.p)
+        cls.a1 = Answer.objects.create(question=cls.q, user=_test_user,
+                                       html="<p>Proof by <b>induction</b> on n &amp; m.</p>")
+        cls.a2 = Answer.objects.create(question=cls.q, user=_test_user, html="<p>Use a loop invariant.</p>")
+        Comment.objects.create(answer=cls.a2, user=_test_user, html="<p>Is the loop <i>variant</i> needed?</p>")
+
+    def search(self, **params):
+        response = self.client.get('/api/search', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_answer_text_found_with_snippet(self):
+        data = self.search(q='induction')
+
+        self.assertEqual(data['count'], 1)
+        result = data['results'][0]
+        self.assertEqual((result['kind'], result['id']), ('answer', self.a1.id))
+        self.assertEqual(result['paper'], {'id': self.p.id, 'course': 'C141', 'year': 2015})
+        self.assertEqual(result['question'], {'id': self.q.id, 'number': '1a'})
+        self.assertEqual(result['snippet'], 'Proof by <b>induction</b> on n &amp; m.')
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search(q='loop')['count'], 2)
+        self.assertEqual(self.search(q='loop needed')['results'][0]['kind'], 'comment')
+        self.assertEqual(self.search(q='loop induction')['count'], 0)
+
+    def test_keywords_ranked_above_text(self):
+        Answer.objects.create(question=self.q, user=_test_user, html="<p>Logic, as ever.</p>")
+
+        kinds = [result['kind'] for result in self.search(q='logic')['results']]
+
+        self.assertEqual(kinds, ['paper', 'answer'])
+
+    def test_course_code_and_question_number(self):
+        data = self.search(q='c141 1a')
+
+        self.assertEqual([result['kind'] for result in data['results']], ['question'])
+
+    def test_filtered_by_kind(self):
+        data = self.search(q='loop', kind='comment')
+
+        self.assertEqual([result['kind'] for result in data['results']], ['comment'])
+
+    def test_paged(self):
+        first = self.search(q='loop', page_size=1)
+        second = self.search(q='loop', page_size=1, page=2)
+
+        self.assertEqual(first['next'], 2)
+        self.assertIsNone(second['next'])
+        self.assertNotEqual(first['results'][0]['id'], second['results'][0]['id'])
+
+    def test_edit_and_delete_update_index(self):
+        self.search(q='induction')
+
+        self.a1.html = "<p>Proof by contradiction.</p>"
+        self.a1.save()
+        self.assertEqual(self.search(q='induction')['count'], 0)
+        self.assertEqual(self.search(q='contradiction')['count'], 1)
+
+        self.a1.delete()
+        self.assertEqual(self.search(q='contradiction')['count'], 0)
+
+    def test_bulk_created_questions_indexed(self):
+        data = [{'number': '2b'}, {'number': '3c'}]
+        self.client.post('/api/submit/' + str(self.p.id) + '/questions', data, format='json')
+
+        self.assertEqual(self.search(q='3c')['count'], 1)
+
+    def test_rebuild_command(self):
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.search(q='induction')['count'], 0)
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+
+        self.assertIn("Indexed 5 documents.", out.getvalue())
+        self.assertEqual(self.search(q='induction')['count'], 1)
+
+    def test_migration_indexes_existing_rows(self):
+        fill_search_index = import_module('api.migrations.0015_fill_search_index').fill_search_index
+        SearchDocument.objects.all().delete()
+
+        fill_search_index(apps, connection.schema_editor())
+
+        self.assertEqual(SearchDocument.objects.count(), 5)
+        self.assertEqual(self.search(q='induction')['count'], 1)
+        self.assertEqual(self.search(q='c141 1a')['count'], 1)
+
+    def test_raw_saves_not_indexed(self):
+        answer = Answer(question=self.q, user=_test_user, html="<p>Fixture</p>", text="Fixture",
+                        timestamp=timezone.now())
+        answer.save_base(raw=True)
+
+        self.assertFalse(SearchDocument.objects.filter(kind=SearchDocument.ANSWER, object_id=answer.id).exists())
+
+    def test_invalid_queries(self):
+        self.assertEqual(self.client.get('/api/search', {'q': ' ?! '}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/search', {'q': 'loop', 'kind': 'user'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_html_to_text(self):
+        self.assertEqual(html_to_text("<p>a&lt;b</p><p>c<br>d</p><script>x()</script>"), "a<b c d")
+
+
+class Instrumentation(AuthAPITestCase):
+    q = None
+    a = None
+
+    @classmethod
+    def setUpTestData(cls):
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+        cls.a = Answer.objects.create(question=cls.q, user=_test_user, html="<p> Answer </p>")
+
+    def setUp(self):
+        super(Instrumentation, self).setUp()
+        metrics.reset()
+
+    def test_unsampled_request_not_timed(self):
+        response = self.client.get('/api/' + str(self.q.id) + '/answer')
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.render_prometheus(), '\n')
+
+    @override_settings(METRICS={'SAMPLE_RATE': 1})
+    def test_sampled_request_timed_and_logged(self):
+        with self.assertLogs('api.metrics', level='INFO') as logs, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/' + str(self.q.id) + '/answer/changes')
+
+        self.assertRegex(response['Server-Timing'],
+                         r'^app;dur=[0-9.]+, db;dur=[0-9.]+;desc="' + str(len(queries)) +
+                         r' queries", serialize;dur=[0-9.]+, render;dur=[0-9.]+$')
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logged['view'], 'AnswerChanges')
+        self.assertEqual(logged['status'], 200)
+        self.assertEqual(logged['bytes'], len(response.content))
+        self.assertGreater(logged['serialize'], 0)
+        self.assertGreater(logged['render'], 0)
+
+    @override_settings(METRICS={'SAMPLE_RATE': 1})
+    def test_serializer_and_renderer_timed_without_patching_drf(self):
+        with self.assertLogs('api.metrics', level='INFO') as logs:
+            self.client.get('/api/answer/' + str(self.a.id), HTTP_ACCEPT='application/json')
+
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logged['view'], 'AnswerDetail')
+        self.assertGreater(logged['serialize'], 0)
+        self.assertGreater(logged['render'], 0)
+        self.assertFalse(hasattr(JSONRenderer.render, '__wrapped__'))
+        self.assertFalse(hasattr(serializers.Serializer.data.fget, '__wrapped__'))
+        self.assertFalse(hasattr(serializers.ListSerializer.is_valid, '__wrapped__'))
+
+    @override_settings(METRICS={'SAMPLE_RATE': 1, 'LOG': False})
+    def test_metrics_served_to_staff(self):
+        self.client.get('/api/' + str(self.q.id) + '/answer')
+        self.client.get('/api/' + str(self.q.id) + '/answer')
+
+        self.assertEqual(self.client.get('/api/metrics').status_code, status.HTTP_403_FORBIDDEN)
+
+        staff = User.objects.create_user(username="staff", password="password", is_staff=True)
+        self.client.force_login(user=staff)
+        response = self.client.get('/api/metrics')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode('utf-8')
+        self.assertIn('# TYPE biblioteq_request_duration_seconds histogram', text)
+        self.assertIn('biblioteq_request_duration_seconds_bucket{view="Answers",le="+Inf"} 2', text)
+        self.assertIn('biblioteq_request_duration_seconds_count{view="Answers"} 2', text)
+        self.assertIn('biblioteq_response_size_bytes_count{view="Answers"} 2', text)
+
+
+class Benchmark(TestCase):
+    ARGS = ['--in-place', '--papers', '2', '--questions', '2', '--answers', '3', '--pdf-kb', '1',
+            '--requests', '3', '--warmup', '1']
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'results.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_saves_results_of_each_scenario(self):
+        call_command('benchmark', *self.ARGS, output=self.output, stdout=StringIO())
+
+        with open(self.output) as f:
+            saved = json.load(f)
+        self.assertEqual(set(saved['results']), set(name for name, _ in benchmark.SCENARIOS))
+        self.assertEqual(saved['metadata']['dataset']['papers'], 2)
+        result = saved['results']['answers_poll']
+        self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+        self.assertGreater(result['bytes'], 0)
+        self.assertEqual(saved['results']['answers_revalidate']['bytes'], 0)
+
+    def test_fails_on_more_queries_than_baseline(self):
+        baseline = {'answers_poll': {'p95_ms': 1e9, 'queries': 0}}
+        with open(self.output, 'w') as f:
+            json.dump({'results': baseline}, f)
+
+        with self.assertRaisesRegex(CommandError, "answers_poll: [0-9]+ queries per request, was 0"):
+            call_command('benchmark', *self.ARGS, scenario=['answers_poll'], compare=self.output,
+                         stdout=StringIO())
+
+    def test_compares_serializers(self):
+        out = StringIO()
+
+        call_command('benchmark', *self.ARGS, scenario=['vote'], serializers=True, output=self.output, stdout=out)
+
+        with open(self.output) as f:
+            saved = json.load(f)
+        self.assertEqual(set(saved['serializers']), {'answers', 'comments'})
+        self.assertEqual(saved['serializers']['answers']['rows'], 3)
+        self.assertGreater(saved['serializers']['answers']['speedup'], 0)
+        self.assertIn("projection ms", out.getvalue())
+
+    def test_slower_p95_within_tolerance_passes(self):
+        results = {'vote': {'p95_ms': 11.0, 'queries': 3}}
+
+        self.assertEqual(benchmark.find_regressions(results, {'vote': {'p95_ms': 10.0, 'queries': 3}}, 0.2), [])
+        self.assertEqual(len(benchmark.find_regressions(results, {'vote': {'p95_ms': 5.0, 'queries': 3}}, 0.2)), 1)
+
+
+class LoadTest(LiveServerTestCase):
+    def setUp(self):
+        benchmark.generate_dataset(benchmark.DEFAULT_SPEC._replace(papers=1, questions=2, answers=3, pdf_kb=1))
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'stages.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ramps_viewers_of_solution_page(self):
+        out = StringIO()
+
+        call_command('loadtest', url=self.live_server_url, viewers_start=1, viewers_step=1, viewers_max=2,
+                     stage_seconds=0.5, writers=1, write_interval=1, speedup=20, max_p95_ms=10000,
+                     output=self.output, stdout=out)
+
+        with open(self.output) as f:
+            stages = json.load(f)['stages']
+        self.assertEqual([stage['viewers'] for stage in stages], [1, 2])
+        self.assertIn('answer_changes', stages[-1]['endpoints'])
+        self.assertEqual(stages[-1]['endpoints']['all']['errors'], 0)
+        self.assertIn("Not saturated with 2 viewers.", out.getvalue())
+
+    # Streams end every second and are reopened with new tokens.
+    @override_settings(EVENTS={'HEARTBEAT': 1, 'STREAM_TIMEOUT': 1})
+    def test_viewers_holding_event_streams(self):
+        out = StringIO()
+
+        call_command('loadtest', url=self.live_server_url, viewers_start=2, viewers_step=1, viewers_max=2,
+                     stage_seconds=2, writers=1, write_interval=1, speedup=20, max_p95_ms=10000,
+                     events=True, output=self.output, stdout=out)
+
+        with open(self.output) as f:
+            endpoints = json.load(f)['stages'][-1]['endpoints']
+        self.assertGreaterEqual(endpoints['events']['requests'], 2)
+        self.assertGreaterEqual(endpoints['events_token']['requests'], endpoints['events']['requests'])
+        self.assertEqual(endpoints['all']['errors'], 0)
+
+    def test_writer_flips_can_vote_once_voted(self):
+        class Session(object):
+            def request(self, endpoint, method, path, data=None):
+                self.path = path
+                return status.HTTP_201_CREATED, b'{}'
+
+        writer = loadtest.Writer(Session(), {'course': 'C141', 'year': 2015}, 1, 0, threading.Event(),
+                                 {'id': 1, 'username': 'user'}, 1, 0)
+        answer = {'id': 7, 'can_vote': 1}
+
+        writer.vote(answer)
+        self.assertEqual((writer.session.path, answer['can_vote']), ('/api/upvote/7', 0))
+        writer.vote(answer)
+        self.assertEqual((writer.session.path, answer['can_vote']), ('/api/downvote/7', 1))
+
+    def test_saturation_by_latency_or_errors(self):
+        samples = [('answer_changes', 200, 0.01)] * 17 + [('answer_changes', 200, 2.0)] * 2 + [('upvote', 500, 0.01)]
+        summary = loadtest.summarize(samples, 10)
+
+        self.assertEqual(summary['all']['throughput'], 2.0)
+        self.assertEqual(summary['upvote']['error_rate'], 1.0)
+        self.assertIsNone(loadtest.saturation(summary, 5000, 0.1))
+        self.assertIn("p95", loadtest.saturation(summary, 100, 0.1))
+        self.assertIn("error rate", loadtest.saturation(summary, 5000, 0.01))
+
+
+class DatabaseConnections(TestCase):
+    def setUp(self):
+        self.connection = connections['default']
+        self.connection.ensure_connection()
+
+    def test_idle_connection_checked_before_reuse(self):
+        self.connection.last_used = time.time() - 60
+
+        with mock.patch.dict(self.connection.settings_dict, {'HEALTH_CHECK_IDLE': 30}), \
+                mock.patch.object(self.connection, 'is_usable', return_value=False), \
+                mock.patch.object(self.connection, 'close') as close:
+            health.check_idle_connections()
+
+        close.assert_called_once_with()
+
+    def test_connection_in_use_not_checked(self):
+        health.mark_connections_used()
+
+        with mock.patch.dict(self.connection.settings_dict, {'HEALTH_CHECK_IDLE': 30}), \
+                mock.patch.object(self.connection, 'is_usable') as is_usable:
+            health.check_idle_connections()
+
+        is_usable.assert_not_called()
+
+    @mock.patch('api.db.backends.postgresql_pool.base.pool.ThreadedConnectionPool')
+    def test_pool_waits_for_free_connection(self, pool_class):
+        pool_class.return_value.getconn.side_effect = lambda: mock.Mock(closed=0)
+        pool = ConnectionPool(1, 1, 0.01, None, {})
+
+        connection = pool.getconn()
+        with self.assertRaises(OperationalError):
+            pool.getconn()
+
+        pool.putconn(connection)
+        self.assertIsNotNone(pool.getconn())
+
+    @mock.patch('api.db.backends.postgresql_pool.base.pool.ThreadedConnectionPool')
+    def test_pool_discards_broken_connections(self, pool_class):
+        broken, healthy = mock.Mock(closed=2), mock.Mock(closed=0)
+        pool_class.return_value.getconn.side_effect = [broken, healthy]
+        pool = ConnectionPool(1, 2, 0.01, None, {})
+
+        self.assertIs(pool.getconn(), healthy)
+        pool_class.return_value.putconn.assert_called_once_with(broken, close=True)
+
+
+class CachedAnswers(AuthAPITestCase):
+    q = None
+    a = None
+    u = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(CachedAnswers, cls).setUpTestData()
+
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+        cls.u = User.objects.create_user(username="user", password="password")
+        cls.a = []
+        for html in ['<p> "can_vote":-1 </p>', '<p> \u2028 caf\u00e9 </p>', '<p> Answer </p>']:
+            cls.a.append(Answer.objects.create(question=cls.q, user=cls.u, html=html))
+        Vote.objects.create(answer=cls.a[1], user=_test_user)
+
+    def url(self):
+        return '/api/' + str(self.q.id) + '/answer'
+
+    def answer_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url())
+        return response, [q['sql'] for q in queries.captured_queries if 'FROM "api_answer"' in q['sql']]
+
+    def test_same_bytes_as_serializer(self):
+        answers = Answer.objects.filter(question=self.q).select_related('user')
+        context = can_vote_context(_test_user.id, Vote.objects.all())
+        expected = JSONRenderer().render(AnswerSerializer(answers, many=True, context=context).data)
+
+        self.client.get(self.url())
+        response = self.client.get(self.url())
+
+        self.assertEqual(response.content, expected)
+        self.assertEqual([a['can_vote'] for a in response.json()], [1, 0, 1])
+
+    def test_second_request_served_from_cache(self):
+        self.answer_queries()
+
+        response, queries = self.answer_queries()
+
+        self.assertEqual(queries, [])
+        self.assertEqual(len(response.json()), 3)
+
+    def test_can_vote_differs_between_users_of_cache(self):
+        self.client.get(self.url())
+
+        client = APIClient()
+        client.force_login(user=self.u)
+
+        self.assertEqual([a['can_vote'] for a in client.get(self.url()).json()], [1, 1, 1])
+
+    def test_vote_invalidates(self):
+        self.client.get(self.url())
+
+        self.client.post('/api/upvote/' + str(self.a[0].id), {})
+
+        votes = dict((a['id'], a['votes']) for a in self.client.get(self.url()).json())
+        self.assertEqual(votes[self.a[0].id], 1)
+
+    def test_create_edit_and_delete_invalidate(self):
+        self.client.get(self.url())
+        answer_id = self.client.post('/api/submit/answer/', {
+            'question': str(self.q.id),
+            'user': {'id': _test_user.id, 'username': _test_user.username},
+            'html': "<p> New </p>",
+        }, format='json').data['id']
+        self.assertEqual(len(self.client.get(self.url()).json()), 4)
+
+        self.client.post('/api/update/answer/', {'id': answer_id, 'html': "<p> Edited </p>"}, format='json')
+        self.assertIn("<p> Edited </p>", [a['html'] for a in self.client.get(self.url()).json()])
+
+        self.client.delete('/api/delete/' + str(answer_id) + '/answer')
+        self.assertEqual(len(self.client.get(self.url()).json()), 3)
+
+    # The cache is keyed on the version in the database, so a process that
+    # missed the write, as with a cache shared by other servers, does not
+    # serve the old answers.
+    def test_version_read_from_database(self):
+        self.client.get(self.url())
+        AnswerChange.objects.record(self.a[0], AnswerChange.VOTED)
+        Answer.objects.filter(pk=self.a[0].id).update(votes=5)
+
+        votes = dict((a['id'], a['votes']) for a in self.client.get(self.url()).json())
+        self.assertEqual(votes[self.a[0].id], 5)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class RedisCacheBackend(TestCase):
+    def setUp(self):
+        self.cache = RedisCache('redis://localhost:6379/0', {
+            'OPTIONS': {'CLIENT_CLASS': 'fakeredis.FakeStrictRedis'},
+            'KEY_PREFIX': 'test',
+        })
+        self.cache.client.flushdb()
+
+    def test_set_get_and_delete(self):
+        self.cache.set('key', {'a': [1, b'bytes']})
+        self.assertEqual(self.cache.get('key'), {'a': [1, b'bytes']})
+
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_add_only_if_new(self):
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+
+    def test_timeouts(self):
+        self.cache.set('forever', 1, timeout=None)
+        self.cache.set('expired', 1, timeout=0)
+
+        self.assertEqual(self.cache.client.pttl(self.cache.make_key('forever')), -1)
+        self.assertIsNone(self.cache.get('expired'))
+
+    def test_get_many(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+
+    def test_clear_leaves_other_keys(self):
+        self.cache.set('key', 1)
+        self.cache.client.set('other', 1)
+
+        self.cache.clear()
+
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.client.get('other'), b'1')
+
+
+class TokenAuthentication(APITestCase):
+    q = None
+    a = None
+    u = None
+
+    @classmethod
+    def setUpTestData(cls):
+        super(TokenAuthentication, cls).setUpTestData()
+
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+        cls.u = User.objects.create_user(username="user", password="password")
+        cls.a = Answer.objects.create(question=cls.q, user=cls.u, html="<p> Answer </p>")
+
+    def authenticate(self, user, **claims):
+        payload = jwt_settings.JWT_PAYLOAD_HANDLER(user)
+        payload.update(claims)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_settings.JWT_ENCODE_HANDLER(payload))
+
+    def user_queries(self, method, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+        return response, [q['sql'] for q in queries.captured_queries if 'FROM "auth_user"' in q['sql']]
+
+    def test_token_carries_is_staff(self):
+        payload = jwt_settings.JWT_PAYLOAD_HANDLER(_test_user)
+
+        self.assertIs(payload['is_staff'], False)
+
+    def test_read_without_user_query(self):
+        self.authenticate(_test_user)
+        self.client.get('/api/' + str(self.q.id) + '/answer')
+
+        response, queries = self.user_queries('get', '/api/' + str(self.q.id) + '/answer')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(queries, [])
+        self.assertEqual(response.json()[0]['can_vote'], 1)
+
+    def test_write_loads_user(self):
+        self.authenticate(_test_user)
+
+        response, queries = self.user_queries('post', '/api/upvote/' + str(self.a.id))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(queries), 1)
+
+    def test_write_refused_for_disabled_user(self):
+        self.authenticate(self.u)
+        User.objects.filter(pk=self.u.pk).update(is_active=False)
+
+        response = self.client.post('/api/upvote/' + str(self.a.id))
+
+        self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+    def test_token_without_is_staff_loads_user(self):
+        payload = jwt_settings.JWT_PAYLOAD_HANDLER(_test_user)
+        del payload['is_staff']
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_settings.JWT_ENCODE_HANDLER(payload))
+
+        response, queries = self.user_queries('get', '/api/' + str(self.q.id) + '/answer')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+
+    def test_token_user_equals_user(self):
+        user = TokenUser(self.u.id, self.u.username, False)
+
+        self.assertEqual(user, self.u)
+        self.assertNotEqual(user, _test_user)
+        self.assertTrue(user.is_authenticated)
+
+
+class ListQueryBudgets(QueryBudgetTestCase):
+    q = None
+    a = None
+
+    # Session lookup and user lookup made by authentication.
+    AUTH_QUERIES = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super(ListQueryBudgets, cls).setUpTestData()
+
+        t = PaperTitle.objects.create(title="__TEST__")
+        p = Paper.objects.create(course="C141", year=2015, title=t)
+        cls.q = Question.objects.create(number="1", paper=p)
+        cls.a = Answer.objects.create(question=cls.q, user=_test_user, html="<p> Answer </p>")
+
+    # Adds n answers, comments and votes, each by a new user, and a paper
+    # per answer.
+    def add_rows(self, n):
+        start = User.objects.count()
+        t = PaperTitle.objects.create(title="__MORE__")
+        for i in range(start, start + n):
+            u = User.objects.create_user(username="budget_" + str(i), password="password")
+            a = Answer.objects.create(question=self.q, user=u, html="<p> More </p>")
+            Comment.objects.create(answer=self.a, user=u, html="<p> More </p>")
+            Vote.objects.create(answer=a, user=_test_user)
+            Paper.objects.create(course="C" + str(i).zfill(3)[-3:], year=2015, title=t)
+
+    def assertFixedBudget(self, url, budget):
+        self.assertQueryBudget(url, self.AUTH_QUERIES + budget)
+        self.add_rows(10)
+        response = self.assertQueryBudget(url, self.AUTH_QUERIES + budget)
+        self.assertGreater(len(response.content), 0)
+
+    def test_answers(self):
+        self.assertFixedBudget('/api/' + str(self.q.id) + '/answer', 4)
+
+    def test_answer_changes(self):
+        self.assertFixedBudget('/api/' + str(self.q.id) + '/answer/changes', 4)
+
+    def test_comments(self):
+        self.assertFixedBudget('/api/' + str(self.a.id) + '/comment', 3)
+
+    def test_available_papers(self):
+        self.assertFixedBudget('/api/available-papers', 3)
+
+
 class EditPermissions(APITestCase):
     @classmethod
     def setUpTestData(cls):
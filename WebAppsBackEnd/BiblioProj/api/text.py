@@ -0,0 +1,191 @@
+import re
+from html import escape
+from html.parser import HTMLParser
+
+# Plain text, sanitized HTML and excerpts of the HTML bodies of answers and
+# comments, as written by the Quill editor on the frontend.
+
+# Elements whose content starts a new run of text.
+_BLOCK_TAGS = {
+    'address', 'blockquote', 'br', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li', 'ol', 'p', 'pre',
+    'table', 'td', 'th', 'tr', 'ul',
+}
+# Elements whose content is not text.
+_SKIPPED_TAGS = {'script', 'style'}
+
+
+class TextExtractor(HTMLParser):
+
+    def __init__(self):
+        super(TextExtractor, self).__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+# Returns the text of html with entities decoded and runs of whitespace, and
+# the breaks between blocks, collapsed to single spaces.
+def html_to_text(html):
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return ' '.join(''.join(parser.parts).split())
+
+
+# Elements kept by sanitize_html(), those the editor produces. Others are
+# dropped, keeping their content, except _SKIPPED_TAGS, dropped with it.
+_ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'i', 'iframe', 'img', 'li',
+    'ol', 'p', 'pre', 's', 'span', 'strike', 'strong', 'sub', 'sup', 'u', 'ul',
+}
+_VOID_TAGS = {'br', 'img'}
+# Attributes kept on each element, besides the editor's ql-* classes and
+# the style declarations of _ALLOWED_STYLES.
+_ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'target'},
+    'iframe': {'src', 'frameborder', 'allowfullscreen'},
+    'img': {'src', 'alt', 'width', 'height'},
+}
+_URL_ATTRIBUTES = {'href', 'src'}
+_URL_SCHEMES = {'http', 'https', 'mailto'}
+_DATA_IMAGE = re.compile(r'^data:image/(png|jpeg|gif|webp);base64,', re.IGNORECASE)
+_SCHEME = re.compile(r'^([^/?#:]*):')
+# The editor's text and background colors, as a name, #hex or rgb().
+_ALLOWED_STYLES = {'color', 'background-color'}
+_COLOR = re.compile(r'^(?:[a-z]+|#[0-9a-f]{3,8}|rgba?\(\s*\d{1,3}%?\s*(?:,\s*[0-9.]+%?\s*){2,3}\))$', re.IGNORECASE)
+
+
+# Returns whether url is relative, or of a scheme that runs no script.
+def is_safe_url(url, allow_data_image=False):
+    url = ''.join(url.split()).lower()
+    match = _SCHEME.match(url)
+    if match is None:
+        return True
+    return match.group(1) in _URL_SCHEMES or (allow_data_image and _DATA_IMAGE.match(url) is not None)
+
+
+# Returns the declarations of the style attribute value that set a color,
+# or '' if there are none.
+def sanitize_style(value):
+    kept = []
+    for declaration in value.split(';'):
+        name, _, value = declaration.partition(':')
+        name, value = name.strip().lower(), value.strip()
+        if name in _ALLOWED_STYLES and _COLOR.match(value):
+            kept.append(name + ': ' + value)
+    return '; '.join(kept) + (';' if kept else '')
+
+
+# Videos are the editor's ql-video iframes of an https page, others are
+# dropped.
+def is_video(attrs):
+    attrs = dict(attrs)
+    return 'ql-video' in (attrs.get('class') or '').split() and \
+        (attrs.get('src') or '').strip().lower().startswith('https://')
+
+
+class Sanitizer(HTMLParser):
+
+    def __init__(self):
+        super(Sanitizer, self).__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self.skipping += 1
+        elif not self.skipping and tag in _ALLOWED_TAGS and (tag != 'iframe' or is_video(attrs)):
+            self.parts.append(self.start_tag(tag, attrs))
+            if tag not in _VOID_TAGS:
+                self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif not self.skipping and tag in self.open_tags:
+            # Close the elements left open inside it too.
+            while True:
+                open_tag = self.open_tags.pop()
+                self.parts.append('</' + open_tag + '>')
+                if open_tag == tag:
+                    break
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(escape(data, quote=False))
+
+    def start_tag(self, tag, attrs):
+        allowed = _ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = []
+
+        for name, value in attrs:
+            value = value or ''
+            if name == 'class':
+                value = ' '.join(class_name for class_name in value.split() if class_name.startswith('ql-'))
+                if not value:
+                    continue
+            elif name == 'style':
+                value = sanitize_style(value)
+                if not value:
+                    continue
+            elif name not in allowed:
+                continue
+            elif name in _URL_ATTRIBUTES and not is_safe_url(value, allow_data_image=(tag == 'img')):
+                continue
+            elif name == 'target' and value != '_blank':
+                continue
+            kept.append((name, value))
+
+        if tag == 'a' and ('target', '_blank') in kept:
+            kept.append(('rel', 'noopener noreferrer'))
+
+        return '<' + tag + ''.join(' ' + name + '="' + escape(value) + '"' for name, value in kept) + '>'
+
+    def close(self):
+        super(Sanitizer, self).close()
+        while self.open_tags:
+            self.parts.append('</' + self.open_tags.pop() + '>')
+
+
+# Returns html with only the elements and attributes the editor produces, so
+# it is safe to insert into a page: no scripts, style sheets or styles other
+# than colors, event handlers, javascript: URLs or frames other than videos.
+# Text is re-escaped and every element left open closed.
+def sanitize_html(html):
+    sanitizer = Sanitizer()
+    sanitizer.feed(html)
+    sanitizer.close()
+    return ''.join(sanitizer.parts)
+
+
+# Returns text cut to at most length characters at a word break, marked with
+# an ellipsis if cut.
+def excerpt(text, length):
+    if len(text) <= length:
+        return text
+
+    cut = text[:length - 1]
+    if text[length - 1] != ' ' and ' ' in cut:
+        cut = cut[:cut.rindex(' ')]
+    return cut.rstrip() + '…'
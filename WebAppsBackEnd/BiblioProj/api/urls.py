@@ -27,6 +27,7 @@ create_delete_get_patterns = format_suffix_patterns(create_delete_get_patterns,
 
 paper_info_patterns = [
     url(r'^paper/?$', views.PaperPDF.as_view()),
+    url(r'^paper/pdf/?$', views.PaperDownload.as_view()),
     url(r'^questions/?$', views.PaperQuestions.as_view()),
 ]
 
@@ -38,7 +39,15 @@ register_patterns = [
 
 urlpatterns = [
     url(r'^available-papers/?', views.AvailablePapers.as_view()),
+    url(r'^metrics/?$', views.Metrics.as_view()),
+    url(r'^search/?$', views.Search.as_view()),
     url(r'^(?P<course_code>[A-Z][0-9]{3})/(?P<year>[0-9]{4})/', include(paper_info_patterns)),
+    url(r'^answer/(?P<id>[0-9]+)/?$', views.AnswerDetail.as_view()),
+    url(r'^(?P<id>[0-9]+)/answer/changes/?$', views.AnswerChanges.as_view()),
+    url(r'^(?P<id>[0-9]+)/comment/tree/?$', views.CommentTree.as_view()),
+    url(r'^(?P<id>[0-9]+)/events/?$', views.QuestionEvents.as_view()),
+    url(r'^paper/(?P<id>[0-9]+)/events/?$', views.PaperEvents.as_view()),
+    url(r'^events/token/?$', views.EventsToken.as_view()),
     url(r'^(?P<id>[0-9]+)/(?P<resource_name>.*)/', include(resource_patterns)),
     url(r'^(?P<id>[0-9]+)/', include(create_delete_get_patterns)),
     url(r'^submit/', include(create_delete_get_patterns)),
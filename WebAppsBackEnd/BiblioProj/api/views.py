@@ -1,31 +1,79 @@
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.parsers import JSONParser
-from api.models import Question, Answer, Paper, Comment, PaperTitle
-from api.permissions import IsOwner
+from api.models import Question, Answer, Paper, Comment, PaperTitle, AnswerChange, Vote, SearchDocument
+from api.authentication import StreamTokenAuthentication, make_stream_token
+from api.permissions import IsOwner, IsStaff
+from api import caching, events, metrics, search
+from api.conditional import conditional, make_etag
+from api.pagination import InvalidCursor, KeysetPaginator
+from api.renderers import EventStreamRenderer, FastJSONRenderer
 from api.serializers import PaperSerializer, QuestionSerializer, \
-    AnswerSerializer, CommentSerializer, NewUserSerializer
+    AnswerSerializer, CommentSerializer, NewUserSerializer, can_vote_context, \
+    index_comment_replies, serialize_comment_threads, ANSWER_PROJECTION, COMMENT_PROJECTION
 
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 
 from rest_framework import generics, mixins
 
 from rest_framework import status
 from rest_framework import permissions
 
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.views import APIView
+from rest_framework.settings import api_settings as drf_settings
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
 
 from rest_framework_jwt.settings import api_settings
 
+from django.db import IntegrityError, connection, transaction
+from django.db.models import BinaryField, Count, F, Max
+from django.db.models.functions import Substr
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import urlquote
+
+import datetime
+import mimetypes
 import os
 import os.path
 
+_API_DIR = os.path.dirname(os.path.realpath(__file__))
+
 _ANSWERS_RESOURCE_DIR = 'answers'
 _COMMENTS_RESOURCE_DIR = 'comments'
 _PAST_PAPERS_DIR = 'pastpapers'
 
+_PDF_CHUNK_SIZE = 1024 * 1024
+_PDF_MAX_AGE = 60 * 60
+_UNSATISFIABLE_RANGE = 'unsatisfiable'
+
+_PAGE_SIZE = 20
+_MAX_PAGE_SIZE = 100
+
+# Answers are paged most voted first, comments oldest first.
+_ANSWERS_PAGINATOR = KeysetPaginator(Answer, ('-votes', '-timestamp', '-id'))
+_COMMENTS_PAGINATOR = KeysetPaginator(Comment, ('timestamp', 'id'))
+
+_COMMENT_THREADS_PAGE_SIZE = 20
+_MAX_COMMENT_THREADS_PAGE_SIZE = 100
+# Deeper trees do not fit the recursion limit of the JSON encoder.
+_MAX_COMMENT_DEPTH = 64
+
+# Renderers of the views serving lists of answers and comments.
+_LIST_RENDERERS = [FastJSONRenderer, BrowsableAPIRenderer]
+
+_RESOURCES_DEFAULTS = {
+    # None streams files from the worker, 'x-accel-redirect' or 'x-sendfile'
+    # leaves sending them to the fronting proxy.
+    'OFFLOAD': None,
+    'INTERNAL_URL': '/protected/',
+    'MAX_AGE': 7 * 24 * 60 * 60,
+}
+
 
 class LogInUser(APIView):
 
@@ -88,30 +136,106 @@ class PaperPDF(generics.CreateAPIView, generics.DestroyAPIView):
     serializer_class = PaperSerializer
     queryset = Paper.objects.all()
 
+    def get_version(self, request, course_code, year):
+        paper = Paper.objects.filter(course=course_code, year=year) \
+            .values_list('id', 'title_id', 'pdf_sha1').first()
+        if paper is None:
+            return None
+        return make_etag('paper', *paper), None
+
+    @conditional
     def get(self, request, course_code, year):
         # Get paper from database.
-        paper = get_unique(Paper, course=course_code, year=year)
+        paper = Paper.objects.select_related('title').filter(course=course_code, year=year).first()
         if paper is None:
             return http_error_not_found(
                     "(Paper, Year)",
                     "(" + course_code + ", " + year + ")"
             )
 
-        # Set the response's fields
+        # Set the response's fields. The PDF itself is downloaded from
+        # PaperDownload.
         data = {
                 'title': paper.title.title,
-                'pdf': paper.pdf,
                 'paper_id': paper.id
         }
 
         return Response(data)
 
 
+# Streams the PDF of a paper as binary, with support for conditional and
+# Range requests. Only the requested bytes are read from the database, in
+# chunks, so large papers never sit whole in a worker's memory.
+class PaperDownload(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, course_code, year):
+        paper = Paper.objects.filter(course=course_code, year=year) \
+            .values('id', 'pdf_size', 'pdf_sha1').first()
+        if paper is None:
+            return http_error_not_found(
+                    "(Paper, Year)",
+                    "(" + course_code + ", " + year + ")"
+            )
+
+        etag = '"' + paper['pdf_sha1'] + '"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        size = paper['pdf_size']
+        byte_range = parse_byte_range(request.META.get('HTTP_RANGE'), size)
+
+        # A Range only applies to the version of the file named by If-Range.
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is not None and if_range != etag:
+            byte_range = None
+
+        if byte_range == _UNSATISFIABLE_RANGE:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = 'bytes */' + str(size)
+            return response
+
+        if byte_range is None:
+            start, end = 0, size - 1
+            response_status = status.HTTP_200_OK
+        else:
+            start, end = byte_range
+            response_status = status.HTTP_206_PARTIAL_CONTENT
+
+        response = StreamingHttpResponse(
+                iter_pdf(paper['id'], start, end + 1),
+                content_type='application/pdf',
+                status=response_status
+        )
+        response['Content-Length'] = str(end + 1 - start)
+        if byte_range is not None:
+            response['Content-Range'] = 'bytes ' + str(start) + '-' + str(end) + '/' + str(size)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=' + str(_PDF_MAX_AGE)
+        response['Content-Disposition'] = 'inline; filename="' + course_code + '_' + year + '.pdf"'
+        return response
+
+
 
 
 class PaperQuestions(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_version(self, request, course_code, year):
+        # Questions are only ever added, so their count and latest id identify
+        # the list, and the paper's counters change with any of theirs.
+        paper = Paper.objects.filter(course=course_code, year=year) \
+            .values('id', 'answer_count', 'comment_count', 'last_activity') \
+            .annotate(count=Count('question'), latest=Max('question__id')).first()
+        if paper is None:
+            return None
+        last_activity = paper['last_activity']
+        return make_etag('questions', paper['id'], paper['count'], paper['latest'], paper['answer_count'],
+                         paper['comment_count'], None if last_activity is None else last_activity.timestamp()), None
+
+    @conditional
     def get(self, request, course_code, year):
         # Get paper id for (course_code, year).
         paper = get_unique(Paper, course=course_code, year=year)
@@ -125,7 +249,7 @@ class PaperQuestions(APIView):
         # Get all questions with that paper id
         questions = Question.objects.filter(paper=paper)
 
-        # Serialise into (question id, question number)
+        # Serialise into (question id, question number, counters)
         serializer = QuestionSerializer(questions, many=True)
 
         return JsonResponse(serializer.data, safe=False)
@@ -144,26 +268,98 @@ class PaperData(mixins.DestroyModelMixin,
                 generics.CreateAPIView):
 
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = _LIST_RENDERERS
 
     # RENAME if we can think of a better name
     def get_related_model(self):
         raise Exception("ERROR: get_related_model(): URLs should point to a subclass of PaperData.")
 
-    def get_related_serialized_data(self, record, user_id):
-        raise Exception("ERROR: get_related_serialized_data(): URLs should point to a subclass of PaperData.")
+    # Returns the related rows of record, unordered, for paging through.
+    def get_related_queryset(self, record):
+        raise Exception("ERROR: get_related_queryset(): URLs should point to a subclass of PaperData.")
+
+    # Returns the KeysetPaginator ordering pages of the related rows.
+    def get_related_paginator(self):
+        raise Exception("ERROR: get_related_paginator(): URLs should point to a subclass of PaperData.")
+
+    # Returns (etag, last_modified) of the related data of the record with
+    # the given id, as seen by user_id, with only fields if not None.
+    def get_related_version(self, id, user_id, fields):
+        raise Exception("ERROR: get_related_version(): URLs should point to a subclass of PaperData.")
+
+    # Returns the Projection the related rows are served with, in full or
+    # with the fields of ?view=summary or ?fields=.
+    def get_related_projection(self):
+        raise Exception("ERROR: get_related_projection(): URLs should point to a subclass of PaperData.")
+
+    # Returns the context the projection of rows, the .values() of a page of
+    # related rows, is serialized with for user_id.
+    def get_projection_context(self, rows, fields, user_id):
+        return None
+
+    def get_version(self, request, id, format=None):
+        try:
+            fields = self.get_related_projection().get_fields(request.query_params)
+        except ValueError:
+            return None
+        return self.get_related_version(id, request.user.id, fields)
 
+    @conditional
     def get(self, request, id, format=None):
+        try:
+            fields = self.get_related_projection().get_fields(request.query_params)
+        except ValueError as e:
+            return Response("Error: " + str(e), status=status.HTTP_400_BAD_REQUEST)
+
         # Get record
         model = self.get_related_model()
         record = get_unique(model, pk=id)
         if record is None:
-            http_error_not_found("Record", id)
+            return http_error_not_found("Record", id)
 
-        user = get_unique(User, username=request.user)
+        if any(param in request.query_params for param in ('page_size', 'cursor', 'top')):
+            return self.get_page(request, record, request.user.id, fields or self.get_related_projection().full)
 
-        # Get corresponding data and serialize and return
-        serialized_data = self.get_related_serialized_data(record, user.id)
-        return Response(serialized_data)
+        if fields is not None:
+            return self.get_projected_response(record, fields, request.user.id)
+
+        return self.get_related_response(record, request.user.id)
+
+    def get_related_response(self, record, user_id):
+        return self.get_projected_response(record, self.get_related_projection().full, user_id)
+
+    def get_projected_response(self, record, fields, user_id):
+        rows = list(self.get_related_projection().values(self.get_related_queryset(record), fields))
+        return Response(self.get_projected_data(rows, fields, user_id))
+
+    # Pages through the related rows with ?page_size= and ?cursor=, the 'next'
+    # cursor of the previous page. ?top=K returns the first K rows alone, as
+    # a plain list like the unpaged response.
+    def get_page(self, request, record, user_id, fields):
+        queryset = self.get_related_projection().values(self.get_related_queryset(record), fields)
+
+        try:
+            top = get_int_param(request, 'top', None, minimum=1)
+            page_size = get_int_param(request, 'page_size', _PAGE_SIZE, minimum=1)
+            rows, next_cursor = self.get_related_paginator().paginate(
+                    queryset,
+                    None if top is not None else request.query_params.get('cursor'),
+                    min(top if top is not None else page_size, _MAX_PAGE_SIZE)
+            )
+        except (ValueError, InvalidCursor) as e:
+            return Response("Error: " + str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        serialized_data = self.get_projected_data(rows, fields, user_id)
+        if top is not None:
+            return Response(serialized_data)
+
+        return Response({'results': serialized_data, 'next': next_cursor})
+
+    # Serializes fields of rows, the .values() of related rows, as seen by
+    # user_id.
+    def get_projected_data(self, rows, fields, user_id):
+        context = self.get_projection_context(rows, fields, user_id)
+        return self.get_related_projection().serialize(rows, fields, context)
 
     def delete(self, request, *args, **kwargs):
         return self.destroy(request, *args, **kwargs)
@@ -172,14 +368,144 @@ class PaperData(mixins.DestroyModelMixin,
 class Answers(PaperData):
     queryset = Answer.objects.all()
     serializer_class = AnswerSerializer
+    answers_version = None
 
     def get_related_model(self):
         return Question
 
-    def get_related_serialized_data(self, question, user_id):
-        answers = Answer.objects.filter(question=question)
-        serializer = AnswerSerializer(answers, many=True, context={"user_id": user_id})
-        return serializer.data
+    # Served from the cache of rendered answers, see caching.get_answers_json().
+    def get_related_response(self, question, user_id):
+        version, _ = self.get_answers_version(question.id)
+        context = can_vote_context(user_id, Vote.objects.filter(answer__question=question))
+        return HttpResponse(caching.get_answers_json(question.id, version, context['voted_answer_ids']),
+                            content_type='application/json')
+
+    def get_related_queryset(self, question):
+        return Answer.objects.filter(question=question)
+
+    def get_related_paginator(self):
+        return _ANSWERS_PAGINATOR
+
+    def get_related_version(self, question_id, user_id, fields):
+        # can_vote differs between users, so the user is part of the version
+        # too.
+        version, timestamp = self.get_answers_version(question_id)
+        return make_etag('answers', question_id, version, user_id, *(fields or ())), timestamp
+
+    # Reads the version once for both the ETag and the cached answers, as a
+    # view instance serves a single request.
+    def get_answers_version(self, question_id):
+        if self.answers_version is None:
+            self.answers_version = caching.answers_version(question_id)
+        return self.answers_version
+
+    def get_related_projection(self):
+        return ANSWER_PROJECTION
+
+    def get_projection_context(self, rows, fields, user_id):
+        if 'can_vote' not in fields:
+            return None
+        return can_vote_context(user_id, Vote.objects.filter(answer_id__in=[row['id'] for row in rows]))
+
+    def perform_destroy(self, instance):
+        change = AnswerChange.objects.record(instance, AnswerChange.DELETED)
+        events.publish_answer_change(instance, change, {'id': instance.id})
+        instance.delete()
+
+
+# Change feed of the answers of a question. Without ?since= returns every
+# answer and a cursor; with ?since=<cursor> returns only the answers created,
+# edited or voted on since then and the ids of those deleted, or 204 if
+# nothing has changed. Takes ?view=summary and ?fields= like Answers.
+class AnswerChanges(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = _LIST_RENDERERS
+
+    def get(self, request, id):
+        since = request.query_params.get('since')
+
+        try:
+            fields = ANSWER_PROJECTION.get_fields(request.query_params)
+        except ValueError as e:
+            return Response("Error: " + str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        if since is None:
+            return self.get_all(request, id, fields)
+
+        try:
+            since = int(since)
+        except ValueError:
+            return Response("Error: since must be an integer cursor, not " + since + ".",
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        changes = list(AnswerChange.objects.filter(question_id=id, id__gt=since)
+                       .values_list('id', 'answer_id', 'action'))
+        if not changes:
+            # Changes are deleted with their question, so only an empty poll
+            # needs to check it still exists.
+            if not Question.objects.filter(pk=id).exists():
+                return http_error_not_found("Question", id)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        deleted = [answer_id for _, answer_id, action in changes if action == AnswerChange.DELETED]
+        changed = [answer_id for _, answer_id, action in changes if action != AnswerChange.DELETED]
+
+        answers = self.serialize(Answer.objects.filter(pk__in=changed),
+                                 Vote.objects.filter(answer_id__in=changed), request.user.id, fields)
+
+        return Response({
+            'cursor': max(change_id for change_id, _, _ in changes),
+            'answers': answers,
+            'deleted': deleted
+        })
+
+    def get_all(self, request, id, fields):
+        question = get_unique(Question, pk=id)
+        if question is None:
+            return http_error_not_found("Question", id)
+
+        # Take the cursor first so a change racing with this request is sent
+        # again on the next poll rather than lost.
+        cursor = AnswerChange.objects.filter(question=question).aggregate(cursor=Max('id'))['cursor']
+
+        answers = self.serialize(Answer.objects.filter(question=question),
+                                 Vote.objects.filter(answer__question=question), request.user.id, fields)
+
+        return Response({
+            'cursor': cursor or 0,
+            'answers': answers,
+            'deleted': []
+        })
+
+    # Serializes answers, or only fields of them if not None, with the votes
+    # of the user among votes.
+    def serialize(self, answers, votes, user_id, fields):
+        fields = fields or ANSWER_PROJECTION.full
+        context = can_vote_context(user_id, votes)
+        return ANSWER_PROJECTION.serialize(ANSWER_PROJECTION.values(answers, fields), fields, context)
+
+
+# One answer in full, for clients listing answers with ?view=summary to fetch
+# the body of an answer when it is opened.
+class AnswerDetail(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_version(self, request, id):
+        # An answer's latest change is kept in the change feed, see
+        # AnswerChange.objects.record().
+        change = AnswerChange.objects.filter(answer_id=id).values_list('id', 'timestamp').first()
+        if change is None:
+            return None
+        return make_etag('answer', id, change[0], request.user.id), change[1]
+
+    @conditional
+    def get(self, request, id):
+        answer = Answer.objects.filter(pk=id).select_related('user').first()
+        if answer is None:
+            return http_error_not_found("Answer", id)
+
+        serializer = AnswerSerializer(answer, context={'user_id': request.user.id})
+        return Response(serializer.data)
 
 
 class Comments(PaperData):
@@ -189,31 +515,137 @@ class Comments(PaperData):
     def get_related_model(self):
         return Answer
 
-    def get_related_serialized_data(self, answer, user_id):
-        comments = Comment.objects.filter(answer=answer)
-        serializer = CommentSerializer(comments, many=True)
-        return serializer.data
+    def get_related_queryset(self, answer):
+        return Comment.objects.filter(answer=answer)
+
+    def get_related_paginator(self):
+        return _COMMENTS_PAGINATOR
+
+    def get_related_version(self, answer_id, user_id, fields):
+        return comments_version(answer_id, fields or ())
+
+    def get_related_projection(self):
+        return COMMENT_PROJECTION
+
+    def perform_destroy(self, instance):
+        events.publish_comment_change(instance, events.DELETED,
+                                      {'id': instance.id, 'answer': instance.answer_id})
+        instance.delete()
+
+
+# The comments of an answer as a tree of threads, built from one query. Takes
+# ?depth= to limit how many levels of replies are nested under each top level
+# comment, and pages the top level comments with ?page_size= and ?after=, the
+# 'next' value of the previous page. Replies are never nested deeper than
+# _MAX_COMMENT_DEPTH, ?root=<comment id> continues a truncated thread from
+# that comment.
+class CommentTree(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = _LIST_RENDERERS
+
+    def get_version(self, request, id):
+        return comments_version(id)
+
+    @conditional
+    def get(self, request, id):
+        try:
+            depth = get_int_param(request, 'depth', _MAX_COMMENT_DEPTH, minimum=0)
+            page_size = get_int_param(request, 'page_size', _COMMENT_THREADS_PAGE_SIZE, minimum=1)
+            after = get_int_param(request, 'after', 0)
+            root_id = get_int_param(request, 'root', None)
+        except ValueError as e:
+            return Response("Error: " + str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        answer = get_unique(Answer, pk=id)
+        if answer is None:
+            return http_error_not_found("Answer", id)
+
+        comments = list(COMMENT_PROJECTION.values(Comment.objects.filter(answer=answer), COMMENT_PROJECTION.full)
+                        .order_by('id'))
+        roots, replies = index_comment_replies(comments)
+        depth = min(depth, _MAX_COMMENT_DEPTH)
+
+        if root_id is not None:
+            roots = [comment for comment in comments if comment['id'] == root_id]
+            if not roots:
+                return http_error_not_found("Comment", str(root_id))
+
+        page_size = min(page_size, _MAX_COMMENT_THREADS_PAGE_SIZE)
+        page = [root for root in roots if root['id'] > after][:page_size + 1]
+        has_next = len(page) > page_size
+        page = page[:page_size]
+
+        return Response({
+            'count': len(roots),
+            'next': page[-1]['id'] if has_next else None,
+            'threads': serialize_comment_threads(page, replies, depth)
+        })
 
 
 class Resource(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    # Returns the path of the resource, or None if resource_name would lead
+    # out of the resource directory.
+    def get_resource_path(self, id, resource_name):
+        directory = os.path.join(_API_DIR, self.get_name_of_resource_directory())
+        resource_path = os.path.realpath(os.path.join(directory, id, resource_name))
+
+        if not resource_path.startswith(directory + os.sep):
+            return None
+
+        return resource_path
+
+    def get_version(self, request, id, resource_name):
+        resource_path = self.get_resource_path(id, resource_name)
+        if resource_path is None:
+            return None
+
+        try:
+            stat = os.stat(resource_path)
+        except OSError:
+            return None
+
+        modified = datetime.datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        return make_etag('resource', stat.st_mtime_ns, stat.st_size), modified
+
+    @conditional
     def get(self, request, id, resource_name):
         # Construct path to resource
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        resource_path = os.path.join(current_dir, self.get_name_of_resource_directory(), id, resource_name)
+        resource_path = self.get_resource_path(id, resource_name)
+        if resource_path is None:
+            return self.resource_not_found(id, resource_name)
+
+        offload = get_resources_setting('OFFLOAD')
 
         try:
-            resource = open(resource_path, 'rb')
+            size = os.stat(resource_path).st_size
+            if offload is None:
+                resource = open(resource_path, 'rb')
 
         except IOError:
-            return http_error_not_found(
-                    "Looking for resource of something with ID = " + id + ". Resource",
-                    resource_name
-            )
+            return self.resource_not_found(id, resource_name)
+
+        content_type = mimetypes.guess_type(resource_path)[0] or 'application/octet-stream'
 
-        with resource:
-            return HttpResponse(resource.read(), content_type="image/jpeg")
+        if offload is None:
+            # Streamed from the open file, by the server's wsgi.file_wrapper
+            # (sendfile) where it has one, so the image is never held whole
+            # in the worker.
+            response = FileResponse(resource, content_type=content_type)
+            response['Content-Length'] = size
+        else:
+            response = offload_resource(offload, resource_path, content_type)
+
+        response['Cache-Control'] = 'private, max-age=' + str(get_resources_setting('MAX_AGE'))
+        response['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+    def resource_not_found(self, id, resource_name):
+        return http_error_not_found(
+                "Looking for resource of something with ID = " + id + ". Resource",
+                resource_name
+        )
 
     def get_name_of_resource_directory(self):
         raise Exception("ERROR: get_name_of_resource_directory(): URLs should point ot subclass of Resource.")
@@ -295,68 +727,56 @@ class Votes(APIView):
     def post(self, request, answer_id):
         # Get answer
         answer = get_unique(Answer, pk=answer_id)
-        # Get user
-        user = get_unique(User, username=request.user)
+        user = request.user
         if answer is None:
             return http_error_not_found("Answer", answer_id)
 
-        if user is None:
-            return http_error_not_found("User", user.id)
-
-        if user == answer.user:
+        if user.id == answer.user_id:
             return Response("Front end should have prevented user + " +
                             str(user.id) + " from voting on their own answer.",
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Update list of user id's
-        import json
-
-        json_dec = json.decoder.JSONDecoder()
+        # Record the vote and update the counter in one transaction. The
+        # counter is incremented in the database, so concurrent votes are
+        # never lost.
+        with transaction.atomic():
+            if not self.modify_votes(answer=answer, user=user):
+                return Response(
+                       "ERROR: User has already voted",
+                        status=status.HTTP_400_BAD_REQUEST
+                )
 
-        if answer.user_voted == "":
-            user_ids = []
-        else:
-            user_ids = json_dec.decode(answer.user_voted)
-
-        if not self.modify_voting_list(user_id=user.id, user_ids=user_ids):
-            return Response(
-                   "ERROR: User has already voted",
-                    status=status.HTTP_400_BAD_REQUEST
-            )
+            Answer.objects.filter(pk=answer.id).update(votes=self.updateVotes(F('votes')))
 
-        # Update the list of users who have voted
-        answer.user_voted = json.dumps(user_ids)
-
-        # Update votes
-        answer.votes = self.updateVotes(answer.votes)
-
-        # Save answer
-        answer.full_clean()
-        answer.save()
+        answer.refresh_from_db(fields=['votes'])
+        change = AnswerChange.objects.record(answer, AnswerChange.VOTED)
+        events.publish_answer_change(answer, change, {'id': answer.id, 'votes': answer.votes})
 
         # Return new votes
         response_data = {'votes': answer.votes}
         return Response(response_data, status=status.HTTP_201_CREATED)
 
     def updateVotes(self, votes):
-        return Response("ERROR: updateVotes(): URLs should point to a "
-                        "subclass of Votes.", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        raise Exception("ERROR: updateVotes(): URLs should point to a subclass of Votes.")
 
-    def modify_voting_list(self, user_ids, user_id):
-        return Response("ERROR WRITE A PROPER MESSAGE")
+    # Returns False if the user's vote cannot be changed in this direction.
+    def modify_votes(self, answer, user):
+        raise Exception("ERROR: modify_votes(): URLs should point to a subclass of Votes.")
 
 
 class UpVote(Votes):
     def updateVotes(self, votes):
         return votes + 1
 
-    def modify_voting_list(self, user_ids, user_id):
-
-        if user_id in user_ids:
+    def modify_votes(self, answer, user):
+        # The unique (answer, user) constraint rejects a second vote, even
+        # one racing with this.
+        try:
+            with transaction.atomic():
+                Vote.objects.create(answer=answer, user=user)
+        except IntegrityError:
             return False
 
-        user_ids.append(user_id)
-
         return True
 
 
@@ -364,37 +784,250 @@ class DownVote(Votes):
     def updateVotes(self, votes):
         return votes - 1
 
-    def modify_voting_list(self, user_ids, user_id):
+    def modify_votes(self, answer, user):
+        deleted, _ = Vote.objects.filter(answer=answer, user=user).delete()
+        return deleted > 0
 
-        if user_id not in user_ids:
-            return False
 
-        user_ids.remove(user_id)
+# Server-Sent Events stream of the answer, vote and comment updates of a
+# question or paper.
+class Events(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = list(drf_settings.DEFAULT_AUTHENTICATION_CLASSES) + [StreamTokenAuthentication]
+    renderer_classes = list(drf_settings.DEFAULT_RENDERER_CLASSES) + [EventStreamRenderer]
 
-        return True
+    def get_model(self):
+        raise Exception("ERROR: get_model(): URLs should point to a subclass of Events.")
 
+    def get_channel(self, id):
+        raise Exception("ERROR: get_channel(): URLs should point to a subclass of Events.")
 
-class AvailablePapers(APIView):
+    def get(self, request, id):
+        if not self.get_model().objects.filter(pk=id).exists():
+            return http_error_not_found(self.get_model().__name__, id)
+
+        body = events.open_stream([self.get_channel(id)])
+        if body is None:
+            return Response("Error: Too many event streams open, poll for changes instead.",
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        # The stream reads nothing more from the database, so it does not hold
+        # a connection while it waits. Tests run inside a transaction.
+        if not connection.in_atomic_block:
+            connection.close()
+
+        response = StreamingHttpResponse(body, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class QuestionEvents(Events):
+
+    def get_model(self):
+        return Question
+
+    def get_channel(self, id):
+        return events.question_channel(id)
+
+
+class PaperEvents(Events):
+
+    def get_model(self):
+        return Paper
+
+    def get_channel(self, id):
+        return events.paper_channel(id)
+
+
+# Issues the user a stream token to open event streams with, as the Events
+# views take it in the URL, see StreamTokenAuthentication. A POST, so it is
+# never cached.
+class EventsToken(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        return Response({
+            'token': make_stream_token(request.user),
+            'expires_in': events.get_setting('TOKEN_LIFETIME'),
+        })
+
+
+# Ranked full-text search of papers, questions, answers and comments, see
+# api/search.py. ?q= is the query, ?kind= may be given once or more to only
+# return results of those kinds, and results are paged by ?page= and
+# ?page_size=.
+class Search(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        course_year_mappings = {}
-        papers = Paper.objects.all()
+        query = request.query_params.get('q', '').strip()
+        kinds = request.query_params.getlist('kind')
+        try:
+            page = get_int_param(request, 'page', 1, minimum=1)
+            page_size = min(get_int_param(request, 'page_size', _PAGE_SIZE, minimum=1), _MAX_PAGE_SIZE)
+        except ValueError as e:
+            return Response("Error: " + str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        if not search.words(query):
+            return Response("Error: q must contain a word to search for.", status=status.HTTP_400_BAD_REQUEST)
+        for kind in kinds:
+            if kind not in dict(SearchDocument.KINDS):
+                return Response("Error: kind must be one of " + ", ".join(dict(SearchDocument.KINDS)) +
+                                ", not " + kind + ".", status=status.HTTP_400_BAD_REQUEST)
+
+        count, documents = search.search(query, kinds, (page - 1) * page_size, page_size)
+
+        papers = Paper.objects.in_bulk(set(document.paper_id for document in documents))
+        numbers = dict(Question.objects.filter(id__in=set(document.question_id for document in documents))
+                       .values_list('id', 'number'))
+
+        return Response({
+            'count': count,
+            'next': page + 1 if page * page_size < count else None,
+            'results': [{
+                'kind': document.kind,
+                'id': document.object_id,
+                'paper': {
+                    'id': document.paper_id,
+                    'course': papers[document.paper_id].course,
+                    'year': papers[document.paper_id].year,
+                },
+                'question': None if document.question_id is None else {
+                    'id': document.question_id,
+                    'number': numbers.get(document.question_id),
+                },
+                'answer': document.answer_id,
+                'rank': document.rank,
+                'snippet': search.snippet(document, query),
+            } for document in documents if document.paper_id in papers]
+        })
+
+
+# Histograms of the sampled requests of this process, for Prometheus to
+# scrape with a staff user's token.
+class Metrics(APIView):
+    permission_classes = [IsStaff]
+
+    def get(self, request):
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        for paper in papers:
-            course_str = str(paper.course)
-            course_data = {}
-            course_data.setdefault("Years", [])
-            course_data.setdefault("Name", paper.title.title)
-            course_data.setdefault("paper_id", paper.id)
-            course_year_mappings.setdefault(course_str, course_data)
 
-        for paper in papers:
-            course_str = str(paper.course)
-            course_year_mappings[course_str]['Years'].append(paper.year)
+class AvailablePapers(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    available_papers_version = None
 
+    def get_version(self, request):
+        return make_etag(*self.get_available_papers_version()), None
+
+    @conditional
+    def get(self, request):
+        version = self.get_available_papers_version()
+        course_year_mappings = caching.get_available_papers(version)
         return Response(course_year_mappings)
 
+    # Reads the version once for both the ETag and the cached index, as a
+    # view instance serves a single request.
+    def get_available_papers_version(self):
+        if self.available_papers_version is None:
+            self.available_papers_version = caching.available_papers_version()
+        return self.available_papers_version
+
+
+# Parses a single 'bytes=start-end' Range header into the inclusive byte
+# range it asks for of a file of size bytes. Returns None if the whole file
+# should be sent instead, including for multiple ranges, and
+# _UNSATISFIABLE_RANGE if the range lies outside the file.
+def parse_byte_range(header, size):
+    if header is None or not header.startswith('bytes=') or ',' in header:
+        return None
+
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if start == '':
+            # Suffix range, the last end bytes.
+            length = int(end)
+            if length == 0:
+                return _UNSATISFIABLE_RANGE
+            return max(size - length, 0), size - 1
+
+        start = int(start)
+        end = size - 1 if end == '' else min(int(end), size - 1)
+    except ValueError:
+        return None
+
+    if start > end:
+        return None if start < size else _UNSATISFIABLE_RANGE
+
+    return start, end
+
+
+# Yields bytes [start, end) of the PDF of a paper, reading at most
+# _PDF_CHUNK_SIZE bytes from the database at a time.
+def iter_pdf(paper_id, start, end):
+    while start < end:
+        length = min(_PDF_CHUNK_SIZE, end - start)
+        chunk = Paper.objects.filter(pk=paper_id) \
+            .annotate(chunk=Substr('pdf', start + 1, length, output_field=BinaryField())) \
+            .values_list('chunk', flat=True).first()
+        if not chunk:
+            return
+        yield bytes(chunk)
+        start += length
+
+
+# The version of the comments of an answer, for conditional GETs of them.
+# A new comment raises the latest id, a deletion lowers the count and an edit
+# raises the latest update. There is no Last-Modified, as deleting any but the
+# latest updated comment leaves every timestamp as it was.
+def comments_version(answer_id, fields=()):
+    latest = Comment.objects.filter(answer_id=answer_id) \
+        .aggregate(count=Count('id'), id=Max('id'), updated_at=Max('updated_at'))
+    updated_at = latest['updated_at']
+    version = None if updated_at is None else updated_at.timestamp()
+    return make_etag('comments', answer_id, latest['count'], latest['id'], version, *fields), None
+
+
+# Reads the integer query parameter name, raising ValueError if it is not one
+# or is below minimum.
+def get_int_param(request, name, default, minimum=None):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(name + " must be an integer, not " + value + ".")
+
+    if minimum is not None and value < minimum:
+        raise ValueError(name + " must be at least " + str(minimum) + ".")
+
+    return value
+
+
+def get_resources_setting(name):
+    return getattr(settings, 'RESOURCES', {}).get(name, _RESOURCES_DEFAULTS[name])
+
+
+# Hands the file at resource_path to the fronting proxy to send. Nginx serves
+# X-Accel-Redirect from an internal location mapped onto the api directory,
+# Apache and lighttpd serve the absolute path in X-Sendfile.
+def offload_resource(offload, resource_path, content_type):
+    response = HttpResponse(content_type=content_type)
+
+    if offload == 'x-accel-redirect':
+        relative_path = os.path.relpath(resource_path, _API_DIR).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = get_resources_setting('INTERNAL_URL') + urlquote(relative_path)
+    elif offload == 'x-sendfile':
+        response['X-Sendfile'] = resource_path
+    else:
+        raise ImproperlyConfigured("Unknown RESOURCES['OFFLOAD'] mode: " + str(offload))
+
+    return response
+
 
 # Gets the instance of the model from that database that uniquely has the given
 # kwargs. If such an object does not exist, returns None.
@@ -10,7 +10,7 @@ import {EditAnswer, EditAnswerJson} from "./jsonConversion/EditAnswerJson";
 import {Paper, PaperJson} from "./jsonConversion/PaperJson";
 import {EncodedPDF} from "./upload-paper/EncodedPdf";
 import {LoginDetails} from "./login/LoginDetails";
-import {Headers, RequestOptions} from "@angular/http";
+import {Headers, RequestOptions, ResponseContentType} from "@angular/http";
 import {Vote} from "./solution-page/Vote";
 
 
@@ -34,6 +34,15 @@ export class HttpAPIService {
     ).map(res => res.json());
   }
 
+  // The PDF is streamed as binary and shown from an object URL, which the
+  // caller should revoke when done with it.
+  public getPaperPdf(paperId: string, paperYear: string): Observable<string> {
+    return this.http.get(
+      HttpAPIService.makeUrl([paperId, paperYear, 'paper', 'pdf']),
+      {responseType: ResponseContentType.Blob}
+    ).map(res => URL.createObjectURL(res.blob()));
+  }
+
   public getQuestions(paperId: string, paperYear: string): Observable<JSON> {
     return this.http.get(
       HttpAPIService.makeUrl([paperId, paperYear, 'questions'])
@@ -46,6 +55,26 @@ export class HttpAPIService {
     ).map(res => res.json());
   }
 
+  public getAnswerChanges(questionId: number, cursor: number): Observable<JSON> {
+    return this.http.get(
+      HttpAPIService.makeUrl([questionId.toString(), 'answer', 'changes']) +
+      (cursor === null ? '' : '?since=' + cursor)
+    ).map(res => res.status === 204 ? null : res.json());
+  }
+
+  // EventSource cannot send the Authorization header, so streams are opened
+  // with a short-lived stream token in the URL instead of the login token.
+  public getEventsToken(): Observable<string> {
+    return this.http.post(
+      HttpAPIService.makeUrl(['events', 'token']), ''
+    ).map(res => res.json().token);
+  }
+
+  public paperEventsUrl(paperId: number, eventsToken: string): string {
+    return HttpAPIService.makeUrl(['paper', paperId.toString(), 'events']) +
+      '?token=' + encodeURIComponent(eventsToken);
+  }
+
   public voteAnswer(answerId: number, vote: Vote): Observable<JSON> {
     return this.http.post(
       HttpAPIService.makeUrl([vote.toUri(), answerId.toString()]),
@@ -5,6 +5,7 @@ export class Solution {
   private _hidden: boolean = true;
   private _answers: Answer[] = [];
   private _showMore: boolean = false;
+  private _cursor: number = null;
 
   constructor(private _id: number, private _question: string) {
   }
@@ -48,6 +49,14 @@ export class Solution {
     this.resortAnswers();
   }
 
+  public applyChanges(changed: Answer[], deleted: number[]): void {
+    let replaced = changed.map(answer => answer.id);
+    this._answers = this.answers
+      .filter(ans => deleted.indexOf(ans.id) === -1 && replaced.indexOf(ans.id) === -1)
+      .concat(changed);
+    this.resortAnswers();
+  }
+
   public resortAnswers() {
     this.answers.sort((a1, a2) => a2.numVotes - a1.numVotes);
   }
@@ -83,6 +92,14 @@ export class Solution {
     this._answers = value;
   }
 
+  get cursor(): number {
+    return this._cursor;
+  }
+
+  set cursor(value: number) {
+    this._cursor = value;
+  }
+
   get hidden(): boolean {
     return this._hidden;
   }
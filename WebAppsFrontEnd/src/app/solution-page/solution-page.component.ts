@@ -33,8 +33,12 @@ export class SolutionPageComponent implements OnDestroy {
   myPrivilege: number;
 
   pdfSrc: SafeResourceUrl;
+  private pdfObjectUrl: string = null;
   private refreshPageSubscription: Subscription;
-  private refreshSolutionSubscription: Subscription;
+  private refreshSolutionSubscription: Subscription = null;
+  private solutionRefreshRate: number = null;
+  private paperEvents: EventSource = null;
+  private destroyed = false;
 
   private editingAnswer: Answer = null;
   answerEditor: QuillEditorComponent = new QuillEditorComponent(new ElementRef('placeholder'));
@@ -59,8 +63,65 @@ export class SolutionPageComponent implements OnDestroy {
       SolutionPageComponent.seconds(20), // initial delay
       SolutionPageComponent.seconds(120) // poll rate
     ).subscribe(() => this.refreshPage());
+  }
+
+  // The server pushes answer updates for the paper, so the displayed solution
+  // is polled slowly while streaming, in case an event is missed, and often
+  // only if the browser cannot hold the event stream open.
+  private subscribeToPaperEvents() {
+    if (typeof EventSource === 'undefined') {
+      this.pollDisplayedSolution(5);
+      return;
+    }
+
+    this.pollDisplayedSolution(30);
+    this.apiService.getEventsToken().subscribe(
+      eventsToken => this.openPaperEvents(eventsToken),
+      error => {
+        console.log(error);
+        this.pollDisplayedSolution(5);
+      }
+    );
+  }
+
+  // Stream tokens only last a minute, so the browser's own reconnection
+  // fails once the server ends a stream. A stream that was open is reopened
+  // with a new token; one that never opened, refused by a server holding as
+  // many streams as it serves, falls back to polling.
+  private openPaperEvents(eventsToken: string) {
+    if (this.destroyed) {
+      return;
+    }
+
+    let opened = false;
+    this.paperEvents = new EventSource(this.apiService.paperEventsUrl(this.paperId, eventsToken));
+    this.paperEvents.onopen = () => opened = true;
+    ['answer.created', 'answer.updated', 'answer.voted', 'answer.deleted'].forEach(event => {
+      this.paperEvents.addEventListener(event, (message: MessageEvent) => {
+        this.refreshChangedSolution(JSON.parse(message.data).question);
+      });
+    });
+    this.paperEvents.onerror = () => {
+      if (this.paperEvents.readyState !== EventSource.CLOSED) {
+        return;
+      }
+      if (opened) {
+        this.subscribeToPaperEvents();
+      } else {
+        this.pollDisplayedSolution(5);
+      }
+    };
+  }
 
-    let solutionRefreshRate = 5;
+  private pollDisplayedSolution(solutionRefreshRate: number) {
+    if (this.destroyed || this.solutionRefreshRate === solutionRefreshRate) {
+      return;
+    }
+    if (this.refreshSolutionSubscription !== null) {
+      this.refreshSolutionSubscription.unsubscribe();
+    }
+
+    this.solutionRefreshRate = solutionRefreshRate;
     this.refreshSolutionSubscription = Observable.timer(
       SolutionPageComponent.seconds(solutionRefreshRate),
       SolutionPageComponent.seconds(solutionRefreshRate)
@@ -68,8 +129,17 @@ export class SolutionPageComponent implements OnDestroy {
   }
 
   ngOnDestroy(): void {
+    this.destroyed = true;
     this.refreshPageSubscription.unsubscribe();
-    this.refreshSolutionSubscription.unsubscribe();
+    if (this.refreshSolutionSubscription !== null) {
+      this.refreshSolutionSubscription.unsubscribe();
+    }
+    if (this.paperEvents !== null) {
+      this.paperEvents.close();
+    }
+    if (this.pdfObjectUrl !== null) {
+      URL.revokeObjectURL(this.pdfObjectUrl);
+    }
   }
 
   /*
@@ -86,12 +156,23 @@ export class SolutionPageComponent implements OnDestroy {
       () => {
         let parsedPaper = JSON.parse(jsonPaper);
         this.paperName = parsedPaper.title;
-        this.pdfSrc = this.apiService.makePDF(parsedPaper.pdf);
         this.paperId = parsedPaper.paper_id;
+        this.retrievePdf();
+        this.subscribeToPaperEvents();
       }
     );
   }
 
+  private retrievePdf() {
+    this.apiService.getPaperPdf(this.paperCode, this.paperYear).subscribe(
+      objectUrl => {
+        this.pdfObjectUrl = objectUrl;
+        this.pdfSrc = this.apiService.sanitizeResource(objectUrl);
+      },
+      error => console.log(error)
+    );
+  }
+
   private retrieveSolutions() {
     let jsonSolutions: string;
     this.apiService.getQuestions(this.paperCode, this.paperYear).subscribe(
@@ -109,11 +190,18 @@ export class SolutionPageComponent implements OnDestroy {
     });
   }
 
-  private makeAnswersFromJson(solution: Solution, jsonAnswers: string): void {
-    solution.answers = JSON.parse(jsonAnswers).map(parsedAnswer => {
+  private applyChangesFromJson(solution: Solution, jsonChanges: string): void {
+    let parsedChanges = JSON.parse(jsonChanges);
+    let changed = parsedChanges.answers.map(parsedAnswer => {
       return NewAnswerSubmission.makeAnswerFromJson(parsedAnswer);
     });
-    solution.resortAnswers();
+    if (solution.cursor === null) {
+      solution.answers = changed;
+      solution.resortAnswers();
+    } else {
+      solution.applyChanges(changed, parsedChanges.deleted);
+    }
+    solution.cursor = parsedChanges.cursor;
   }
 
   /*
@@ -130,13 +218,23 @@ export class SolutionPageComponent implements OnDestroy {
     }
   }
 
+  private refreshChangedSolution(questionId: number): void {
+    let solution = this.solutions.find(s => s.id === questionId);
+    if (solution !== undefined && !solution.hidden) {
+      this.refreshSolution(solution);
+    }
+  }
+
   private refreshSolution(solution: Solution) {
-    let jsonAnswers: string;
-    this.apiService.getAnswers(solution.id).subscribe(
-      jsonData => jsonAnswers = JSON.stringify(jsonData),
+    // Only answers changed since the last poll are sent, nothing if unchanged.
+    let jsonChanges: string = null;
+    this.apiService.getAnswerChanges(solution.id, solution.cursor).subscribe(
+      jsonData => jsonChanges = jsonData === null ? null : JSON.stringify(jsonData),
       error => console.log(error),
       () => {
-        this.makeAnswersFromJson(solution, jsonAnswers);
+        if (jsonChanges !== null) {
+          this.applyChangesFromJson(solution, jsonChanges);
+        }
       }
     );
   }